@@ -1,14 +1,45 @@
+from dataclasses import asdict, dataclass
+from datetime import datetime
 from typing import Optional
 
+import jwt
 from fastapi import Depends, HTTPException, Request
-from fastapi_users import BaseUserManager, FastAPIUsers, IntegerIDMixin
+from fastapi_users import BaseUserManager, FastAPIUsers, IntegerIDMixin, exceptions
 from fastapi_users.authentication import AuthenticationBackend, CookieTransport, JWTStrategy
 from fastapi_users.db import SQLAlchemyUserDatabase
+from fastapi_users.jwt import decode_jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .config import settings
 from .database import get_async_session
 from .models import User
+from .services.lru_cache import LRUCache
+
+# Active users resolved from auth tokens, by user id
+user_cache = LRUCache(settings.auth_user_cache_size, settings.auth_user_cache_ttl)
+
+
+@dataclass(frozen=True)
+class _UserSnapshot:
+    """The columns of a cached user; every request gets its own `User` from it"""
+
+    id: int
+    email: str
+    is_active: bool
+    is_superuser: bool
+    is_verified: bool
+    create_datetime: Optional[datetime]
+
+    @classmethod
+    def of(cls, user: User) -> "_UserSnapshot":
+        return cls(
+            user.id, user.email, user.is_active, user.is_superuser,
+            user.is_verified, user.create_datetime,
+        )
+
+    def to_user(self) -> User:
+        # Transient and never attached to a session: read-only by design
+        return User(**asdict(self))
 
 
 async def get_user_db(session: AsyncSession = Depends(get_async_session)):
@@ -27,6 +58,12 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
     ):
         print(f"User {user.id} forgot password. Reset token: {token}")
 
+    async def on_after_update(self, user: User, update_dict: dict, request: Optional[Request] = None):
+        invalidate_user(user.id)
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        invalidate_user(user.id)
+
 
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
     yield UserManager(user_db)
@@ -41,8 +78,42 @@ cookie_transport = CookieTransport(
 )
 
 
+class CachedJWTStrategy(JWTStrategy):
+    """JWTStrategy that skips the user lookup for recently seen active users.
+
+    The token is still verified on every request; only loading the `User`
+    row is cached, as an immutable snapshot rather than the ORM instance.
+    Changes made through `update_user` or the user manager evict the entry
+    right away, other workers pick them up once the entry's TTL runs out.
+    """
+
+    async def read_token(self, token: Optional[str], user_manager: BaseUserManager) -> Optional[User]:
+        if token is None:
+            return None
+        try:
+            data = decode_jwt(token, self.decode_key, self.token_audience, algorithms=[self.algorithm])
+            user_id = user_manager.parse_id(data["sub"])
+        except (jwt.PyJWTError, KeyError, exceptions.InvalidID):
+            return None
+
+        snapshot = user_cache.get(user_id)
+        if snapshot is not None:
+            return snapshot.to_user()
+        try:
+            user = await user_manager.get(user_id)
+        except exceptions.UserNotExists:
+            return None
+        if user.is_active:
+            user_cache.set(user_id, _UserSnapshot.of(user))
+        return user
+
+
+def invalidate_user(user_id: int) -> None:
+    user_cache.pop(user_id)
+
+
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(secret=settings.secret_key, lifetime_seconds=86400)
+    return CachedJWTStrategy(secret=settings.secret_key, lifetime_seconds=86400)
 
 
 auth_backend = AuthenticationBackend(
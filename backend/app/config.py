@@ -1,3 +1,5 @@
+from typing import Dict
+
 from pydantic_settings import BaseSettings
 
 
@@ -5,6 +7,70 @@ class Settings(BaseSettings):
     database_url: str = "sqlite+aiosqlite:///./app.db"
     secret_key: str = "PARTIALLY_AWARE_TEST_KEY"
 
+    # RAG embedding pipeline
+    rag_embed_batch_size: int = 32
+    rag_embed_concurrency: int = 4
+    rag_chunker: str = "structured"
+    rag_chunk_size: int = 128
+    rag_chunk_overlap: int = 16
+    rag_index_dir: str = "./rag_indexes"
+    rag_document_dir: str = "./rag_documents"
+    rag_ingest_workers: int = 1
+    # Seconds an indexing claim lasts without a heartbeat before another worker may take it over
+    rag_ingest_lease: float = 300
+    rag_cache_max_bytes: int = 1024 * 1024 * 1024
+    rag_embedding_cache_path: str = "./embedding_cache.sqlite3"
+    rag_embedding_cache_dtype: str = "float16"
+    rag_embedding_cache_max_entries: int = 500_000
+    rag_query_cache_size: int = 2048
+    rag_query_cache_ttl: float = 3600
+    rag_ivf_nprobe: int = 16
+    rag_hnsw_ef_search: int = 64
+    rag_hybrid_search: bool = True
+    rag_hybrid_candidates: int = 20
+    rag_rrf_k: int = 60
+    rag_mmr: bool = True
+    rag_mmr_candidates: int = 20
+    rag_mmr_lambda: float = 0.5
+
+    # Pooled HTTP clients for Ollama agents
+    ollama_max_connections: int = 100
+    ollama_max_keepalive_connections: int = 20
+    ollama_keepalive_expiry: float = 30
+    ollama_connect_timeout: float = 10
+    ollama_chat_timeout: float = 120
+    ollama_embed_timeout: float = 120
+    ollama_pull_timeout: float = 600
+    ollama_default_timeout: float = 30
+    ollama_health_timeout: float = 5
+    ollama_health_interval: float = 15
+    ollama_max_concurrent_requests: int = 4
+    ollama_max_queued_requests: int = 64
+    ollama_max_queued_per_user: int = 4
+    ollama_queue_timeout: float = 120
+
+    # Chat history sent to the model
+    chat_history_tokens: int = 3072
+    chat_history_tokens_by_model: Dict[str, int] = {}
+    chat_summary_enabled: bool = False
+    chat_write_batch_size: int = 64
+    chat_page_size: int = 100
+    chat_messages_page_size: int = 100
+    chat_response_cache_size: int = 1024
+    chat_response_cache_ttl: float = 3600
+
+    # Resolved users kept in memory so auth doesn't query the user table per request
+    auth_user_cache_size: int = 1024
+    auth_user_cache_ttl: float = 30
+
+    # Seconds between checks for system settings changed by other workers
+    system_settings_check_interval: float = 5
+
+    # Prometheus scrape endpoint at /metrics
+    metrics_enabled: bool = True
+    # Bearer token a scraper sends to /metrics; without one an admin session is required
+    metrics_token: str = ""
+
     model_config = {"env_file": ".env", "extra": "ignore"}
 
 
@@ -1,13 +1,19 @@
+import time
 from typing import AsyncGenerator
 
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from .config import settings
+from .services.metrics import db_session_duration
 
 engine = create_async_engine(settings.database_url)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    started = time.perf_counter()
     async with async_session_maker() as session:
-        yield session
+        try:
+            yield session
+        finally:
+            db_session_duration.observe(time.perf_counter() - started)
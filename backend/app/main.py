@@ -1,10 +1,38 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
 
 from .auth import auth_backend, fastapi_users
-from .routers import agent, rag, settings, users
+from .database import async_session_maker
+from .models import Agent
+from .config import settings as app_settings
+from .routers import agent, analytics, metrics, rag, settings, users
+from .services.agent_clients import agent_clients
+from .services.agent_pool import agent_pool
+from .services.ingestion import ingestion_queue
+from .services.message_writer import message_writer
+from .services.metrics import MetricsMiddleware
+from .services.system_settings import system_settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with async_session_maker() as db:
+        agent_clients.open((await db.execute(select(Agent.url))).scalars().all())
+        await system_settings.load(db)
+    await message_writer.start()
+    await ingestion_queue.start()
+    await agent_pool.start()
+    yield
+    await agent_pool.stop()
+    await ingestion_queue.stop()
+    await message_writer.stop()
+    await agent_clients.aclose()
 
-app = FastAPI(title="Partially Aware Assistant API")
+
+app = FastAPI(title="Partially Aware Assistant API", lifespan=lifespan)
 
 # ── CORS ─────────────────────────────────────────────────────────────────────
 # In production, serve the SvelteKit build as static files instead.
@@ -14,8 +42,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# ── Metrics ───────────────────────────────────────────────────────────────────
+if app_settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
 # ── Auth routes (fastapi-users) ───────────────────────────────────────────────
 app.include_router(
     fastapi_users.get_auth_router(auth_backend),
@@ -28,6 +61,9 @@ app.include_router(agent.router)
 app.include_router(settings.router)
 app.include_router(users.router)
 app.include_router(rag.router)
+app.include_router(analytics.router)
+if app_settings.metrics_enabled:
+    app.include_router(metrics.router)
 
 
 @app.get("/health")
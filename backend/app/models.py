@@ -1,15 +1,20 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Optional
 
 from fastapi_users.db import SQLAlchemyBaseUserTable
 from sqlalchemy import (
-    Boolean, DateTime, Integer, String, Text, ForeignKey,
+    BigInteger, Boolean, Date, DateTime, Float, Integer, String, Text, ForeignKey,
     UniqueConstraint, ForeignKeyConstraint
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 
 
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token) used to window chat history"""
+    return (len(text) + 3) // 4
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -130,6 +135,9 @@ class Chat(Base):
     kb_id: Mapped[Optional[int]] = mapped_column(
         Integer, ForeignKey("knowledge_base.id", ondelete="SET NULL"), nullable=True
     )
+    # Rolling summary of the messages up to and including summary_message_id
+    summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    summary_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     create_datetime: Mapped[datetime] = mapped_column(
         DateTime, nullable=False, server_default=func.now(), index=True
     )
@@ -158,8 +166,17 @@ class Message(Base):
     eval_count: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     eval_duration: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     model: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # Agent that generated an assistant reply (chats are routed across agents)
+    agent_id: Mapped[Optional[int]] = mapped_column(
+        Integer, ForeignKey("agent.id", name="fk_message_agent_id", ondelete="SET NULL"), nullable=True
+    )
     role: Mapped[str] = mapped_column(String(255), nullable=False)
     model_reasoning: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    token_count: Mapped[Optional[int]] = mapped_column(
+        Integer,
+        nullable=True,
+        default=lambda ctx: estimate_tokens(ctx.get_current_parameters()["message"]),
+    )
     create_datetime: Mapped[datetime] = mapped_column(
         DateTime, nullable=False, server_default=func.now(), index=True
     )
@@ -167,6 +184,41 @@ class Message(Base):
     chat: Mapped["Chat"] = relationship("Chat", back_populates="messages")
 
 
+class ModelStatsDaily(Base):
+    """Per agent/model/day rollup of the Ollama stats stored on messages"""
+    __tablename__ = "model_stats_daily"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    # 0 when the agent is unknown (or was deleted)
+    agent_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    model_name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    messages: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Durations are in nanoseconds, as reported by Ollama
+    total_duration_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    load_duration_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    cold_loads: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    prompt_eval_count_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    prompt_eval_count_max: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    eval_count_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    eval_duration_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+class ModelStatsBucket(Base):
+    """Histogram counts behind the percentiles of `ModelStatsDaily`"""
+    __tablename__ = "model_stats_bucket"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    agent_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    model_name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    # latency_ms | tokens_per_second | prompt_tokens
+    metric: Mapped[str] = mapped_column(String(20), primary_key=True)
+    bucket: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Smallest and largest value seen in the bucket; NULL on rows from before they were kept
+    min_value: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    max_value: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+
 class KnowledgeBase(Base):
     __tablename__ = "knowledge_base"
 
@@ -176,13 +228,24 @@ class KnowledgeBase(Base):
     )
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     document_filename: Mapped[str] = mapped_column(String(255), nullable=False)
-    document_content: Mapped[str] = mapped_column(Text, nullable=False)
     chunk_size: Mapped[Optional[int]] = mapped_column(Integer, default=500)
     chunk_overlap: Mapped[Optional[int]] = mapped_column(Integer, default=50)
+    # structured (sizes in tokens) | characters (sizes in characters)
+    chunker: Mapped[str] = mapped_column(
+        String(20), nullable=False, default="structured", server_default="structured"
+    )
     agent_id: Mapped[Optional[int]] = mapped_column(
         Integer, ForeignKey("agent.id", ondelete="CASCADE"), nullable=True
     )
     embedding_model: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # auto | flat | ivf_flat | hnsw | ivf_pq
+    index_type: Mapped[str] = mapped_column(
+        String(20), nullable=False, default="auto", server_default="auto"
+    )
+    # pending | indexing | ready | failed
+    index_status: Mapped[str] = mapped_column(
+        String(20), nullable=False, default="pending", server_default="pending"
+    )
     create_datetime: Mapped[datetime] = mapped_column(
         DateTime, nullable=False, server_default=func.now(), index=True
     )
@@ -191,3 +254,36 @@ class KnowledgeBase(Base):
     )
 
     user: Mapped["User"] = relationship("User", back_populates="knowledge_bases")
+
+
+class KnowledgeBaseDocument(Base):
+    __tablename__ = "knowledge_base_document"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kb_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("knowledge_base.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    filename: Mapped[str] = mapped_column(String(255), nullable=False)
+    # Document text lives in the content-addressed document store
+    content_sha256: Mapped[str] = mapped_column(String(64), nullable=False, index=True)
+    size_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+    create_datetime: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, server_default=func.now()
+    )
+
+
+class KnowledgeBaseChunk(Base):
+    """Maps a FAISS vector id to the span of the document it was embedded from"""
+    __tablename__ = "knowledge_base_chunk"
+
+    # Doubles as the vector id in the knowledge base's FAISS IndexIDMap
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kb_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("knowledge_base.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    document_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("knowledge_base_document.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    chunk_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    start_offset: Mapped[int] = mapped_column(Integer, nullable=False)
+    end_offset: Mapped[int] = mapped_column(Integer, nullable=False)
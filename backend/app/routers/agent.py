@@ -1,33 +1,47 @@
 import json
 from typing import Optional
 
-import httpx
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response
 from fastapi.responses import StreamingResponse
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from ..auth import current_active_user
+from ..config import settings
 from ..database import get_async_session
 from ..models import Agent, Chat, Message, Model, User
 from ..schemas import (
     ChatCreate, ChatDetail, ChatOut, MessageOut,
     SaveMessageRequest, SendMessageRequest
 )
+from ..services.agent_pool import agent_pool
+from ..services.chat_context import chat_context
+from ..services.chat_stream import is_cacheable, stream_chat
+from ..services.model_stats import model_stats
+from ..services.scheduler import QueueFull, agent_scheduler
 
 router = APIRouter(prefix="/api", tags=["chat"])
 
 
 @router.get("/chats", response_model=list[ChatOut])
 async def get_chats(
+    response: Response,
+    limit: int = Query(settings.chat_page_size, ge=1, le=500),
+    cursor: Optional[int] = None,
     user: User = Depends(current_active_user),
     db: AsyncSession = Depends(get_async_session),
 ):
-    result = await db.execute(
-        select(Chat).where(Chat.user_id == user.id).order_by(Chat.create_datetime.desc())
-    )
-    return result.scalars().all()
+    """Newest chats first. When more remain, X-Next-Cursor holds the cursor for the next page."""
+    query = select(Chat).where(Chat.user_id == user.id)
+    if cursor is not None:
+        query = query.where(Chat.id < cursor)
+    result = await db.execute(query.order_by(Chat.id.desc()).limit(limit + 1))
+    chats = result.scalars().all()
+    if len(chats) > limit:
+        chats = chats[:limit]
+        response.headers["X-Next-Cursor"] = str(chats[-1].id)
+    return chats
 
 
 @router.post("/chats", response_model=ChatOut)
@@ -51,6 +65,8 @@ async def create_chat(
 @router.get("/chats/{chat_id}", response_model=ChatDetail)
 async def get_chat(
     chat_id: int,
+    limit: int = Query(settings.chat_messages_page_size, ge=1, le=1000),
+    cursor: Optional[int] = None,
     user: User = Depends(current_active_user),
     db: AsyncSession = Depends(get_async_session),
 ):
@@ -58,13 +74,18 @@ async def get_chat(
     if not chat or chat.user_id != user.id:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    result = await db.execute(
-        select(Message)
-        .where(Message.chat_id == chat_id)
-        .order_by(Message.create_datetime)
-    )
+    # Latest `limit` messages, older than `cursor` when scrolling back
+    query = select(Message).where(Message.chat_id == chat_id)
+    if cursor is not None:
+        query = query.where(Message.id < cursor)
+    result = await db.execute(query.order_by(Message.id.desc()).limit(limit + 1))
     messages = result.scalars().all()
-    return {"chat": chat, "messages": messages}
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = messages[-1].id
+    messages.reverse()
+    return {"chat": chat, "messages": messages, "next_cursor": next_cursor}
 
 
 @router.delete("/chats/{chat_id}")
@@ -119,52 +140,67 @@ async def send_message(
     if not model:
         raise HTTPException(status_code=404, detail=f"Model {payload.model_name} not found")
 
-    # Get or create chat
+    # Existing chat must belong to the user; new chats are created once admitted
     if payload.chat_id:
         chat = await db.get(Chat, payload.chat_id)
         if not chat or chat.user_id != user.id:
             raise HTTPException(status_code=403, detail="Chat not found or access denied")
-    else:
-        chat = Chat(name="New chat", user_id=user.id)
-        db.add(chat)
+
+    # Any agent serving this model can answer; the chat's agent breaks ties.
+    # Take a place in the queue of the best one, or refuse when all are full.
+    agent_urls = await agent_pool.route(db, model.model_name, agent.url)
+    try:
+        ticket = agent_scheduler.admit(agent_urls, user.id)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    try:
+        if not payload.chat_id:
+            chat = Chat(name="New chat", user_id=user.id)
+            db.add(chat)
+            await db.commit()
+            await db.refresh(chat)
+
+        # Save user message
+        user_msg = Message(chat_id=chat.id, message=payload.message, role="user")
+        db.add(user_msg)
+
+        # Update chat agent/model/kb
+        chat.agent_id = agent.id
+        chat.model_name = model.model_name
+        chat.kb_id = payload.kb_id
         await db.commit()
-        await db.refresh(chat)
 
-    # Save user message
-    user_msg = Message(chat_id=chat.id, message=payload.message, role="user")
-    db.add(user_msg)
+        # Most recent history that fits the model's token budget
+        history, cutoff_id = await chat_context.build_history(db, chat)
+    except BaseException:
+        agent_scheduler.release(ticket)
+        raise
 
-    # Update chat agent/model/kb
-    chat.agent_id = agent.id
-    chat.model_name = model.model_name
-    chat.kb_id = payload.kb_id
-    await db.commit()
-
-    # Reconstruct history from DB
-    history_result = await db.execute(
-        select(Message)
-        .where(Message.chat_id == chat.id)
-        .order_by(Message.create_datetime)
-    )
-    history = [
-        {"role": m.role, "content": m.message}
-        for m in history_result.scalars().all()
-    ]
+    background = BackgroundTasks()
+    if chat_context.needs_summary(chat, cutoff_id):
+        background.add_task(
+            chat_context.update_summary, chat.id, agent.url, model.model_name, cutoff_id
+        )
 
-    ollama_url = f"{agent.url}/api/chat"
     ollama_payload = {"model": payload.model_name, "messages": history, "stream": True}
+    if payload.options:
+        ollama_payload["options"] = payload.options
     chat_id = chat.id
+    # Started now so the slot is used (and the reply saved) even if the client leaves early
+    lines = stream_chat(
+        ticket, agent_urls, ollama_payload, chat_id,
+        cacheable=is_cacheable(payload.options, payload.cache),
+    )
 
     async def generate():
         # Send chat_id first so the frontend can track/update this chat
         yield json.dumps({"type": "chat_id", "chat_id": chat_id}) + "\n"
-        async with httpx.AsyncClient(timeout=120) as client:
-            async with client.stream("POST", ollama_url, json=ollama_payload) as resp:
-                async for line in resp.aiter_lines():
-                    if line:
-                        yield line + "\n"
+        # The assistant reply is saved server-side once the stream finishes
+        async for line in lines:
+            yield line
 
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    return StreamingResponse(generate(), media_type="text/event-stream", background=background)
 
 
 @router.post("/chat/save_message", response_model=dict)
@@ -181,6 +217,8 @@ async def save_message(
         chat_id=payload.chat_id,
         message=payload.message,
         role="assistant",
+        model=chat.model_name,
+        agent_id=chat.agent_id,
         model_reasoning=payload.model_reasoning,
         total_duration=payload.total_duration,
         load_duration=payload.load_duration,
@@ -190,5 +228,6 @@ async def save_message(
         eval_duration=payload.eval_duration,
     )
     db.add(msg)
+    await model_stats.record(db, [msg])
     await db.commit()
     return {"success": True}
@@ -0,0 +1,37 @@
+from datetime import date
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth import require_admin
+from ..database import get_async_session
+from ..models import User
+from ..services.model_stats import model_stats
+
+router = APIRouter(prefix="/api/analytics", tags=["analytics"])
+
+
+@router.get("/models")
+async def model_analytics(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    agent_id: Optional[int] = None,
+    model_name: Optional[str] = None,
+    group_by: Literal["day", "total"] = "day",
+    user: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """Latency, tokens/sec, model loads and prompt sizes per agent/model (default: last 30 days)"""
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return await model_stats.report(db, start, end, agent_id, model_name, by_day=group_by == "day")
+
+
+@router.post("/models/rebuild")
+async def rebuild_model_analytics(
+    user: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """Recompute the rollup from the stored messages"""
+    return {"rows": await model_stats.rebuild(db)}
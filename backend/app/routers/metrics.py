@@ -0,0 +1,73 @@
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from ..auth import require_admin
+from ..config import settings
+from ..services.agent_pool import agent_pool
+from ..services.chat_stream import response_cache
+from ..services.embedding_cache import embedding_cache
+from ..services.index_cache import index_cache
+from ..services.ingestion import ingestion_queue
+from ..services.message_writer import message_writer
+from ..services.metrics import metrics
+from ..services.rag_service import query_embedding_cache
+from ..services.scheduler import agent_scheduler
+
+
+async def require_metrics_token(authorization: str = Header("")) -> None:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token, settings.metrics_token):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+
+# Samples include agent URLs and queue state, so scraping is never anonymous
+router = APIRouter(
+    tags=["metrics"],
+    dependencies=[Depends(require_metrics_token if settings.metrics_token else require_admin)],
+)
+
+
+@metrics.collector
+def _cache_samples():
+    caches = {
+        "index": index_cache.stats(),
+        "query_embedding": query_embedding_cache.stats(),
+        "response": response_cache.stats(),
+    }
+    if embedding_cache is not None:
+        caches["embedding"] = embedding_cache.stats()
+    for cache, stats in caches.items():
+        for result, key in (("hit", "hits"), ("miss", "misses")):
+            yield (
+                "cache_lookups_total", "counter", "Cache lookups by cache and result",
+                {"cache": cache, "result": result}, stats[key],
+            )
+        yield ("cache_entries", "gauge", "Entries held by each cache", {"cache": cache}, stats["entries"])
+
+
+@metrics.collector
+def _agent_samples():
+    for url, state in agent_scheduler.stats()["agents"].items():
+        yield ("ollama_requests_active", "gauge", "Requests running against an agent", {"agent": url}, state["active"])
+        yield ("ollama_requests_queued", "gauge", "Requests waiting for a slot on an agent", {"agent": url}, state["queued"])
+    for url, state in agent_pool.stats().items():
+        yield ("ollama_agent_healthy", "gauge", "1 if the agent passed its last health check", {"agent": url}, int(state["healthy"]))
+    yield ("ollama_requests_rejected_total", "counter", "Requests refused with 429", {}, agent_scheduler.rejected)
+
+
+@metrics.collector
+def _background_samples():
+    writer = message_writer.stats()
+    yield ("chat_message_writes_queued", "gauge", "Assistant messages waiting to be saved", {}, writer["queued"])
+    yield ("chat_message_write_batches_total", "counter", "Transactions used to save assistant messages", {}, writer["batches"])
+    yield (
+        "rag_ingestion_jobs_pending", "gauge", "Knowledge bases waiting for or being indexed",
+        {}, ingestion_queue.pending(),
+    )
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
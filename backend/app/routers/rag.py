@@ -1,24 +1,48 @@
+import asyncio
 import json
-from typing import Dict, Tuple
+from typing import Optional
 
 import httpx
-import requests
 from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
 from fastapi.responses import StreamingResponse
-from sqlalchemy import select
+from sqlalchemy import delete, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from werkzeug.utils import secure_filename
 
-from ..auth import current_active_user
-from ..database import get_async_session
-from ..models import Agent, Chat, KnowledgeBase, Message, Model, User
-from ..schemas import KnowledgeBaseOut, RAGQueryRequest
-from ..services.rag_service import RAGService
+from ..auth import current_active_user, require_admin
+from ..config import settings
+from ..database import async_session_maker, get_async_session
+from ..models import (
+    Agent, Chat, KnowledgeBase, KnowledgeBaseChunk, KnowledgeBaseDocument,
+    Message, Model, User,
+)
+from ..schemas import (
+    IngestionStatusOut, KnowledgeBaseDocumentOut, KnowledgeBaseOut, RAGQueryRequest,
+)
+from ..services.agent_pool import agent_pool
+from ..services.chat_stream import is_cacheable, response_cache, stream_chat
+from ..services.chunking import CHUNKERS
+from ..services.document_store import SpooledUpload, document_store
+from ..services.embedding_cache import embedding_cache
+from ..services.faiss_index import INDEX_TYPES
+from ..services.index_cache import index_cache
+from ..services.index_store import index_store
+from ..services.ingestion import ingestion_queue
+from ..services.rag_service import AsyncRAGService, query_embedding_cache
+from ..services.scheduler import QueueFull, agent_scheduler
+from ..services.system_settings import system_settings
 
 router = APIRouter(prefix="/api/rag", tags=["rag"])
 
-# In-memory cache: (user_id, kb_id) -> RAGService
-_rag_services: Dict[Tuple[int, int], RAGService] = {}
+
+@router.get("/cache/stats")
+async def rag_cache_stats(user: User = Depends(require_admin)):
+    return {
+        "indexes": index_cache.stats(),
+        "queries": query_embedding_cache.stats(),
+        "responses": response_cache.stats(),
+        "embeddings": await asyncio.to_thread(embedding_cache.stats) if embedding_cache else None,
+    }
 
 
 @router.get("/knowledge_bases", response_model=list[KnowledgeBaseOut])
@@ -39,6 +63,10 @@ async def upload_knowledge_base(
     name: str = Form(...),
     agent_id: int = Form(...),
     embedding_model: str = Form(...),
+    index_type: str = Form("auto"),
+    chunker: str = Form(settings.rag_chunker),
+    chunk_size: Optional[int] = Form(None),
+    chunk_overlap: Optional[int] = Form(None),
     file: UploadFile = File(...),
     user: User = Depends(current_active_user),
     db: AsyncSession = Depends(get_async_session),
@@ -46,32 +74,213 @@ async def upload_knowledge_base(
     agent = await db.get(Agent, agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
-
-    try:
-        content = (await file.read()).decode("utf-8")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading file: {e}")
+    if index_type not in INDEX_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown index type: {index_type}")
+    if chunker not in CHUNKERS:
+        raise HTTPException(status_code=400, detail=f"Unknown chunker: {chunker}")
+    # Structured chunks are sized in tokens, character chunks in characters
+    if chunk_size is None:
+        chunk_size = settings.rag_chunk_size if chunker == "structured" else 500
+    if chunk_overlap is None:
+        chunk_overlap = settings.rag_chunk_overlap if chunker == "structured" else 50
+    if chunk_size < 16 or not 0 <= chunk_overlap < chunk_size:
+        raise HTTPException(status_code=400, detail="chunk_size must be at least 16 and chunk_overlap below it")
 
     filename = secure_filename(file.filename or "upload.txt")
+    upload = await _spool_upload(file)
 
     kb = KnowledgeBase(
         user_id=user.id,
         name=name,
         document_filename=filename,
-        document_content=content,
-        chunk_size=500,
-        chunk_overlap=50,
+        chunker=chunker,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
         agent_id=agent_id,
         embedding_model=embedding_model,
+        index_type=index_type,
     )
     db.add(kb)
+    async with document_store.lock(upload.sha256):
+        await asyncio.to_thread(document_store.put, upload)
+        try:
+            await db.flush()
+            db.add(_document_from_upload(kb.id, filename, upload))
+            await db.commit()
+            await db.refresh(kb)
+        except Exception as e:
+            await db.rollback()
+            await _abandon_upload(upload)
+            raise HTTPException(status_code=400, detail=str(e))
+        await asyncio.to_thread(document_store.commit, upload)
+    ingestion_queue.enqueue(kb.id)
+    return kb
+
+
+async def _spool_upload(file: UploadFile) -> SpooledUpload:
     try:
-        await db.commit()
-        await db.refresh(kb)
+        upload = await document_store.spool(file)
     except Exception as e:
-        await db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    return kb
+        raise HTTPException(status_code=400, detail=f"Error reading file: {e}")
+    return upload
+
+
+def _document_from_upload(kb_id: int, filename: str, upload: SpooledUpload) -> KnowledgeBaseDocument:
+    return KnowledgeBaseDocument(
+        kb_id=kb_id, filename=filename, content_sha256=upload.sha256, size_bytes=upload.size
+    )
+
+
+async def _abandon_upload(upload: SpooledUpload) -> None:
+    """Drop an upload whose document was not committed; the caller holds its blob lock"""
+    await asyncio.to_thread(document_store.discard, upload)
+    await _release_blob(upload.sha256)
+
+
+async def _release_blobs(shas) -> None:
+    """Delete document blobs no longer referenced by any document"""
+    for sha in set(shas):
+        async with document_store.lock(sha):
+            await _release_blob(sha)
+
+
+async def _release_blob(sha: str) -> None:
+    if await _blob_in_use(sha):
+        return
+    detached = await asyncio.to_thread(document_store.detach, sha)
+    if detached is None:
+        return
+    # Another process may have committed a document with this blob since the check
+    if await _blob_in_use(sha):
+        await asyncio.to_thread(document_store.commit, detached)
+    else:
+        await asyncio.to_thread(document_store.discard, detached)
+
+
+async def _blob_in_use(sha: str) -> bool:
+    # A fresh session each time, so the second check is not read from the first one's snapshot
+    async with async_session_maker() as db:
+        return await db.scalar(
+            select(KnowledgeBaseDocument.id).where(KnowledgeBaseDocument.content_sha256 == sha).limit(1)
+        ) is not None
+
+
+@router.get("/{kb_id}/documents", response_model=list[KnowledgeBaseDocumentOut])
+async def list_documents(
+    kb_id: int,
+    user: User = Depends(current_active_user),
+    db: AsyncSession = Depends(get_async_session),
+):
+    kb = await db.get(KnowledgeBase, kb_id)
+    if not kb or kb.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+
+    chunk_counts = (
+        select(KnowledgeBaseChunk.document_id, func.count().label("chunk_count"))
+        .where(KnowledgeBaseChunk.kb_id == kb_id)
+        .group_by(KnowledgeBaseChunk.document_id)
+        .subquery()
+    )
+    result = await db.execute(
+        select(
+            KnowledgeBaseDocument.id,
+            KnowledgeBaseDocument.kb_id,
+            KnowledgeBaseDocument.filename,
+            KnowledgeBaseDocument.size_bytes,
+            KnowledgeBaseDocument.create_datetime,
+            func.coalesce(chunk_counts.c.chunk_count, 0).label("chunk_count"),
+        )
+        .outerjoin(chunk_counts, chunk_counts.c.document_id == KnowledgeBaseDocument.id)
+        .where(KnowledgeBaseDocument.kb_id == kb_id)
+        .order_by(KnowledgeBaseDocument.id)
+    )
+    return result.mappings().all()
+
+
+@router.post("/{kb_id}/documents", response_model=KnowledgeBaseDocumentOut)
+async def add_document(
+    kb_id: int,
+    file: UploadFile = File(...),
+    user: User = Depends(current_active_user),
+    db: AsyncSession = Depends(get_async_session),
+):
+    kb = await db.get(KnowledgeBase, kb_id)
+    if not kb or kb.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+
+    filename = secure_filename(file.filename or "upload.txt")
+    upload = await _spool_upload(file)
+    document = _document_from_upload(kb_id, filename, upload)
+    async with document_store.lock(upload.sha256):
+        await asyncio.to_thread(document_store.put, upload)
+        db.add(document)
+        await _mark_pending(db, kb_id)
+        try:
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            await _abandon_upload(upload)
+            raise HTTPException(status_code=400, detail=str(e))
+        await asyncio.to_thread(document_store.commit, upload)
+    await db.refresh(document)
+    # Only the new document's chunks are embedded and added to the index
+    ingestion_queue.enqueue(kb_id)
+    return document
+
+
+@router.delete("/{kb_id}/documents/{document_id}")
+async def delete_document(
+    kb_id: int,
+    document_id: int,
+    user: User = Depends(current_active_user),
+    db: AsyncSession = Depends(get_async_session),
+):
+    kb = await db.get(KnowledgeBase, kb_id)
+    if not kb or kb.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    document = await db.get(KnowledgeBaseDocument, document_id)
+    if not document or document.kb_id != kb_id:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    await db.execute(delete(KnowledgeBaseChunk).where(KnowledgeBaseChunk.document_id == document_id))
+    await db.delete(document)
+    await _mark_pending(db, kb_id)
+    await db.commit()
+    await _release_blobs([document.content_sha256])
+    # The worker drops this document's vectors from the stored index
+    ingestion_queue.enqueue(kb_id)
+    return {"success": True}
+
+
+async def _mark_pending(db: AsyncSession, kb_id: int) -> None:
+    # A running sync stays claimed; it notices the changed documents when it finishes
+    await db.execute(
+        update(KnowledgeBase)
+        .where(KnowledgeBase.id == kb_id, KnowledgeBase.index_status != "indexing")
+        .values(index_status="pending")
+    )
+
+
+@router.get("/{kb_id}/status", response_model=IngestionStatusOut)
+async def knowledge_base_status(
+    kb_id: int,
+    user: User = Depends(current_active_user),
+    db: AsyncSession = Depends(get_async_session),
+):
+    kb = await db.get(KnowledgeBase, kb_id)
+    if not kb or kb.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+
+    job = ingestion_queue.get(kb_id)
+    if not job:
+        return IngestionStatusOut(kb_id=kb_id, status=kb.index_status)
+    return IngestionStatusOut(
+        kb_id=kb_id,
+        status=job.status,
+        chunks_done=job.chunks_done,
+        chunks_total=job.chunks_total,
+        error=job.error,
+    )
 
 
 @router.post("/query")
@@ -101,73 +310,98 @@ async def rag_query(
     if not kn_agent:
         raise HTTPException(status_code=404, detail="Knowledge base agent not found")
 
-    # Get or create chat record
+    # Load the index built by the ingestion worker. While documents are being
+    # added or removed the previously stored index keeps serving queries.
+    embedding_model = kb.embedding_model or "nomic-embed-text"
+    store_key = index_store.key(
+        embedding_model, kb.chunk_size or 500, kb.chunk_overlap or 50, kb.index_type, kb.chunker
+    )
+    # Another process may have re-saved the index since it was cached
+    version = index_store.version(kb.id, store_key)
+    service = index_cache.get(kb.id, version)
+    if service is None:
+        service = AsyncRAGService(kn_agent.url, embedding_model, kb.index_type)
+        if not await asyncio.to_thread(index_store.load, kb.id, store_key, service):
+            if kb.index_status != "ready":
+                raise HTTPException(status_code=409, detail=f"Knowledge base is not ready ({kb.index_status})")
+            # Index files are gone; rebuild in the background
+            kb.index_status = "pending"
+            await db.commit()
+            ingestion_queue.enqueue(kb.id)
+            raise HTTPException(status_code=409, detail="Knowledge base is being re-indexed")
+        index_cache.put(kb.id, service, version)
+
+    # Existing chat must belong to the user; new chats are created once admitted
     if payload.chat_id:
         chat = await db.get(Chat, payload.chat_id)
         if not chat or chat.user_id != user.id:
             raise HTTPException(status_code=403, detail="Chat not found or access denied")
-    else:
-        chat = Chat(
-            name=payload.query[:50],
-            user_id=user.id,
-            agent_id=payload.agent_id,
-            model_name=payload.model_name,
-            kb_id=payload.kb_id,
-        )
-        db.add(chat)
-        await db.commit()
-        await db.refresh(chat)
-
-    # Save user message and update chat metadata
-    user_msg = Message(chat_id=chat.id, message=payload.query, role="user")
-    db.add(user_msg)
-    chat.agent_id = payload.agent_id
-    chat.model_name = payload.model_name
-    chat.kb_id = payload.kb_id
-    await db.commit()
-
-    chat_id = chat.id
-
-    # Get RAG system prompt
-    from sqlalchemy import select as sa_select
-    from ..models import SystemSettings
-    settings_result = await db.execute(
-        sa_select(SystemSettings)
-        .where(SystemSettings.active.is_(True))
-        .order_by(SystemSettings.update_datetime.desc(), SystemSettings.id.desc())
-    )
-    settings_rows = settings_result.scalars().all()
-    rag_prompt = next(
-        (s.setting_value for s in settings_rows if s.setting_name == "rag_prompt"), ""
-    )
 
-    # Build or retrieve RAG service (sync, runs in thread)
-    service_key = (user.id, payload.kb_id)
-    if service_key not in _rag_services:
-        service = RAGService(kn_agent.url, kb.embedding_model or "nomic-embed-text")
-        chunks = service.chunk_text(kb.document_content, kb.chunk_size or 500, kb.chunk_overlap or 50)
-        if not chunks:
-            raise HTTPException(status_code=400, detail="Document is empty or could not be chunked")
-        service.build_index(chunks)
-        _rag_services[service_key] = service
-    else:
-        service = _rag_services[service_key]
+    # Pick the best agent for the model, or refuse when all are full. Its
+    # queue is only joined after retrieval: a chat slot held while the query
+    # embedding waits for a slot of its own could deadlock the agent.
+    agent_urls = await agent_pool.route(db, payload.model_name, agent.url)
+    try:
+        agent_url = agent_scheduler.pick(agent_urls, user.id)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
 
     try:
-        relevant_chunks = service.retrieve(payload.query, k=3)
-        chunk_texts = [c[0] for c in relevant_chunks]
-        augmented_prompt = service.augment_prompt(payload.query, chunk_texts, rag_prompt)
-    except requests.exceptions.RequestException as e:
+        relevant_chunks = await service.retrieve(
+            payload.query, k=3, nprobe=payload.nprobe, ef_search=payload.ef_search,
+            user_id=user.id, hybrid=payload.hybrid, mmr=payload.mmr,
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Ollama connection error: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"RAG error: {e}")
 
-    ollama_url = f"{agent.url}/api/chat"
+    ticket = agent_scheduler.enqueue(agent_url, user.id)
+    try:
+        if not payload.chat_id:
+            chat = Chat(
+                name=payload.query[:50],
+                user_id=user.id,
+                agent_id=payload.agent_id,
+                model_name=payload.model_name,
+                kb_id=payload.kb_id,
+            )
+            db.add(chat)
+            await db.commit()
+            await db.refresh(chat)
+
+        # Save user message and update chat metadata
+        user_msg = Message(chat_id=chat.id, message=payload.query, role="user")
+        db.add(user_msg)
+        chat.agent_id = payload.agent_id
+        chat.model_name = payload.model_name
+        chat.kb_id = payload.kb_id
+        await db.commit()
+
+        chat_id = chat.id
+
+        rag_prompt = await system_settings.get(db, "rag_prompt", "")
+    except BaseException:
+        agent_scheduler.release(ticket)
+        raise
+
+    chunk_texts = [c[0] for c in relevant_chunks]
+    augmented_prompt = service.augment_prompt(payload.query, chunk_texts, rag_prompt)
+
     ollama_payload = {
         "model": payload.model_name,
         "messages": [{"role": "user", "content": augmented_prompt}],
         "stream": True,
     }
+    if payload.options:
+        ollama_payload["options"] = payload.options
+    # Started now so the slot is used (and the reply saved) even if the client leaves early
+    lines = stream_chat(
+        ticket, agent_urls, ollama_payload, chat_id,
+        cacheable=is_cacheable(payload.options, payload.cache),
+    )
 
     async def generate():
         # Send chat_id first so the frontend can track this chat
@@ -181,15 +415,8 @@ async def rag_query(
         }
         yield json.dumps(metadata) + "\n"
 
-        async with httpx.AsyncClient(timeout=120) as client:
-            async with client.stream("POST", ollama_url, json=ollama_payload) as resp:
-                if resp.status_code != 200:
-                    error_text = await resp.aread()
-                    yield json.dumps({"error": f"Ollama error {resp.status_code}: {error_text.decode()}"}) + "\n"
-                    return
-                async for line in resp.aiter_lines():
-                    if line:
-                        yield line + "\n"
+        async for line in lines:
+            yield line
 
     return StreamingResponse(generate(), media_type="text/event-stream")
 
@@ -207,9 +434,16 @@ async def delete_knowledge_base(
         raise HTTPException(status_code=403, detail="Unauthorized")
 
     # Clear from cache
-    service_key = (user.id, kb_id)
-    _rag_services.pop(service_key, None)
+    index_cache.pop(kb_id)
+    ingestion_queue.discard(kb_id)
+    await asyncio.to_thread(index_store.delete, kb_id)
 
+    shas = (await db.execute(
+        select(KnowledgeBaseDocument.content_sha256).where(KnowledgeBaseDocument.kb_id == kb_id)
+    )).scalars().all()
+    await db.execute(delete(KnowledgeBaseChunk).where(KnowledgeBaseChunk.kb_id == kb_id))
+    await db.execute(delete(KnowledgeBaseDocument).where(KnowledgeBaseDocument.kb_id == kb_id))
     await db.delete(kb)
     await db.commit()
+    await _release_blobs(shas)
     return {"success": True}
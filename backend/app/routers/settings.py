@@ -1,4 +1,3 @@
-import httpx
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from sqlalchemy import select
@@ -12,6 +11,10 @@ from ..schemas import (
     AddModelRequest, AddTagRequest, AgentCreate, AgentOut,
     ModelOut, SystemSettingsOut, SystemSettingsUpdate,
 )
+from ..services.agent_clients import agent_clients
+from ..services.agent_pool import agent_pool
+from ..services.scheduler import agent_scheduler
+from ..services.system_settings import system_settings
 
 router = APIRouter(prefix="/api", tags=["settings"])
 
@@ -42,6 +45,15 @@ async def create_agent(
     return agent
 
 
+@router.get("/agents/pool/stats")
+async def agent_pool_stats(user: User = Depends(require_admin)):
+    return {
+        **agent_clients.stats(),
+        "routing": agent_pool.stats(),
+        "scheduler": agent_scheduler.stats(),
+    }
+
+
 @router.get("/agents/{agent_id}", response_model=AgentOut)
 async def get_agent(
     agent_id: int,
@@ -118,13 +130,14 @@ async def pull_model(
         raise HTTPException(status_code=404, detail="Agent not found")
 
     async def generate():
-        async with httpx.AsyncClient(timeout=600) as client:
-            async with client.stream(
-                "POST", f"{agent.url}/api/pull", json={"model": model_name}
-            ) as resp:
-                async for line in resp.aiter_lines():
-                    if line:
-                        yield f"data: {line}\n\n"
+        client = agent_clients.get(agent.url)
+        async with client.stream(
+            "POST", f"{agent.url}/api/pull", json={"model": model_name},
+            timeout=agent_clients.timeout("pull"),
+        ) as resp:
+            async for line in resp.aiter_lines():
+                if line:
+                    yield f"data: {line}\n\n"
 
     return StreamingResponse(generate(), media_type="text/event-stream")
 
@@ -134,21 +147,7 @@ async def get_system_settings(
     user: User = Depends(current_active_user),
     db: AsyncSession = Depends(get_async_session),
 ):
-    result = await db.execute(
-        select(SystemSettings)
-        .where(SystemSettings.active.is_(True))
-        .order_by(
-            SystemSettings.setting_name,
-            SystemSettings.update_datetime.desc(),
-            SystemSettings.id.desc(),
-        )
-    )
-    settings_rows = result.scalars().all()
-    latest: dict = {}
-    for row in settings_rows:
-        if row.setting_name not in latest:
-            latest[row.setting_name] = row.setting_value
-    return SystemSettingsOut(rag_prompt=latest.get("rag_prompt"))
+    return SystemSettingsOut(**await system_settings.all(db))
 
 
 @router.post("/system/settings", response_model=SystemSettingsOut)
@@ -157,22 +156,21 @@ async def update_system_settings(
     user: User = Depends(require_admin),
     db: AsyncSession = Depends(get_async_session),
 ):
-    # Deactivate all existing rag_prompt settings
+    values = payload.model_dump(exclude_none=True)
+    # Deactivate the settings being replaced
     result = await db.execute(
         select(SystemSettings).where(
-            SystemSettings.setting_name == "rag_prompt",
+            SystemSettings.setting_name.in_(values),
             SystemSettings.active.is_(True),
         )
     )
     for row in result.scalars().all():
         row.active = False
 
-    new_setting = SystemSettings(
-        user_id=user.id,
-        setting_name="rag_prompt",
-        setting_value=payload.rag_prompt,
-        active=True,
-    )
-    db.add(new_setting)
+    db.add_all([
+        SystemSettings(user_id=user.id, setting_name=name, setting_value=value, active=True)
+        for name, value in values.items()
+    ])
     await db.commit()
-    return SystemSettingsOut(rag_prompt=payload.rag_prompt)
+    await system_settings.load(db)
+    return SystemSettingsOut(**await system_settings.all(db))
@@ -3,7 +3,7 @@ from fastapi_users.password import PasswordHelper
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..auth import current_active_user, require_admin
+from ..auth import current_active_user, invalidate_user, require_admin
 from ..database import get_async_session
 from ..models import User
 from ..schemas import UserAdminCreate, UserRead, UserUpdateRequest
@@ -95,5 +95,6 @@ async def update_user(
     if payload.is_active is not None:
         target.is_active = payload.is_active
     await db.commit()
+    invalidate_user(target.id)
     await db.refresh(target)
     return target
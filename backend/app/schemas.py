@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from fastapi_users import schemas
 from pydantic import BaseModel
@@ -113,6 +113,7 @@ class MessageOut(BaseModel):
 class ChatDetail(BaseModel):
     chat: ChatOut
     messages: List[MessageOut]
+    next_cursor: Optional[int] = None  # pass as `cursor` to load older messages
 
 
 class SendMessageRequest(BaseModel):
@@ -121,6 +122,10 @@ class SendMessageRequest(BaseModel):
     model_name: str
     message: str
     kb_id: Optional[int] = None
+    # Ollama generation options (temperature, seed, ...)
+    options: Optional[Dict[str, Any]] = None
+    # Reuse an identical earlier reply; implied by temperature 0
+    cache: bool = False
 
 
 class SaveMessageRequest(BaseModel):
@@ -153,16 +158,47 @@ class KnowledgeBaseOut(BaseModel):
     document_filename: str
     agent_id: Optional[int] = None
     embedding_model: Optional[str] = None
+    chunker: str = "structured"
     chunk_size: Optional[int] = None
     chunk_overlap: Optional[int] = None
+    index_type: str = "auto"
+    index_status: str = "pending"
     create_datetime: datetime
 
     model_config = {"from_attributes": True}
 
 
+class KnowledgeBaseDocumentOut(BaseModel):
+    id: int
+    kb_id: int
+    filename: str
+    size_bytes: int
+    chunk_count: int = 0
+    create_datetime: datetime
+
+    model_config = {"from_attributes": True}
+
+
+class IngestionStatusOut(BaseModel):
+    kb_id: int
+    status: str
+    chunks_done: int = 0
+    chunks_total: int = 0
+    error: Optional[str] = None
+
+
 class RAGQueryRequest(BaseModel):
     chat_id: Optional[int] = None
     kb_id: int
     agent_id: int
     model_name: str
     query: str
+    # Search-time recall/latency knobs for IVF and HNSW indexes
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    # Fuse BM25 keyword matches into the results; defaults to RAG_HYBRID_SEARCH
+    hybrid: Optional[bool] = None
+    # Drop near-duplicate chunks by MMR re-ranking; defaults to RAG_MMR
+    mmr: Optional[bool] = None
+    options: Optional[Dict[str, Any]] = None
+    cache: bool = False
@@ -0,0 +1,103 @@
+from typing import Dict
+
+import httpx
+
+from ..config import settings
+
+# Read timeouts per kind of Ollama call. For streamed calls the read timeout
+# bounds the gap between two chunks, not the whole response.
+OPERATION_TIMEOUTS = {
+    "chat": lambda: settings.ollama_chat_timeout,
+    "embed": lambda: settings.ollama_embed_timeout,
+    "pull": lambda: settings.ollama_pull_timeout,
+    "health": lambda: settings.ollama_health_timeout,
+    "default": lambda: settings.ollama_default_timeout,
+}
+
+
+def _normalize(agent_url: str) -> str:
+    return agent_url.rstrip("/")
+
+
+class AgentClientRegistry:
+    """Pooled HTTP clients for Ollama agents, one per `Agent.url`.
+
+    Connections to an agent are kept alive and reused across requests, so
+    chats, embeddings and pulls don't pay TCP setup on every call.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30,
+        connect_timeout: float = 10,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.connect_timeout = connect_timeout
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._requests: Dict[str, int] = {}
+
+    def timeout(self, operation: str = "default") -> httpx.Timeout:
+        read = OPERATION_TIMEOUTS.get(operation, OPERATION_TIMEOUTS["default"])()
+        return httpx.Timeout(read, connect=self.connect_timeout)
+
+    def get(self, agent_url: str) -> httpx.AsyncClient:
+        """Async client for an agent, created on first use"""
+        key = _normalize(agent_url)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            async def count_request(request: httpx.Request) -> None:
+                self._requests[key] = self._requests.get(key, 0) + 1
+
+            client = httpx.AsyncClient(
+                base_url=key,
+                limits=self.limits,
+                timeout=self.timeout(),
+                event_hooks={"request": [count_request]},
+            )
+            self._clients[key] = client
+        return client
+
+    def open(self, agent_urls) -> None:
+        """Create clients for known agents up front"""
+        for url in agent_urls:
+            self.get(url)
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def stats(self) -> dict:
+        agents = {}
+        for key, client in self._clients.items():
+            # httpx exposes no public pool introspection; read httpcore's pool
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+            idle = sum(1 for c in connections if c.is_idle())
+            agents[key] = {
+                "requests": self._requests.get(key, 0),
+                "connections": len(connections),
+                "idle": idle,
+                "active": len(connections) - idle,
+                "closed": client.is_closed,
+            }
+        return {
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "agents": agents,
+        }
+
+
+agent_clients = AgentClientRegistry(
+    max_connections=settings.ollama_max_connections,
+    max_keepalive_connections=settings.ollama_max_keepalive_connections,
+    keepalive_expiry=settings.ollama_keepalive_expiry,
+    connect_timeout=settings.ollama_connect_timeout,
+)
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import httpx
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import async_session_maker
+from ..models import Agent, Model
+from .agent_clients import agent_clients
+from .scheduler import agent_scheduler
+
+
+@dataclass
+class AgentState:
+    url: str
+    healthy: bool = True
+    in_flight: int = 0
+    requests: int = 0
+    failures: int = 0
+    # Exponentially weighted generation speed, from Ollama's eval stats
+    tokens_per_second: Optional[float] = None
+    last_error: Optional[str] = None
+    checked_at: Optional[float] = None
+
+
+class AgentPool:
+    """Routes generation requests across every agent that serves a model.
+
+    Agents with a `Model` row of the same name form a pool. Each request
+    goes to the healthy agent expected to finish it soonest, judged by its
+    running and queued requests and observed tokens/sec; the rest are kept as
+    failover candidates. A background task probes every agent periodically
+    and brings failed ones back when they answer again.
+    """
+
+    def __init__(self, health_interval: float = 15, smoothing: float = 0.3):
+        self.health_interval = health_interval
+        self.smoothing = smoothing
+        self._agents: Dict[str, AgentState] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def state(self, url: str) -> AgentState:
+        url = url.rstrip("/")
+        state = self._agents.get(url)
+        if state is None:
+            state = self._agents[url] = AgentState(url)
+        return state
+
+    async def route(self, db: AsyncSession, model_name: str, preferred_url: str) -> List[str]:
+        """Agent URLs serving `model_name`, best first"""
+        result = await db.execute(
+            select(Agent.url).join(Model, Model.agent_id == Agent.id).where(Model.model_name == model_name)
+        )
+        urls = list(dict.fromkeys([preferred_url, *result.scalars().all()]))
+        return self.rank(urls, preferred_url)
+
+    def rank(self, urls: List[str], preferred_url: Optional[str] = None) -> List[str]:
+        states = [self.state(url) for url in urls]
+        known = [s.tokens_per_second for s in states if s.tokens_per_second]
+        # Agents without measurements yet are assumed to be average
+        default_tps = sum(known) / len(known) if known else 1.0
+
+        def expected_wait(state: AgentState) -> tuple:
+            tps = state.tokens_per_second or default_tps
+            return (
+                not state.healthy,
+                (agent_scheduler.load(state.url) + 1) / tps,
+                state.url != (preferred_url or "").rstrip("/"),
+                state.requests,
+            )
+
+        return [state.url for state in sorted(states, key=expected_wait)]
+
+    def begin(self, url: str) -> None:
+        state = self.state(url)
+        state.in_flight += 1
+        state.requests += 1
+
+    def end(self, url: str, final: Optional[dict] = None) -> None:
+        state = self.state(url)
+        state.in_flight = max(0, state.in_flight - 1)
+        if final and final.get("eval_count") and final.get("eval_duration"):
+            tps = final["eval_count"] / (final["eval_duration"] / 1e9)
+            if state.tokens_per_second is None:
+                state.tokens_per_second = tps
+            else:
+                state.tokens_per_second += self.smoothing * (tps - state.tokens_per_second)
+
+    def fail(self, url: str, error: str, unreachable: bool = True) -> None:
+        state = self.state(url)
+        state.failures += 1
+        state.last_error = error
+        if unreachable:
+            state.healthy = False
+
+    async def start(self) -> None:
+        if self.health_interval > 0:
+            self._task = asyncio.create_task(self._health_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def check(self, url: str) -> bool:
+        state = self.state(url)
+        try:
+            response = await agent_clients.get(url).get(
+                f"{state.url}/api/version", timeout=agent_clients.timeout("health")
+            )
+            response.raise_for_status()
+            state.healthy, state.last_error = True, None
+        except httpx.HTTPError as e:
+            state.healthy, state.last_error = False, str(e) or type(e).__name__
+        state.checked_at = time.time()
+        return state.healthy
+
+    async def _health_loop(self) -> None:
+        while True:
+            try:
+                async with async_session_maker() as db:
+                    urls = (await db.execute(select(Agent.url))).scalars().all()
+                await asyncio.gather(*(self.check(url) for url in urls))
+            except Exception:
+                pass
+            await asyncio.sleep(self.health_interval)
+
+    def stats(self) -> dict:
+        return {
+            url: {
+                "healthy": s.healthy,
+                "in_flight": s.in_flight,
+                "requests": s.requests,
+                "failures": s.failures,
+                "tokens_per_second": round(s.tokens_per_second, 2) if s.tokens_per_second else None,
+                "last_error": s.last_error,
+                "checked_at": s.checked_at,
+            }
+            for url, s in self._agents.items()
+        }
+
+
+agent_pool = AgentPool(settings.ollama_health_interval)
@@ -0,0 +1,176 @@
+import re
+from array import array
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+# Words, plus identifiers joined by - . / : (error codes, part numbers,
+# versions), which are indexed both whole and as their parts
+_TOKEN = re.compile(r"\w+(?:[-./:]\w+)*")
+_PART = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = _TOKEN.findall(text.lower())
+    for token in [t for t in tokens if not t.isalnum()]:
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over a knowledge base's chunks, addressed by chunk id.
+
+    Postings are kept in CSR form: for term `t`, documents
+    `rows[offsets[t]:offsets[t + 1]]` contain it `tfs[...]` times, where a
+    row indexes `ids`/`lengths`. A query touches only the postings of its
+    terms and scores them with NumPy, so it stays in the low milliseconds
+    on 100k-chunk knowledge bases. Adding chunks sorts only the new
+    postings and merges them in; removing chunks filters the existing ones.
+    Neither re-sorts nor re-tokenizes the corpus.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        self.ids = np.empty(0, dtype="int64")
+        self.lengths = np.empty(0, dtype="float32")
+        self.offsets = np.zeros(1, dtype="int64")
+        self.rows = np.empty(0, dtype="int32")
+        self.tfs = np.empty(0, dtype="float32")
+        # Per-document length normalization, recomputed after changes
+        self._norm = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids: Sequence[int], texts: Sequence[str]) -> "BM25Index":
+        index = cls()
+        index.add(ids, texts)
+        return index
+
+    def add(self, ids: Sequence[int], texts: Sequence[str]) -> None:
+        if ids is None or not len(ids):
+            return
+        vocabulary = self.vocabulary
+        occurrences, lengths = array("q"), array("q")
+        for text in texts:
+            tokens = tokenize(text)
+            occurrences.extend([vocabulary.setdefault(t, len(vocabulary)) for t in tokens])
+            lengths.append(len(tokens))
+
+        # Count each (row, term) pair once to get the term frequencies
+        lengths = np.frombuffer(lengths, dtype="int64")
+        rows = np.repeat(np.arange(len(self.ids), len(self.ids) + len(lengths), dtype="int64"), lengths)
+        pairs, tfs = np.unique(rows * len(vocabulary) + np.frombuffer(occurrences, dtype="int64"), return_counts=True)
+        self._merge_postings(pairs % len(vocabulary), pairs // len(vocabulary), tfs.astype("float32"))
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype="int64")])
+        self.lengths = np.concatenate([self.lengths, lengths.astype("float32")])
+        self._norm = None
+
+    def remove(self, ids: Sequence[int]) -> None:
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype="int64"))
+        if keep.all():
+            return
+        # New row number of every kept document
+        remap = np.cumsum(keep) - 1
+        live = keep[self.rows]
+        self._set_postings(self._posting_terms()[live], remap[self.rows[live]], self.tfs[live])
+        self.ids = self.ids[keep]
+        self.lengths = self.lengths[keep]
+        self._norm = None
+
+    def _posting_terms(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.offsets) - 1, dtype="int64"), np.diff(self.offsets))
+
+    def _set_postings(self, terms: np.ndarray, rows: np.ndarray, tfs: np.ndarray) -> None:
+        """Store postings already ordered by term"""
+        self.rows = rows.astype("int32")
+        self.tfs = tfs
+        counts = np.bincount(terms, minlength=len(self.vocabulary))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype("int64")
+
+    def _merge_postings(self, terms: np.ndarray, rows: np.ndarray, tfs: np.ndarray) -> None:
+        """Merge postings of rows past the existing ones into the term order"""
+        order = np.argsort(terms, kind="stable")
+        terms, rows, tfs = terms[order], rows[order], tfs[order]
+        # Offsets of the terms the new postings brought into the vocabulary are the end
+        old_offsets = np.concatenate([
+            self.offsets, np.full(len(self.vocabulary) + 1 - len(self.offsets), self.offsets[-1]),
+        ])
+        new_offsets = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=len(self.vocabulary)))])
+        # Within a term, existing postings keep their place ahead of the new rows
+        old_terms = self._posting_terms()
+        old_slots = np.arange(len(old_terms)) + new_offsets[old_terms]
+        new_slots = np.arange(len(terms)) + old_offsets[terms + 1]
+        size = len(old_terms) + len(terms)
+        merged_rows = np.empty(size, dtype="int32")
+        merged_tfs = np.empty(size, dtype="float32")
+        merged_rows[old_slots], merged_rows[new_slots] = self.rows, rows
+        merged_tfs[old_slots], merged_tfs[new_slots] = self.tfs, tfs
+        self.rows, self.tfs = merged_rows, merged_tfs
+        self.offsets = old_offsets + new_offsets
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (chunk id, score) pairs; chunks sharing no term with the query are left out"""
+        n = len(self.ids)
+        term_ids = {self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary}
+        if not n or not term_ids or k <= 0:
+            return []
+        if self._norm is None:
+            average = max(float(self.lengths.mean()), 1e-9)
+            self._norm = self.k1 * (1 - self.b + self.b * self.lengths / average)
+        norm = self._norm
+        scores = np.zeros(n, dtype="float32")
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            if start == end:
+                continue
+            rows, tfs = self.rows[start:end], self.tfs[start:end]
+            df = end - start
+            idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm[rows])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(self.ids[row]), float(scores[row])) for row in matched]
+
+    def nbytes(self) -> int:
+        arrays = (self.ids, self.lengths, self.offsets, self.rows, self.tfs)
+        # Rough size of the vocabulary dict and its strings
+        return sum(a.nbytes for a in arrays) + len(self.vocabulary) * 100
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Arrays for np.savez; the vocabulary is stored in term id order"""
+        terms = sorted(self.vocabulary, key=self.vocabulary.__getitem__)
+        return {
+            "terms": np.array("\n".join(terms)),
+            "ids": self.ids,
+            "lengths": self.lengths,
+            "offsets": self.offsets,
+            "rows": self.rows,
+            "tfs": self.tfs,
+        }
+
+    @classmethod
+    def from_state(cls, state) -> "BM25Index":
+        index = cls()
+        terms = str(state["terms"])
+        index.vocabulary = {term: i for i, term in enumerate(terms.split("\n"))} if terms else {}
+        for name in ("ids", "lengths", "offsets", "rows", "tfs"):
+            setattr(index, name, state[name])
+        return index
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Merge ranked id lists: each id scores sum(1 / (k + rank)) over the lists holding it"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,161 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import async_session_maker
+from ..models import Chat, Message, estimate_tokens
+from .agent_clients import agent_clients
+from .scheduler import QueueFull, agent_scheduler
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below so it can replace the original messages as context "
+    "for continuing it. Keep facts, names, decisions and open questions; be concise.\n\n"
+    "[summary]"
+    "[transcript]"
+)
+
+# Messages without a cached count (e.g. inserted by raw SQL) are estimated in the query
+_token_count = func.coalesce(Message.token_count, (func.length(Message.message) + 3) / 4)
+
+
+class ChatContextManager:
+    """Chooses which messages of a chat are sent to the model.
+
+    Walks the chat backwards over the cached per-message token counts and
+    keeps the most recent messages that fit the model's history budget, so
+    prompt size stays flat as the chat grows. When summaries are enabled the
+    turns that fell out of the window are replaced by the chat's rolling
+    summary, which is refreshed in the background after each reply.
+    """
+
+    def __init__(
+        self,
+        default_budget: int = 3072,
+        budgets: Optional[Dict[str, int]] = None,
+        summarize: bool = False,
+    ):
+        self.default_budget = default_budget
+        self.budgets = budgets or {}
+        self.summarize = summarize
+        self._summarizing: Set[int] = set()
+
+    def budget(self, model_name: Optional[str]) -> int:
+        return self.budgets.get(model_name, self.default_budget)
+
+    async def build_history(self, db: AsyncSession, chat: Chat) -> Tuple[List[dict], Optional[int]]:
+        """Ollama messages for the chat's next turn.
+
+        Also returns the id of the newest message left out of the window
+        (None if the whole chat fit), for `update_summary`.
+        """
+        summary = chat.summary if self.summarize else None
+        budget = self.budget(chat.model_name)
+        if summary:
+            budget -= estimate_tokens(summary)
+
+        result = await db.stream(
+            select(Message.id, _token_count)
+            .where(Message.chat_id == chat.id)
+            .order_by(Message.id.desc())
+        )
+        oldest_id, cutoff_id, used = None, None, 0
+        async for message_id, tokens in result:
+            # The newest message is always sent, even if it alone exceeds the budget
+            if oldest_id is not None and used + tokens > budget:
+                cutoff_id = message_id
+                break
+            oldest_id, used = message_id, used + tokens
+        await result.close()
+        if oldest_id is None:
+            return [], None
+
+        rows = await db.execute(
+            select(Message.role, Message.message)
+            .where(Message.chat_id == chat.id, Message.id >= oldest_id)
+            .order_by(Message.id)
+        )
+        history = [{"role": role, "content": text} for role, text in rows.all()]
+        if summary and cutoff_id is not None:
+            history.insert(0, {
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary}",
+            })
+        return history, cutoff_id
+
+    def needs_summary(self, chat: Chat, cutoff_id: Optional[int]) -> bool:
+        return (
+            self.summarize
+            and cutoff_id is not None
+            and (chat.summary_message_id or 0) < cutoff_id
+            and chat.id not in self._summarizing
+        )
+
+    async def update_summary(self, chat_id: int, agent_url: str, model_name: str, upto_id: int) -> None:
+        """Fold messages up to `upto_id` into the chat's rolling summary.
+
+        At most one budget's worth of messages is folded in per call, so a
+        long backlog catches up over several turns. Failures leave the
+        previous summary in place.
+        """
+        if chat_id in self._summarizing:
+            return
+        self._summarizing.add(chat_id)
+        try:
+            async with async_session_maker() as db:
+                chat = await db.get(Chat, chat_id)
+                start_id = (chat.summary_message_id or 0) if chat else upto_id
+                if start_id >= upto_id:
+                    return
+
+                result = await db.stream(
+                    select(Message.id, Message.role, Message.message, _token_count)
+                    .where(Message.chat_id == chat_id, Message.id > start_id, Message.id <= upto_id)
+                    .order_by(Message.id)
+                )
+                lines, last_id, used = [], None, 0
+                budget = self.budget(model_name)
+                async for message_id, role, text, tokens in result:
+                    if last_id is not None and used + tokens > budget:
+                        break
+                    lines.append(f"{role}: {text}")
+                    last_id, used = message_id, used + tokens
+                await result.close()
+                if last_id is None:
+                    return
+
+                previous = f"Summary so far:\n{chat.summary}\n\n" if chat.summary else ""
+                prompt = SUMMARY_PROMPT.replace("[summary]", previous)
+                prompt = prompt.replace("[transcript]", "Conversation:\n" + "\n".join(lines))
+                try:
+                    async with agent_scheduler.slot(agent_url, "summaries"):
+                        response = await agent_clients.get(agent_url).post(
+                            f"{agent_url}/api/chat",
+                            json={
+                                "model": model_name,
+                                "messages": [{"role": "user", "content": prompt}],
+                                "stream": False,
+                            },
+                            timeout=agent_clients.timeout("chat"),
+                        )
+                    response.raise_for_status()
+                    summary = response.json()["message"]["content"].strip()
+                except (httpx.HTTPError, QueueFull, KeyError, TypeError, ValueError):
+                    return
+                if not summary:
+                    return
+
+                chat.summary = summary
+                chat.summary_message_id = last_id
+                await db.commit()
+        finally:
+            self._summarizing.discard(chat_id)
+
+
+chat_context = ChatContextManager(
+    default_budget=settings.chat_history_tokens,
+    budgets=settings.chat_history_tokens_by_model,
+    summarize=settings.chat_summary_enabled,
+)
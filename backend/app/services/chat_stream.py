@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import AsyncIterator, List, Optional, Set
+
+import httpx
+
+from ..config import settings
+from .agent_clients import agent_clients
+from .agent_pool import agent_pool
+from .lru_cache import LRUCache
+from .message_writer import message_writer
+from .metrics import (
+    ollama_errors, ollama_generated_tokens, ollama_queue_wait,
+    ollama_time_to_first_token, ollama_tokens_per_second,
+)
+from .scheduler import Ticket, agent_scheduler
+
+STATS_FIELDS = (
+    "total_duration", "load_duration", "prompt_eval_count",
+    "prompt_eval_duration", "eval_count", "eval_duration",
+)
+
+# Replayable Ollama NDJSON lines of completed deterministic replies
+response_cache = LRUCache(settings.chat_response_cache_size, settings.chat_response_cache_ttl)
+
+# Keep references so running pumps aren't garbage collected
+_pumps: Set[asyncio.Task] = set()
+
+
+def is_cacheable(options: Optional[dict], opt_in: bool = False) -> bool:
+    """Replies are only reused when asked to, or when sampling is deterministic"""
+    if response_cache.maxsize <= 0:
+        return False
+    return opt_in or (options or {}).get("temperature") == 0
+
+
+def _cache_key(payload: dict) -> str:
+    key = json.dumps(
+        [payload.get("model"), payload.get("messages"), payload.get("options")],
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class _Reply:
+    """Accumulates a streamed reply for saving and caching"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.content: List[str] = []
+        self.reasoning: List[str] = []
+        self.final: Optional[dict] = None
+        self.agent_url: Optional[str] = None
+
+    def add(self, line: str) -> None:
+        self.lines.append(line)
+        try:
+            chunk = json.loads(line)
+        except ValueError:
+            return
+        message = chunk.get("message") or {}
+        self.content.append(message.get("content") or "")
+        self.reasoning.append(message.get("thinking") or "")
+        if chunk.get("done"):
+            self.final = chunk
+
+    async def save(self, chat_id: int, model: str, with_stats: bool = True) -> None:
+        """Queue the reply and wait until it is committed"""
+        text = "".join(self.content)
+        if not text:
+            return
+        stats = {}
+        if with_stats and self.final:
+            stats = {field: self.final.get(field) for field in STATS_FIELDS}
+        await message_writer.write(
+            chat_id=chat_id,
+            message=text,
+            role="assistant",
+            model=model,
+            model_reasoning="".join(self.reasoning) or None,
+            agent_url=self.agent_url,
+            **stats,
+        )
+
+
+def stream_chat(
+    ticket: Ticket, agent_urls: List[str], payload: dict, chat_id: int, cacheable: bool = False
+) -> AsyncIterator[str]:
+    """Relay Ollama /api/chat NDJSON lines and save the assistant reply.
+
+    The agent `ticket` was admitted to is tried first, then the rest of
+    `agent_urls` in order; once lines have been relayed there is no
+    failover. While the request waits for a slot on an agent, `queued`
+    events report its position. Ollama is read by its own task, so the
+    reply is still completed and saved when the client goes away
+    mid-stream. With `cacheable`, an identical earlier reply is replayed
+    without calling Ollama, and a completed one is stored for reuse.
+    """
+    lines: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(_pump(ticket, agent_urls, payload, chat_id, cacheable, lines))
+    _pumps.add(task)
+    task.add_done_callback(_pumps.discard)
+
+    async def relay():
+        while True:
+            line = await lines.get()
+            if line is None:
+                return
+            yield line
+
+    return relay()
+
+
+async def _wait_for_slot(ticket: Ticket, out: asyncio.Queue) -> bool:
+    """Wait for admission, reporting the queue position; False after the queue timeout"""
+    started = time.perf_counter()
+    position = None
+    while not ticket.admitted:
+        waited = time.perf_counter() - started
+        if agent_scheduler.queue_timeout and waited >= agent_scheduler.queue_timeout:
+            return False
+        if agent_scheduler.position(ticket) != position:
+            position = agent_scheduler.position(ticket)
+            out.put_nowait(json.dumps({"type": "queued", "position": position}) + "\n")
+        await agent_scheduler.wait(ticket, timeout=0.5)
+    ollama_queue_wait.observe(time.perf_counter() - started, ticket.url)
+    return True
+
+
+def _observe_generation(agent_url: str, model: str, final: Optional[dict]) -> None:
+    if not final or not final.get("eval_count"):
+        return
+    ollama_generated_tokens.inc(agent_url, model, amount=final["eval_count"])
+    if final.get("eval_duration"):
+        ollama_tokens_per_second.observe(final["eval_count"] / (final["eval_duration"] / 1e9), agent_url, model)
+
+
+async def _pump(
+    ticket: Ticket,
+    agent_urls: List[str],
+    payload: dict,
+    chat_id: int,
+    cacheable: bool,
+    out: asyncio.Queue,
+) -> None:
+    reply = _Reply()
+    cache_key = _cache_key(payload) if cacheable else None
+    cached = response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        agent_scheduler.release(ticket)
+        for line in cached:
+            out.put_nowait(line + "\n")
+            reply.add(line)
+        # Timings belong to the original generation, not this request
+        await reply.save(chat_id, payload.get("model"), with_stats=False)
+        out.put_nowait(None)
+        return
+
+    error = None
+    try:
+        failover = [url for url in agent_urls if url.rstrip("/") != ticket.url]
+        for n, agent_url in enumerate([ticket.url, *failover]):
+            error = None
+            if n:
+                ticket = agent_scheduler.enqueue(agent_url, ticket.user)
+            try:
+                if not await _wait_for_slot(ticket, out):
+                    error = "Timed out waiting for an agent, try again shortly"
+                    break
+                agent_pool.begin(agent_url)
+                started = time.perf_counter()
+                async with agent_clients.get(agent_url).stream(
+                    "POST", f"{agent_url}/api/chat", json=payload, timeout=agent_clients.timeout("chat")
+                ) as resp:
+                    if resp.status_code != 200:
+                        error_text = await resp.aread()
+                        error = f"Ollama error {resp.status_code}: {error_text.decode()}"
+                        ollama_errors.inc(agent_url)
+                        if resp.status_code >= 500:
+                            agent_pool.fail(agent_url, error, unreachable=False)
+                            continue
+                        break
+                    reply.agent_url = agent_url
+                    async for line in resp.aiter_lines():
+                        if not line:
+                            continue
+                        if not reply.lines:
+                            ollama_time_to_first_token.observe(
+                                time.perf_counter() - started, agent_url, payload.get("model", "")
+                            )
+                        out.put_nowait(line + "\n")
+                        reply.add(line)
+                    _observe_generation(agent_url, payload.get("model", ""), reply.final)
+                    break
+            except httpx.HTTPError as e:
+                error = f"Ollama connection error: {e}"
+                ollama_errors.inc(agent_url)
+                agent_pool.fail(agent_url, error, isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)))
+                if reply.lines:
+                    break
+            finally:
+                if ticket.admitted:
+                    agent_pool.end(agent_url, reply.final)
+                agent_scheduler.release(ticket)
+        if error:
+            out.put_nowait(json.dumps({"error": error}) + "\n")
+    finally:
+        if cache_key and not error and reply.final is not None:
+            response_cache.set(cache_key, reply.lines)
+        try:
+            # The stream only ends once the reply is stored, so a follow-up
+            # message can't be written ahead of it
+            await reply.save(chat_id, payload.get("model"))
+        finally:
+            out.put_nowait(None)
@@ -0,0 +1,184 @@
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+# Approximates subword tokenization: words are cut into pieces of up to six
+# characters and punctuation counts separately
+_TOKEN = re.compile(r"\w{1,6}|[^\w\s]")
+
+# Whitespace separating two units: a line break (two make a paragraph
+# break), or whitespace after sentence-ending punctuation
+_SEPARATOR = re.compile(r"\n\s*|(?<=[.!?;:])\s+|(?<=[.!?;:][\"'”’)\]])\s+")
+_HEADING = re.compile(r"#{1,6}[ \t]")
+
+# Text without any separator is cut into units of at most this many
+# characters, so it isn't rescanned as every new piece arrives
+_MAX_UNIT_CHARS = 1 << 20
+
+CHUNKERS = ("structured", "characters")
+
+# (start, end, tokens, starts a markdown heading, followed by a paragraph break)
+_Unit = Tuple[int, int, int, bool, bool]
+
+
+def iter_chunks(
+    pieces: Iterable[str], chunk_size: int, overlap: int, chunker: str = "structured"
+) -> Iterator[Tuple[int, int, str]]:
+    """Yield (start, end, text) chunks of a document streamed as text pieces"""
+    if chunker == "characters":
+        return _character_chunks(pieces, chunk_size, overlap)
+    if chunker == "structured":
+        return _StructuredChunker(chunk_size, overlap).chunks(pieces)
+    raise ValueError(f"Unknown chunker: {chunker}")
+
+
+def _character_chunks(pieces: Iterable[str], chunk_size: int, overlap: int) -> Iterator[Tuple[int, int, str]]:
+    """Fixed windows of `chunk_size` characters, `overlap` characters apart"""
+    step = max(1, chunk_size - overlap)
+    buffer = ""
+    buffer_start = 0  # document offset of buffer[0]
+    start = 0
+
+    for piece in pieces:
+        buffer += piece
+        while start + chunk_size <= buffer_start + len(buffer):
+            offset = start - buffer_start
+            yield start, start + chunk_size, buffer[offset:offset + chunk_size]
+            start += step
+        if start > buffer_start:
+            buffer = buffer[start - buffer_start:]
+            buffer_start = start
+
+    text_length = buffer_start + len(buffer)
+    while start < text_length:
+        offset = start - buffer_start
+        yield start, min(start + chunk_size, text_length), buffer[offset:offset + chunk_size]
+        start += step
+
+
+class _StructuredChunker:
+    """Packs sentences into chunks of up to `chunk_size` tokens.
+
+    The document is scanned once and split into units at sentence ends and
+    line breaks; units are never cut unless a single one exceeds the chunk
+    size. A chunk that fills up ends at its last paragraph break if that
+    keeps it at least half full, a markdown heading starts a new chunk, and
+    each chunk repeats up to `overlap` tokens of whole trailing units of the
+    previous one. Only the text from the start of the open chunk onwards is
+    kept in memory.
+    """
+
+    def __init__(self, chunk_size: int, overlap: int):
+        self.chunk_size = max(1, chunk_size)
+        self.overlap = min(max(0, overlap), self.chunk_size // 2)
+        self.buffer = ""
+        self.buffer_start = 0  # document offset of buffer[0]
+        self.current: List[_Unit] = []
+        self.tokens = 0
+
+    def chunks(self, pieces: Iterable[str]) -> Iterator[Tuple[int, int, str]]:
+        scan = 0  # buffer offset of the next unit
+        line_start = True
+        for piece in pieces:
+            self.buffer += piece
+            # Only scan up to the last non-space character: what follows it
+            # could still turn out to be a paragraph break
+            limit = len(self.buffer)
+            while limit > scan and self.buffer[limit - 1].isspace():
+                limit -= 1
+            for match in _SEPARATOR.finditer(self.buffer, scan, limit):
+                if match.start() > scan:
+                    yield from self._add(scan, match.start(), line_start, match.group().count("\n") > 1)
+                scan, line_start = match.end(), "\n" in match.group()
+            if limit - scan > _MAX_UNIT_CHARS:
+                cut = self.buffer.rfind(" ", scan, limit)
+                cut = cut if cut > scan else limit
+                yield from self._add(scan, cut, line_start, False)
+                scan, line_start = cut, False
+            scan = self._trim(scan)
+
+        yield from self._add(scan, len(self.buffer), line_start, True)
+        if self.current:
+            yield self._emit(len(self.current))
+
+    def _trim(self, scan: int) -> int:
+        """Drop buffered text before the open chunk; returns `scan` rebased"""
+        keep = min(self.current[0][0] - self.buffer_start if self.current else scan, scan)
+        # Cutting only once half the buffer is dead keeps the copying linear
+        if keep > len(self.buffer) // 2:
+            self.buffer = self.buffer[keep:]
+            self.buffer_start += keep
+            scan -= keep
+        return scan
+
+    def _add(self, start: int, end: int, line_start: bool, paragraph_end: bool) -> Iterator[Tuple[int, int, str]]:
+        while end > start and self.buffer[end - 1].isspace():
+            end -= 1
+        heading = line_start and _HEADING.match(self.buffer, start) is not None
+        offset = self.buffer_start
+        count = len(_TOKEN.findall(self.buffer, start, end))
+        if not count:
+            return
+        if count <= self.chunk_size:
+            yield from self._push((offset + start, offset + end, count, heading, paragraph_end))
+            return
+        # Units longer than a chunk are cut at token boundaries
+        positions = [m.start() for m in _TOKEN.finditer(self.buffer, start, end)]
+        units = []
+        for i in range(0, count, self.chunk_size):
+            piece_start = start if i == 0 else positions[i]
+            piece_end = positions[i + self.chunk_size] if i + self.chunk_size < count else end
+            while self.buffer[piece_end - 1].isspace():
+                piece_end -= 1
+            units.append((
+                offset + piece_start, offset + piece_end, min(self.chunk_size, count - i),
+                heading and i == 0, paragraph_end and i + self.chunk_size >= count,
+            ))
+        for unit in units:
+            yield from self._push(unit)
+
+    def _push(self, unit: _Unit) -> Iterator[Tuple[int, int, str]]:
+        tokens, heading = unit[2], unit[3]
+        if self.current and heading and self.tokens >= self.chunk_size // 4:
+            yield self._emit(len(self.current))
+            self.current, self.tokens = [], 0
+        while self.current and self.tokens + tokens > self.chunk_size:
+            cut = self._cut()
+            yield self._emit(cut)
+            rest = self.current[cut:]
+            carried = self._overlap(self.current[:cut])
+            rest_tokens = sum(u[2] for u in rest)
+            carried_tokens = sum(u[2] for u in carried)
+            # The overlap is dropped when it would leave no room for the unit
+            if rest_tokens + carried_tokens + tokens > self.chunk_size:
+                carried, carried_tokens = [], 0
+            self.current = carried + rest
+            self.tokens = rest_tokens + carried_tokens
+            if not rest:
+                break
+        self.current.append(unit)
+        self.tokens += tokens
+
+    def _cut(self) -> int:
+        """Number of open units to emit: up to the last paragraph break if it is at least half full"""
+        used, best = 0, len(self.current)
+        for i, unit in enumerate(self.current):
+            used += unit[2]
+            if unit[4] and used >= self.chunk_size // 2 and i < len(self.current) - 1:
+                best = i + 1
+        return best
+
+    def _overlap(self, emitted: List[_Unit]) -> List[_Unit]:
+        carried, used = [], 0
+        for unit in reversed(emitted):
+            if used + unit[2] > self.overlap:
+                break
+            carried.append(unit)
+            used += unit[2]
+        # Never carry a whole chunk over, or the next one would repeat it
+        if len(carried) == len(emitted):
+            carried = carried[:-1]
+        return carried[::-1]
+
+    def _emit(self, count: int) -> Tuple[int, int, str]:
+        start, end = self.current[0][0], self.current[count - 1][1]
+        return start, end, self.buffer[start - self.buffer_start:end - self.buffer_start]
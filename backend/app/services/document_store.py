@@ -0,0 +1,119 @@
+import asyncio
+import codecs
+import hashlib
+import os
+import uuid
+import weakref
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from fastapi import UploadFile
+
+from ..config import settings
+
+# Bytes read from an upload (and from disk) per step
+READ_SIZE = 1024 * 1024
+
+
+@dataclass
+class SpooledUpload:
+    """An upload written to a temporary file and validated as UTF-8"""
+    path: str
+    size: int
+    sha256: str
+
+
+class DocumentStore:
+    """Content-addressed store of knowledge base documents as UTF-8 blobs on disk.
+
+    Blobs are named by the sha256 of their bytes, so identical uploads
+    share one file. Uploads are streamed to a temporary file in fixed-size
+    pieces and validated with an incremental decoder, so memory use per
+    upload does not grow with the file. Text is read back the same way.
+
+    A blob is shared by every document with its hash, so adding one and
+    releasing one race. Within a process, callers hold `lock(sha256)`
+    around both. Across processes, an upload keeps its spooled copy until
+    its document row is committed and then restores the blob if it has
+    gone, and a release detaches the blob and puts it back if a document
+    referencing it appeared meanwhile.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _tmp_dir(self) -> str:
+        return os.path.join(self.root, "tmp")
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    async def spool(self, file: UploadFile) -> SpooledUpload:
+        """Copy an upload to disk; raises UnicodeDecodeError if it is not UTF-8"""
+        os.makedirs(self._tmp_dir(), exist_ok=True)
+        path = os.path.join(self._tmp_dir(), uuid.uuid4().hex)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(path, "wb") as f:
+                while piece := await file.read(READ_SIZE):
+                    decoder.decode(piece)
+                    digest.update(piece)
+                    f.write(piece)
+                    size += len(piece)
+                decoder.decode(b"", final=True)
+        except BaseException:
+            os.remove(path)
+            raise
+        return SpooledUpload(path=path, size=size, sha256=digest.hexdigest())
+
+    def lock(self, sha256: str) -> asyncio.Lock:
+        lock = self._locks.get(sha256)
+        if lock is None:
+            lock = self._locks[sha256] = asyncio.Lock()
+        return lock
+
+    def put(self, upload: SpooledUpload) -> None:
+        """Link a spooled upload into the blob store, unless an identical blob exists"""
+        path = self.path(upload.sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(upload.path, path)
+        except FileExistsError:
+            pass
+
+    def commit(self, upload: SpooledUpload) -> None:
+        """Once the document row is committed: make sure its blob exists, drop the spooled copy"""
+        self.put(upload)
+        self.discard(upload)
+
+    def discard(self, upload: SpooledUpload) -> None:
+        if os.path.exists(upload.path):
+            os.remove(upload.path)
+
+    def iter_text(self, sha256: str) -> Iterator[str]:
+        """Decode a stored document piece by piece"""
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        with open(self.path(sha256), "rb") as f:
+            while piece := f.read(READ_SIZE):
+                text = decoder.decode(piece)
+                if text:
+                    yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def detach(self, sha256: str) -> Optional[SpooledUpload]:
+        """Move a blob out of the store, to be discarded or committed back; None if absent"""
+        os.makedirs(self._tmp_dir(), exist_ok=True)
+        path = os.path.join(self._tmp_dir(), uuid.uuid4().hex)
+        try:
+            os.replace(self.path(sha256), path)
+        except FileNotFoundError:
+            return None
+        return SpooledUpload(path=path, size=os.path.getsize(path), sha256=sha256)
+
+
+document_store = DocumentStore(settings.rag_document_dir)
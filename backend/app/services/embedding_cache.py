@@ -0,0 +1,108 @@
+import hashlib
+import sqlite3
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from ..config import settings
+
+# SQLite's default limit on bound parameters is 999
+_LOOKUP_BATCH = 500
+
+
+class EmbeddingCache:
+    """Persistent, content-addressed store of embeddings.
+
+    Vectors are keyed by sha256(embedding model, text), so identical chunks
+    are embedded once no matter which knowledge base or chunking run they
+    come from. Vectors are stored as raw float16 or float32 blobs. The
+    database file is opened on first use.
+
+    At most `max_entries` vectors are kept: rows get increasing rowids as
+    they are written, and writes trim the rowid range to the newest
+    `max_entries`, so the oldest entries go first.
+    """
+
+    def __init__(self, path: str, dtype: str = "float16", max_entries: int = 500_000):
+        if dtype not in ("float16", "float32"):
+            raise ValueError(f"Unsupported embedding cache dtype: {dtype}")
+        self.path = path
+        self.dtype = dtype
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database on first use; called with the lock held"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key BLOB PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def key(embedding_model: str, text: str) -> bytes:
+        h = hashlib.sha256(embedding_model.encode("utf-8"))
+        h.update(b"\0")
+        h.update(text.encode("utf-8"))
+        return h.digest()
+
+    def get_many(self, embedding_model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vectors in the order of `texts`, None where not cached"""
+        keys = [self.key(embedding_model, t) for t in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[i:i + _LOOKUP_BATCH]
+                rows = self._connection().execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype("float32")
+        results = [found.get(k) for k in keys]
+        hits = sum(r is not None for r in results)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, embedding_model: str, texts: List[str], embeddings: np.ndarray) -> None:
+        rows = [
+            (self.key(embedding_model, t), self.dtype, np.asarray(e, dtype=self.dtype).tobytes())
+            for t, e in zip(texts, embeddings)
+        ]
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dtype, vector) VALUES (?, ?, ?)", rows
+            )
+            if self.max_entries > 0:
+                # Both lookups and the delete are rowid range operations
+                conn.execute(
+                    "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?",
+                    (self.max_entries,),
+                )
+            conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return {"entries": entries, "hits": self.hits, "misses": self.misses, "dtype": self.dtype}
+
+
+embedding_cache: Optional[EmbeddingCache] = (
+    EmbeddingCache(
+        settings.rag_embedding_cache_path,
+        settings.rag_embedding_cache_dtype,
+        settings.rag_embedding_cache_max_entries,
+    )
+    if settings.rag_embedding_cache_path else None
+)
@@ -0,0 +1,181 @@
+import math
+from typing import Optional, Sequence
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("auto", "flat", "ivf_flat", "hnsw", "ivf_pq")
+
+# Corpus sizes (in vectors) at which "auto" moves to the next index type
+AUTO_HNSW_MIN = 10_000
+AUTO_IVF_FLAT_MIN = 250_000
+AUTO_IVF_PQ_MIN = 1_000_000
+
+HNSW_M = 32
+# FAISS wants roughly this many training points per IVF centroid
+IVF_TRAIN_POINTS_PER_LIST = 39
+PQ_MIN_VECTORS = 1024
+
+
+def resolve_index_type(index_type: Optional[str], n: int) -> str:
+    """Concrete index type for a corpus of `n` vectors"""
+    index_type = index_type or "auto"
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    if index_type == "auto":
+        if n >= AUTO_IVF_PQ_MIN:
+            return "ivf_pq"
+        if n >= AUTO_IVF_FLAT_MIN:
+            return "ivf_flat"
+        if n >= AUTO_HNSW_MIN:
+            return "hnsw"
+        return "flat"
+    if index_type == "ivf_pq" and n < PQ_MIN_VECTORS:
+        # Too few vectors to train 256-centroid PQ codebooks
+        return "ivf_flat"
+    return index_type
+
+
+def _nlist(n: int) -> int:
+    return max(1, min(int(4 * math.sqrt(n)), n // IVF_TRAIN_POINTS_PER_LIST))
+
+
+def _pq_subquantizers(d: int) -> int:
+    # Largest divisor of d giving sub-vectors of at least 4 dimensions
+    for m in range(max(1, d // 4), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+
+def create_index(
+    embeddings: np.ndarray,
+    index_type: Optional[str] = "auto",
+    ids: Optional[Sequence[int]] = None,
+) -> faiss.Index:
+    """Build (and train, where needed) a FAISS index over `embeddings`.
+
+    Vectors are addressed by `ids` (default 0..n-1) and can be added or
+    removed individually. IVF indexes store the ids in their inverted lists
+    and keep a hashtable direct map for removal and reconstruction; flat
+    and HNSW indexes are wrapped in an IndexIDMap2.
+    """
+    n, d = embeddings.shape
+    index_type = resolve_index_type(index_type, n)
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, HNSW_M)
+    else:
+        nlist = _nlist(n)
+        quantizer = faiss.IndexFlatL2(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, _pq_subquantizers(d), 8)
+        train_size = min(n, max(nlist * 256, PQ_MIN_VECTORS * 64))
+        if train_size < n:
+            sample = np.random.default_rng(0).choice(n, train_size, replace=False)
+            index.train(embeddings[np.sort(sample)])
+        else:
+            index.train(embeddings)
+        enable_reconstruct(index)
+
+    if not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap2(index)
+    ids = np.arange(n, dtype="int64") if ids is None else np.asarray(ids, dtype="int64")
+    index.add_with_ids(embeddings, ids)
+    return index
+
+
+def enable_reconstruct(index: faiss.Index) -> None:
+    """Give an IVF index the direct map it needs to reconstruct vectors by id.
+
+    A hashtable map is used rather than an array one, which would make
+    the index refuse remove_ids.
+    """
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF) and inner.direct_map.type == faiss.DirectMap.NoMap:
+        inner.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+
+def remove_ids(index: faiss.Index, ids: Sequence[int]) -> None:
+    """Remove vectors by id; raises RuntimeError for index types that can't (HNSW)"""
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    # A hashtable direct map only accepts removals listed in an IDSelectorArray
+    index.remove_ids(faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids)))
+
+
+def stored_ids(index: faiss.Index) -> Optional[np.ndarray]:
+    """Ids of every vector an IndexIDMap holds, removed or not; None for other indexes"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map)
+    return None
+
+
+def native_ivf(index: faiss.Index) -> faiss.Index:
+    """Copy of an IndexIDMap2-wrapped IVF index that stores the ids itself.
+
+    IVF indexes used to be wrapped like the others, but removing from an
+    IVF index under an IndexIDMap2 leaves the id map out of step with the
+    inverted lists. Other indexes are returned unchanged.
+    """
+    wrapped = faiss.downcast_index(index)
+    if not isinstance(wrapped, faiss.IndexIDMap) or not isinstance(_unwrap(wrapped), faiss.IndexIVF):
+        return index
+    ivf = faiss.clone_index(_unwrap(wrapped))
+    id_map = faiss.vector_to_array(wrapped.id_map)
+    invlists = ivf.invlists
+    for list_no in range(ivf.nlist):
+        n = invlists.list_size(list_no)
+        if not n:
+            continue
+        positions = faiss.rev_swig_ptr(invlists.get_ids(list_no), n)
+        ids = np.ascontiguousarray(id_map[positions])
+        codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), n * invlists.code_size).copy()
+        invlists.update_entries(list_no, 0, n, faiss.swig_ptr(ids), faiss.swig_ptr(codes))
+    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return ivf
+
+
+def _unwrap(index: faiss.Index) -> faiss.Index:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def search_params(
+    index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+) -> Optional[faiss.SearchParameters]:
+    """Per-call search parameters, so concurrent searches never share mutable state"""
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexIVF) and nprobe:
+        return faiss.SearchParametersIVF(nprobe=min(nprobe, index.nlist))
+    if isinstance(index, faiss.IndexHNSW) and ef_search:
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+
+def index_nbytes(index: faiss.Index) -> int:
+    """Approximate memory held by the index's codes, id map and HNSW graph"""
+    wrapped = faiss.downcast_index(index)
+    index = _unwrap(index)
+    try:
+        code_size = index.sa_code_size()
+    except RuntimeError:
+        code_size = index.d * 4
+    size = code_size * index.ntotal
+    if isinstance(index, faiss.IndexHNSW):
+        size += index.ntotal * index.hnsw.nb_neighbors(0) * 4
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.type == faiss.DirectMap.Array:
+        size += index.ntotal * 8
+    elif isinstance(index, faiss.IndexIVF) and index.direct_map.type == faiss.DirectMap.Hashtable:
+        # unordered_map node plus bucket, roughly
+        size += index.ntotal * 32
+    if isinstance(wrapped, faiss.IndexIDMap):
+        # id array plus IndexIDMap2's reverse map
+        size += index.ntotal * 8 * (3 if isinstance(wrapped, faiss.IndexIDMap2) else 1)
+    return size
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from typing import Optional
+
+from ..config import settings
+from .rag_service import AsyncRAGService
+
+
+class IndexCache:
+    """LRU cache of loaded RAG services, one per knowledge base.
+
+    Entries are sized by their FAISS index and chunk list; the least
+    recently used are evicted once the total exceeds `max_bytes`. Each
+    entry remembers the version of the stored index it was loaded from,
+    and is dropped when asked for with a different one.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[int, AsyncRAGService]" = OrderedDict()
+        self._sizes: dict = {}
+        self._versions: dict = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, kb_id: int, version=None) -> Optional[AsyncRAGService]:
+        service = self._entries.get(kb_id)
+        if service is not None and self._versions[kb_id] != version:
+            self.pop(kb_id)
+            service = None
+        if service is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(kb_id)
+        self.hits += 1
+        return service
+
+    def put(self, kb_id: int, service: AsyncRAGService, version=None) -> None:
+        self.pop(kb_id)
+        size = service.nbytes()
+        self._entries[kb_id] = service
+        self._sizes[kb_id] = size
+        self._versions[kb_id] = version
+        self.total_bytes += size
+        # Always keep the newest entry, even if it alone is over budget
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            self.pop(oldest)
+            self.evictions += 1
+
+    def pop(self, kb_id: int) -> Optional[AsyncRAGService]:
+        service = self._entries.pop(kb_id, None)
+        if service is not None:
+            self.total_bytes -= self._sizes.pop(kb_id)
+            del self._versions[kb_id]
+        return service
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+index_cache = IndexCache(settings.rag_cache_max_bytes)
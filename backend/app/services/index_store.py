@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from ..config import settings
+from .bm25 import BM25Index
+from .faiss_index import enable_reconstruct, native_ivf, stored_ids
+from .rag_service import BaseRAGService
+
+# Memory-map index files on load where this FAISS build supports it
+_MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# Bumped whenever the on-disk layout changes, so old files are never misread
+_FORMAT_VERSION = 2
+
+# Files of one stored generation, in the order `_paths` returns them
+_FILES = ("index.faiss", "chunks.json", "bm25.npz")
+
+
+class IndexStore:
+    """On-disk store of built FAISS indexes, their chunk lists and BM25 indexes.
+
+    Each knowledge base gets its own directory, holding one index per
+    (embedding model, chunker, chunk size, chunk overlap, index type) combination
+    so that a change of parameters never loads a stale index. An index's
+    files live in a generation directory named by the key's `.current`
+    pointer file.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @staticmethod
+    def key(
+        embedding_model: str, chunk_size: int, chunk_overlap: int,
+        index_type: str = "auto", chunker: str = "characters",
+    ) -> str:
+        raw = f"v{_FORMAT_VERSION}|{embedding_model}|{chunk_size}|{chunk_overlap}|{index_type}"
+        # Indexes built before chunkers were selectable keep their key
+        if chunker != "characters":
+            raw += f"|{chunker}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _kb_dir(self, kb_id: int) -> str:
+        return os.path.join(self.root, f"kb_{kb_id}")
+
+    def _pointer(self, kb_id: int, key: str) -> str:
+        return os.path.join(self._kb_dir(kb_id), f"{key}.current")
+
+    def _paths(self, kb_id: int, key: str) -> Optional[tuple]:
+        """(index, chunks, bm25) paths of the stored generation; None if nothing is stored"""
+        kb_dir = self._kb_dir(kb_id)
+        try:
+            with open(self._pointer(kb_id, key), encoding="utf-8") as f:
+                generation = os.path.join(kb_dir, f.read().strip())
+        except FileNotFoundError:
+            # Stored before generations: flat files named after the key
+            base = os.path.join(kb_dir, key)
+            paths = (f"{base}.faiss", f"{base}.chunks.json", f"{base}.bm25.npz")
+            return paths if all(os.path.exists(p) for p in paths[:2]) else None
+        return tuple(os.path.join(generation, name) for name in _FILES)
+
+    def exists(self, kb_id: int, key: str) -> bool:
+        return self._paths(kb_id, key) is not None
+
+    def version(self, kb_id: int, key: str) -> Optional[tuple]:
+        """Changes whenever the stored index is replaced; None if nothing is stored"""
+        paths = self._paths(kb_id, key)
+        if paths is None:
+            return None
+        try:
+            stat = os.stat(paths[0])
+        except FileNotFoundError:
+            return None
+        # Every save writes a new file, so its inode changes even within one mtime tick
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def save(self, kb_id: int, key: str, service: BaseRAGService) -> None:
+        """Write the service's index, chunks and BM25 index as a new generation.
+
+        The files go into a fresh directory and the key's pointer file is
+        swapped to it in one rename, so readers see either the old set or
+        the new one, never a mix. The previous generation is removed after.
+        """
+        kb_dir = self._kb_dir(kb_id)
+        os.makedirs(kb_dir, exist_ok=True)
+        previous = self._paths(kb_id, key)
+        generation = tempfile.mkdtemp(prefix=f"{key}.", dir=kb_dir)
+        index_path, chunks_path, lexical_path = (os.path.join(generation, name) for name in _FILES)
+
+        faiss.write_index(service.index, index_path)
+        with open(chunks_path, "w", encoding="utf-8") as f:
+            json.dump(list(service.chunks.items()), f)
+        with open(lexical_path, "wb") as f:
+            np.savez(f, **service.lexical.state())
+        pointer = self._pointer(kb_id, key)
+        with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+            f.write(os.path.basename(generation))
+        os.replace(pointer + ".tmp", pointer)
+        if previous is not None:
+            self._remove(kb_id, previous)
+
+    def load(self, kb_id: int, key: str, service: BaseRAGService, writable: bool = False) -> bool:
+        """Populate `service` from disk; returns False if nothing is stored.
+
+        Indexes are memory-mapped read-only unless `writable` is set, which
+        loads a private copy that can have vectors added or removed.
+        """
+        while True:
+            paths = self._paths(kb_id, key)
+            if paths is None:
+                return False
+            try:
+                self._load(paths, service, writable)
+                return True
+            except (OSError, RuntimeError):
+                # A save removed this generation while it was being read; take the new one
+                if self._paths(kb_id, key) == paths:
+                    raise
+
+    @staticmethod
+    def _load(paths: tuple, service: BaseRAGService, writable: bool) -> None:
+        index_path, chunks_path, lexical_path = paths
+        with open(chunks_path, encoding="utf-8") as f:
+            chunks = {int(chunk_id): text for chunk_id, text in json.load(f)}
+        index = faiss.read_index(index_path, 0 if writable else _MMAP_FLAG)
+        if os.path.exists(lexical_path):
+            with np.load(lexical_path, allow_pickle=False) as state:
+                lexical = BM25Index.from_state(state)
+        else:
+            # Stored before BM25 indexes were; built from the chunks instead
+            lexical = BM25Index.build(list(chunks), list(chunks.values()))
+
+        if writable:
+            index = native_ivf(index)
+        # IVF indexes stored without a direct map get one in memory
+        enable_reconstruct(index)
+        service.index = index
+        service.chunks = chunks
+        # Vectors an HNSW index still holds for deleted chunks
+        ids = stored_ids(index)
+        service.removed = set() if ids is None else set(ids.tolist()) - chunks.keys()
+        service.lexical = lexical
+
+    def _remove(self, kb_id: int, paths: tuple) -> None:
+        generation = os.path.dirname(paths[0])
+        if generation != self._kb_dir(kb_id):
+            shutil.rmtree(generation, ignore_errors=True)
+            return
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def delete(self, kb_id: int, key: Optional[str] = None) -> None:
+        """Remove one stored index, or every index of the knowledge base"""
+        if key is None:
+            shutil.rmtree(self._kb_dir(kb_id), ignore_errors=True)
+            return
+        paths = self._paths(kb_id, key)
+        pointer = self._pointer(kb_id, key)
+        if os.path.exists(pointer):
+            os.remove(pointer)
+        if paths is not None:
+            self._remove(kb_id, paths)
+
+
+index_store = IndexStore(settings.rag_index_dir)
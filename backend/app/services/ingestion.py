@@ -0,0 +1,311 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from sqlalchemy import and_, delete, or_, select, update
+
+from ..config import settings
+from ..database import async_session_maker
+from ..models import Agent, KnowledgeBase, KnowledgeBaseChunk, KnowledgeBaseDocument
+from .index_cache import index_cache
+from .document_store import document_store
+from .index_store import index_store
+from .rag_service import AsyncRAGService
+
+
+@dataclass
+class IngestionJob:
+    """Progress of bringing one knowledge base's index in line with its documents"""
+    kb_id: int
+    status: str = "pending"  # pending | indexing | ready | failed
+    chunks_done: int = 0
+    chunks_total: int = 0
+    error: Optional[str] = None
+    enqueued_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    # Documents changed while this job was running; sync again afterwards
+    rerun: bool = False
+
+
+class IngestionQueue:
+    """Asyncio queue of knowledge bases whose index needs syncing with their documents.
+
+    A sync embeds only documents whose chunks are not all in the stored
+    index yet and removes the vectors of deleted documents; a full rebuild happens only when no
+    index is stored for the knowledge base's current parameters.
+
+    Embedding runs on the event loop through the pooled async client; the
+    blocking chunking, FAISS and disk work is pushed to worker threads.
+
+    Every process runs its own queue, so a job first claims its knowledge
+    base by moving it from pending to indexing in the database; jobs that
+    lose the claim are dropped. A claim is a lease kept alive while the
+    job runs, so one left behind by a crashed process can be taken over.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._jobs: Dict[int, IngestionJob] = {}
+        self._tasks: list = []
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        # Re-queue anything left unfinished by a previous process; only the
+        # worker that wins the claim indexes it
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(KnowledgeBase.id).where(KnowledgeBase.index_status.in_(("pending", "indexing")))
+            )
+            for kb_id in result.scalars().all():
+                self.enqueue(kb_id)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, kb_id: int) -> IngestionJob:
+        job = self._jobs.get(kb_id)
+        if job and job.status == "pending":
+            return job
+        if job and job.status == "indexing":
+            job.rerun = True
+            return job
+        job = IngestionJob(kb_id=kb_id)
+        self._jobs[kb_id] = job
+        self._queue.put_nowait(kb_id)
+        return job
+
+    def get(self, kb_id: int) -> Optional[IngestionJob]:
+        return self._jobs.get(kb_id)
+
+    def pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status in ("pending", "indexing"))
+
+    def discard(self, kb_id: int) -> None:
+        self._jobs.pop(kb_id, None)
+
+    async def _worker(self) -> None:
+        while True:
+            kb_id = await self._queue.get()
+            job = self._jobs.get(kb_id)
+            try:
+                if job is not None:
+                    await self._ingest(job)
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                await self._set_status(kb_id, "failed")
+            finally:
+                if job is not None and job.finished_at is None:
+                    job.finished_at = time.time()
+                if job is not None and job.rerun and self._jobs.get(kb_id) is job:
+                    self.discard(kb_id)
+                    self.enqueue(kb_id)
+                self._queue.task_done()
+
+    async def _ingest(self, job: IngestionJob) -> None:
+        if not await self._claim(job.kb_id):
+            # Deleted, already indexed, or being indexed by another worker
+            self.discard(job.kb_id)
+            return
+        heartbeat = asyncio.create_task(self._heartbeat(job.kb_id))
+        try:
+            await self._sync(job)
+        finally:
+            heartbeat.cancel()
+
+    async def _sync(self, job: IngestionJob) -> None:
+        async with async_session_maker() as db:
+            kb = await db.get(KnowledgeBase, job.kb_id)
+            if not kb:
+                self.discard(job.kb_id)
+                return
+            agent = await db.get(Agent, kb.agent_id) if kb.agent_id else None
+            if not agent:
+                raise ValueError("Knowledge base agent not found")
+            agent_url = agent.url
+            embedding_model = kb.embedding_model or "nomic-embed-text"
+            chunker = kb.chunker
+            chunk_size, chunk_overlap = kb.chunk_size or 500, kb.chunk_overlap or 50
+            index_type = kb.index_type
+
+            doc_ids = await self._document_ids(job.kb_id)
+            chunk_rows = (await db.execute(
+                select(KnowledgeBaseChunk.id, KnowledgeBaseChunk.document_id)
+                .where(KnowledgeBaseChunk.kb_id == job.kb_id)
+            )).all()
+
+        job.status = "indexing"
+        store_key = index_store.key(embedding_model, chunk_size, chunk_overlap, index_type, chunker)
+        service = AsyncRAGService(agent_url, embedding_model, index_type)
+        full_rebuild = not await asyncio.to_thread(
+            index_store.load, job.kb_id, store_key, service, True
+        )
+
+        doc_chunks: Dict[int, list] = {}
+        for chunk_id, doc_id in chunk_rows:
+            doc_chunks.setdefault(doc_id, []).append(chunk_id)
+        # A document is indexed once all its chunks are in the stored index; a
+        # sync that stopped part way leaves rows whose vectors were never saved
+        indexed_docs = set() if full_rebuild else {
+            doc_id for doc_id, ids in doc_chunks.items()
+            if doc_id in doc_ids and all(chunk_id in service.chunks for chunk_id in ids)
+        }
+        live_ids = {chunk_id for doc_id in indexed_docs for chunk_id in doc_chunks[doc_id]}
+        stale_ids = [chunk_id for chunk_id in service.chunks if chunk_id not in live_ids]
+        new_docs = sorted(doc_ids - indexed_docs)
+
+        async with async_session_maker() as db:
+            await db.execute(delete(KnowledgeBaseChunk).where(
+                KnowledgeBaseChunk.kb_id == job.kb_id, KnowledgeBaseChunk.document_id.not_in(indexed_docs)
+            ))
+            await db.commit()
+        # Before adding: SQLite may hand a deleted chunk's id to a new one
+        await service.remove_chunks(stale_ids)
+
+        # Documents are chunked, embedded and stored a slice at a time, so
+        # neither a whole document's chunks nor a write transaction is held
+        # across Ollama calls. Incremental syncs add each slice to the index
+        # as it comes; a full rebuild keeps them until the end, since IVF
+        # indexes are trained on the whole corpus and "auto" picks the index
+        # type by its size.
+        slice_size = settings.rag_embed_batch_size * settings.rag_embed_concurrency
+        rebuild_ids, rebuild_texts, rebuild_embeddings = [], [], []
+        job.chunks_done = job.chunks_total = 0
+        for doc_id in new_docs:
+            async with async_session_maker() as db:
+                content_sha256 = await db.scalar(
+                    select(KnowledgeBaseDocument.content_sha256).where(KnowledgeBaseDocument.id == doc_id)
+                )
+            if content_sha256 is None:
+                continue
+            chunks = service.iter_chunks(document_store.iter_text(content_sha256), chunk_size, chunk_overlap, chunker)
+            chunk_index = 0
+            while batch := await asyncio.to_thread(_take, chunks, slice_size):
+                texts = [text for _, _, text in batch]
+                # Chunks are counted as they are read; the total grows until the last slice
+                job.chunks_total += len(batch)
+                done = job.chunks_done
+
+                def progress(embedded: int, total: int) -> None:
+                    job.chunks_done = done + embedded
+
+                embeddings = await service.embed_chunks(texts, progress_callback=progress)
+
+                # Insert chunk rows to allocate their ids, which become the vector ids
+                async with async_session_maker() as db:
+                    rows = [
+                        KnowledgeBaseChunk(
+                            kb_id=job.kb_id, document_id=doc_id, chunk_index=chunk_index + i,
+                            start_offset=start, end_offset=end,
+                        )
+                        for i, (start, end, _) in enumerate(batch)
+                    ]
+                    db.add_all(rows)
+                    await db.flush()
+                    ids = [row.id for row in rows]
+                    await db.commit()
+                chunk_index += len(batch)
+
+                if full_rebuild:
+                    rebuild_ids.extend(ids)
+                    rebuild_texts.extend(texts)
+                    rebuild_embeddings.append(embeddings)
+                else:
+                    await service.add_embedded_chunks(ids, texts, embeddings)
+
+        if full_rebuild:
+            if not rebuild_ids:
+                raise ValueError("Knowledge base has no content to index")
+            await service.add_embedded_chunks(rebuild_ids, rebuild_texts, np.vstack(rebuild_embeddings))
+            # Drops indexes stored under other parameters too
+            await asyncio.to_thread(index_store.delete, job.kb_id)
+        await asyncio.to_thread(index_store.save, job.kb_id, store_key, service)
+
+        if not job.rerun and await self._document_ids(job.kb_id) != doc_ids:
+            # Documents changed through another process while we were syncing
+            job.rerun = True
+        if job.rerun:
+            # More changes are queued; stay pending until they are indexed
+            if not await self._set_status(job.kb_id, "pending"):
+                await asyncio.to_thread(index_store.delete, job.kb_id)
+                self.discard(job.kb_id)
+                return
+            job.status = "pending"
+            return
+        if not await self._set_status(job.kb_id, "ready"):
+            # Deleted while we were indexing
+            await asyncio.to_thread(index_store.delete, job.kb_id)
+            self.discard(job.kb_id)
+            return
+        index_cache.pop(job.kb_id)
+        job.status = "ready"
+        job.finished_at = time.time()
+
+    @staticmethod
+    async def _claim(kb_id: int) -> bool:
+        """Atomically take a pending knowledge base, or one whose claim has lapsed"""
+        now = _utcnow()
+        lapsed = now - timedelta(seconds=settings.rag_ingest_lease)
+        async with async_session_maker() as db:
+            result = await db.execute(
+                update(KnowledgeBase)
+                .where(
+                    KnowledgeBase.id == kb_id,
+                    or_(
+                        KnowledgeBase.index_status == "pending",
+                        and_(KnowledgeBase.index_status == "indexing", KnowledgeBase.update_datetime < lapsed),
+                    ),
+                )
+                .values(index_status="indexing", update_datetime=now)
+            )
+            await db.commit()
+            return result.rowcount == 1
+
+    @staticmethod
+    async def _heartbeat(kb_id: int) -> None:
+        while True:
+            await asyncio.sleep(settings.rag_ingest_lease / 3)
+            async with async_session_maker() as db:
+                await db.execute(
+                    update(KnowledgeBase)
+                    .where(KnowledgeBase.id == kb_id, KnowledgeBase.index_status == "indexing")
+                    .values(update_datetime=_utcnow())
+                )
+                await db.commit()
+
+    @staticmethod
+    async def _document_ids(kb_id: int) -> set:
+        async with async_session_maker() as db:
+            return set((await db.execute(
+                select(KnowledgeBaseDocument.id).where(KnowledgeBaseDocument.kb_id == kb_id)
+            )).scalars().all())
+
+    @staticmethod
+    async def _set_status(kb_id: int, status: str) -> bool:
+        async with async_session_maker() as db:
+            kb = await db.get(KnowledgeBase, kb_id)
+            if not kb:
+                return False
+            kb.index_status = status
+            await db.commit()
+            return True
+
+
+def _take(items: Iterator, n: int) -> List:
+    return list(islice(items, n))
+
+
+def _utcnow() -> datetime:
+    # Naive UTC, like the timestamps SQLite's CURRENT_TIMESTAMP stores
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+ingestion_queue = IngestionQueue(settings.rag_ingest_workers)
@@ -0,0 +1,110 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select
+
+from ..config import settings
+from ..database import async_session_maker
+from ..models import Agent, Message
+from .model_stats import model_stats
+
+
+class MessageWriter:
+    """Persists messages produced by chat streams in the background.
+
+    One task drains the queue; everything queued while a transaction is in
+    flight goes into the next one, so under load many finished streams
+    share a single commit instead of paying one each.
+    """
+
+    def __init__(self, batch_size: int = 64):
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Write everything still queued, then stop"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    def write(self, **fields) -> asyncio.Future:
+        """Queue a Message; an `agent_url` field is resolved to its agent_id.
+
+        The returned future resolves to whether the row was committed, so a
+        caller can hold back until the message is visible to other sessions.
+        """
+        done = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fields, done))
+        return done
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            stopping = item is None
+            batch = [] if stopping else [item]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if batch:
+                await self._write(batch)
+            if stopping and self._queue.empty():
+                return
+
+    async def _write(self, batch: List[Tuple[dict, asyncio.Future]]) -> None:
+        try:
+            async with async_session_maker() as db:
+                agent_ids = {}
+                if any(fields.get("agent_url") for fields, _ in batch):
+                    agents = await db.execute(select(Agent.id, Agent.url))
+                    agent_ids = {url.rstrip("/"): agent_id for agent_id, url in agents}
+                messages = []
+                for fields, _ in batch:
+                    fields = dict(fields)
+                    agent_url = fields.pop("agent_url", None)
+                    if agent_url:
+                        fields["agent_id"] = agent_ids.get(agent_url.rstrip("/"))
+                    messages.append(Message(**fields))
+                db.add_all(messages)
+                await model_stats.record(db, messages)
+                await db.commit()
+            self.written += len(batch)
+            self.batches += 1
+            _resolve(batch, True)
+            return
+        except Exception:
+            if len(batch) == 1:
+                self.failed += 1
+                _resolve(batch, False)
+                return
+        # Retry one by one so a single bad row doesn't drop the whole batch
+        for item in batch:
+            await self._write([item])
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+        }
+
+
+def _resolve(batch: List[Tuple[dict, asyncio.Future]], committed: bool) -> None:
+    for _, done in batch:
+        if not done.done():
+            done.set_result(committed)
+
+
+message_writer = MessageWriter(settings.chat_write_batch_size)
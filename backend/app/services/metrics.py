@@ -0,0 +1,212 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Fixed-bucket histogram; an observation is one bisect and a few adds"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last)], sum
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class MetricsRegistry:
+    """Metrics rendered in the Prometheus text exposition format.
+
+    Besides counters and histograms updated on the hot paths, collectors
+    are called at scrape time to export state the services already keep
+    (cache counters, queue depths), so those cost nothing per request.
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Optional[Sequence[float]] = None
+    ) -> Histogram:
+        metric = Histogram(name, help, labels, buckets or LATENCY_BUCKETS)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable) -> Callable:
+        """Register `fn` returning (name, type, help, labels, value) samples"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        # Collectors may interleave families; each must be rendered as one group
+        families: Dict[str, Tuple[str, str, List[str]]] = {}
+        for collect in self._collectors:
+            try:
+                samples = list(collect())
+            except Exception:
+                continue
+            for name, kind, help, labels, value in samples:
+                family = families.setdefault(name, (kind, help, []))
+                family[2].append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        for name, (kind, help, samples) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response body is complete",
+    ["method", "route", "status"],
+)
+db_session_duration = metrics.histogram(
+    "db_session_duration_seconds", "Time a request-scoped database session stays open",
+)
+ollama_queue_wait = metrics.histogram(
+    "ollama_queue_wait_seconds", "Time a generation request waits for a slot on an agent",
+    ["agent"],
+)
+ollama_time_to_first_token = metrics.histogram(
+    "ollama_time_to_first_token_seconds", "Time from sending a chat request to the first streamed token",
+    ["agent", "model"],
+)
+ollama_tokens_per_second = metrics.histogram(
+    "ollama_tokens_per_second", "Generation speed from Ollama's eval_count/eval_duration",
+    ["agent", "model"], RATE_BUCKETS,
+)
+ollama_generated_tokens = metrics.counter(
+    "ollama_generated_tokens_total", "Tokens generated, from Ollama's eval_count", ["agent", "model"],
+)
+ollama_errors = metrics.counter(
+    "ollama_errors_total", "Failed Ollama chat requests", ["agent"],
+)
+embedding_duration = metrics.histogram(
+    "rag_embedding_duration_seconds", "Latency of Ollama /api/embed calls", ["agent", "model"],
+)
+embedding_batch_size = metrics.histogram(
+    "rag_embedding_batch_size", "Texts per Ollama /api/embed call", ["model"], SIZE_BUCKETS,
+)
+faiss_search_duration = metrics.histogram(
+    "rag_faiss_search_duration_seconds", "FAISS index search time", ["index"],
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request until its body is fully sent.
+
+    Requests are labelled by route template (``/api/chats/{chat_id}``), not
+    the raw path, so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], route, status)
@@ -0,0 +1,306 @@
+from bisect import bisect_left
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, delete, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Agent, Chat, Message, ModelStatsBucket, ModelStatsDaily
+
+# A reply whose load_duration exceeds this had to load the model first
+COLD_LOAD_NS = 500_000_000
+
+# Bucket upper bounds per histogram; larger values land in one overflow bucket
+BUCKETS: Dict[str, Tuple[float, ...]] = {
+    "latency_ms": (100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000, 60000, 120000, 300000),
+    "tokens_per_second": (1, 2, 5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200, 500),
+    "prompt_tokens": (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 131072),
+}
+
+_SUMMED = (
+    "messages", "total_duration_sum", "load_duration_sum", "cold_loads",
+    "prompt_eval_count_sum", "eval_count_sum", "eval_duration_sum",
+)
+
+
+def _observations(message: Message) -> Dict[str, float]:
+    values = {"latency_ms": message.total_duration / 1e6}
+    if message.eval_count and message.eval_duration:
+        values["tokens_per_second"] = message.eval_count * 1e9 / message.eval_duration
+    if message.prompt_eval_count is not None:
+        values["prompt_tokens"] = message.prompt_eval_count
+    return values
+
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+async def _upsert(
+    db: AsyncSession, table, rows: List[dict], keys: Sequence[str], merge: Callable[[object], dict]
+) -> None:
+    """Insert `rows`, merging into existing rows with the same `keys`.
+
+    `merge(new)` maps the columns to update to their merged values, where
+    `new.<column>` is the value being inserted.
+    """
+    upsert_insert = _UPSERT_INSERTS.get(db.bind.dialect.name)
+    if upsert_insert is not None:
+        stmt = upsert_insert(table).values(rows)
+        await db.execute(stmt.on_conflict_do_update(index_elements=keys, set_=merge(stmt.excluded)))
+        return
+    # Elsewhere, update each row in place and insert the ones not there yet
+    for row in rows:
+        new = SimpleNamespace(**{name: literal(value) for name, value in row.items()})
+        result = await db.execute(
+            update(table).where(*(getattr(table, key) == row[key] for key in keys)).values(merge(new))
+        )
+        if result.rowcount == 0:
+            await db.execute(insert(table).values(row))
+
+
+def _least(current, new):
+    # Two-argument min()/max() are SQLite's LEAST()/GREATEST(); CASE works
+    # everywhere, and takes `new` while `current` is still NULL
+    return case((current <= new, current), else_=new)
+
+
+def _greatest(current, new):
+    return case((current >= new, current), else_=new)
+
+
+def _percentile(
+    buckets: Dict[int, Tuple[int, Optional[float], Optional[float]]], bounds: Sequence[float], q: float
+) -> Optional[float]:
+    """Estimate a percentile from (count, min, max) per bucket.
+
+    Values are taken to spread evenly between the smallest and largest one
+    seen in the bucket that holds the percentile, so the estimate stays
+    within the observed range. Rows recorded before min/max were kept fall
+    back to the bucket bounds.
+    """
+    total = sum(count for count, _, _ in buckets.values())
+    if not total:
+        return None
+    target, seen = q * total, 0
+    for bucket in sorted(buckets):
+        count, low, high = buckets[bucket]
+        if seen + count >= target:
+            if low is None or high is None:
+                low = bounds[bucket - 1] if bucket else 0
+                high = bounds[bucket] if bucket < len(bounds) else low
+            return low + (high - low) * (target - seen) / count
+        seen += count
+    return float(bounds[-1])
+
+
+class ModelStats:
+    """Per agent/model/day analytics over the Ollama stats on messages.
+
+    Every assistant reply with stats is folded into `model_stats_daily`
+    and `model_stats_bucket` in the same transaction that saves it, so
+    reports aggregate a few rows per day instead of scanning messages.
+    Percentiles come from the bucket counts and the smallest and largest
+    value seen in each bucket. `rebuild` recomputes both
+    tables from the message table with SQL aggregation.
+    """
+
+    async def record(self, db: AsyncSession, messages: Iterable[Message]) -> None:
+        day = datetime.now(timezone.utc).date()
+        daily: Dict[tuple, dict] = {}
+        buckets: Dict[tuple, list] = {}
+        for message in messages:
+            if message.role != "assistant" or not message.total_duration or not message.model:
+                continue
+            key = (day, message.agent_id or 0, message.model)
+            row = daily.setdefault(key, dict.fromkeys(_SUMMED, 0) | {"prompt_eval_count_max": 0})
+            row["messages"] += 1
+            row["total_duration_sum"] += message.total_duration
+            row["load_duration_sum"] += message.load_duration or 0
+            row["cold_loads"] += (message.load_duration or 0) > COLD_LOAD_NS
+            row["prompt_eval_count_sum"] += message.prompt_eval_count or 0
+            row["prompt_eval_count_max"] = max(row["prompt_eval_count_max"], message.prompt_eval_count or 0)
+            row["eval_count_sum"] += message.eval_count or 0
+            row["eval_duration_sum"] += message.eval_duration or 0
+            for metric, value in _observations(message).items():
+                bucket_key = (*key, metric, bisect_left(BUCKETS[metric], value))
+                bucket = buckets.setdefault(bucket_key, [0, value, value])
+                bucket[0] += 1
+                bucket[1] = min(bucket[1], value)
+                bucket[2] = max(bucket[2], value)
+        if not daily:
+            return
+
+        await _upsert(
+            db, ModelStatsDaily,
+            [{"day": d, "agent_id": a, "model_name": m, **row} for (d, a, m), row in daily.items()],
+            ["day", "agent_id", "model_name"],
+            lambda new: {
+                **{name: getattr(ModelStatsDaily, name) + getattr(new, name) for name in _SUMMED},
+                "prompt_eval_count_max": _greatest(
+                    ModelStatsDaily.prompt_eval_count_max, new.prompt_eval_count_max
+                ),
+            },
+        )
+        await _upsert(
+            db, ModelStatsBucket,
+            [
+                {
+                    "day": d, "agent_id": a, "model_name": m, "metric": metric, "bucket": b,
+                    "count": count, "min_value": low, "max_value": high,
+                }
+                for (d, a, m, metric, b), (count, low, high) in buckets.items()
+            ],
+            ["day", "agent_id", "model_name", "metric", "bucket"],
+            lambda new: {
+                "count": ModelStatsBucket.count + new.count,
+                "min_value": _least(ModelStatsBucket.min_value, new.min_value),
+                "max_value": _greatest(ModelStatsBucket.max_value, new.max_value),
+            },
+        )
+
+    async def rebuild(self, db: AsyncSession) -> int:
+        """Recompute the rollup from all stored messages; returns the number of day rows"""
+        await db.execute(delete(ModelStatsBucket))
+        await db.execute(delete(ModelStatsDaily))
+
+        day = func.date(Message.create_datetime)
+        # Replies saved before messages recorded their agent/model fall back to the chat's
+        agent_id = func.coalesce(Message.agent_id, Chat.agent_id, 0)
+        model_name = func.coalesce(Message.model, Chat.model_name)
+        load = func.coalesce(Message.load_duration, 0)
+        prompt = func.coalesce(Message.prompt_eval_count, 0)
+
+        def replies(*columns):
+            return (
+                select(*columns)
+                .join(Chat, Chat.id == Message.chat_id)
+                .where(Message.role == "assistant", Message.total_duration > 0, model_name.is_not(None))
+            )
+
+        await db.execute(insert(ModelStatsDaily).from_select(
+            ["day", "agent_id", "model_name", *_SUMMED, "prompt_eval_count_max"],
+            replies(
+                day, agent_id, model_name,
+                func.count(),
+                func.sum(Message.total_duration),
+                func.sum(load),
+                func.sum(case((load > COLD_LOAD_NS, 1), else_=0)),
+                func.sum(prompt),
+                func.sum(func.coalesce(Message.eval_count, 0)),
+                func.sum(func.coalesce(Message.eval_duration, 0)),
+                func.max(prompt),
+            ).group_by(day, agent_id, model_name),
+        ))
+
+        values = {
+            "latency_ms": (Message.total_duration / 1e6, Message.total_duration > 0),
+            "tokens_per_second": (
+                Message.eval_count * 1e9 / Message.eval_duration,
+                (Message.eval_count > 0) & (Message.eval_duration > 0),
+            ),
+            "prompt_tokens": (Message.prompt_eval_count, Message.prompt_eval_count.is_not(None)),
+        }
+        for metric, (value, present) in values.items():
+            # Same index as bisect_left(BUCKETS[metric], value)
+            bucket = sum((case((value > bound, 1), else_=0) for bound in BUCKETS[metric]), literal(0))
+            await db.execute(insert(ModelStatsBucket).from_select(
+                ["day", "agent_id", "model_name", "metric", "bucket", "count", "min_value", "max_value"],
+                replies(
+                    day, agent_id, model_name, literal(metric), bucket,
+                    func.count(), func.min(value), func.max(value),
+                )
+                .where(present)
+                .group_by(day, agent_id, model_name, bucket),
+            ))
+
+        await db.commit()
+        return await db.scalar(select(func.count()).select_from(ModelStatsDaily))
+
+    async def report(
+        self,
+        db: AsyncSession,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        agent_id: Optional[int] = None,
+        model_name: Optional[str] = None,
+        by_day: bool = True,
+    ) -> List[dict]:
+        """Latency, speed, load and prompt size per agent/model (and day)"""
+        end = end or datetime.now(timezone.utc).date()
+        start = start or end - timedelta(days=29)
+
+        def grouped(table, *columns, extra: Sequence = ()):
+            keys = [table.agent_id, table.model_name] + ([table.day] if by_day else [])
+            stmt = select(*keys, *extra, *columns).where(table.day >= start, table.day <= end)
+            if agent_id is not None:
+                stmt = stmt.where(table.agent_id == agent_id)
+            if model_name is not None:
+                stmt = stmt.where(table.model_name == model_name)
+            return stmt.group_by(*keys, *extra)
+
+        daily = await db.execute(
+            grouped(
+                ModelStatsDaily,
+                *[func.sum(getattr(ModelStatsDaily, name)) for name in _SUMMED],
+                func.max(ModelStatsDaily.prompt_eval_count_max),
+            ).order_by(*([ModelStatsDaily.day.desc()] if by_day else []), ModelStatsDaily.model_name)
+        )
+        histograms: Dict[tuple, Dict[str, Dict[int, tuple]]] = {}
+        buckets = await db.execute(grouped(
+            ModelStatsBucket,
+            func.sum(ModelStatsBucket.count),
+            func.min(ModelStatsBucket.min_value),
+            func.max(ModelStatsBucket.max_value),
+            extra=(ModelStatsBucket.metric, ModelStatsBucket.bucket),
+        ))
+        for *key, metric, bucket, count, low, high in buckets:
+            histograms.setdefault(tuple(key), {}).setdefault(metric, {})[bucket] = (count, low, high)
+
+        names = dict((await db.execute(select(Agent.id, Agent.name))).all())
+        rows = []
+        for row in daily:
+            key = tuple(row[:3 if by_day else 2])
+            sums = dict(zip(_SUMMED, row[len(key):len(key) + len(_SUMMED)]))
+            prompt_max = row[-1]
+            counts = histograms.get(key, {})
+
+            def pct(metric: str, q: float) -> Optional[float]:
+                value = _percentile(counts.get(metric, {}), BUCKETS[metric], q)
+                return round(value, 1) if value is not None else None
+
+            n = sums["messages"]
+            rows.append({
+                **({"day": key[2]} if by_day else {}),
+                "agent_id": key[0],
+                "agent_name": names.get(key[0]),
+                "model_name": key[1],
+                "messages": n,
+                "latency_ms": {
+                    "avg": round(sums["total_duration_sum"] / n / 1e6, 1),
+                    "p50": pct("latency_ms", 0.5),
+                    "p95": pct("latency_ms", 0.95),
+                },
+                "tokens_per_second": {
+                    "avg": round(sums["eval_count_sum"] * 1e9 / sums["eval_duration_sum"], 1)
+                    if sums["eval_duration_sum"] else None,
+                    "p50": pct("tokens_per_second", 0.5),
+                    "p95": pct("tokens_per_second", 0.95),
+                },
+                "load": {
+                    "cold_loads": sums["cold_loads"],
+                    "cold_load_rate": round(sums["cold_loads"] / n, 4),
+                    "avg_ms": round(sums["load_duration_sum"] / n / 1e6, 1),
+                },
+                "prompt_tokens": {
+                    "avg": round(sums["prompt_eval_count_sum"] / n, 1),
+                    "p95": pct("prompt_tokens", 0.95),
+                    "max": prompt_max,
+                },
+            })
+        return rows
+
+
+model_stats = ModelStats()
@@ -1,76 +1,253 @@
+import asyncio
+import sys
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
 import numpy as np
 import faiss
-import requests
-from typing import List, Optional
+import httpx
+
+from ..config import settings
+from .agent_clients import agent_clients
+from .bm25 import BM25Index, reciprocal_rank_fusion
+from .chunking import iter_chunks
+from .embedding_cache import embedding_cache
+from .faiss_index import create_index, index_nbytes, remove_ids, search_params
+from .lru_cache import LRUCache
+from .metrics import embedding_batch_size, embedding_duration, faiss_search_duration
+from .scheduler import agent_scheduler
+
+# Called as progress_callback(chunks_embedded, total_chunks)
+ProgressCallback = Callable[[int, int], None]
+
+# (agent url, embedding model, normalized query) -> query embedding
+query_embedding_cache = LRUCache(settings.rag_query_cache_size, settings.rag_query_cache_ttl)
+
+# Share of an index's vectors that may be tombstoned before it is compacted
+COMPACT_RATIO = 0.25
+
+
+def maximal_marginal_relevance(
+    query: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    lambda_: float = 0.5,
+    relevance: Optional[np.ndarray] = None,
+) -> List[int]:
+    """Pick k rows of `vectors`, each maximizing
+    lambda * relevance - (1 - lambda) * max cosine similarity to those already picked.
 
+    Relevance is cosine similarity with `query`. Other scores passed as
+    `relevance` (e.g. fused ranks) keep their order but are mapped onto the
+    range of those cosine similarities, so both terms share a scale.
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    cosine = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    if relevance is None:
+        relevance = cosine
+    else:
+        span = float(relevance.max() - relevance.min())
+        scale = (cosine.max() - cosine.min()) / span if span > 0 else 0.0
+        relevance = cosine.max() - (relevance.max() - relevance) * scale
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    for _ in range(min(k, len(vectors)) - 1):
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
 
-class RAGService:
-    """Service for RAG operations: chunking, embedding, retrieval"""
 
-    def __init__(self, agent_url: str, embedding_model: str = "nomic-embed-text"):
+class BaseRAGService:
+    """Chunking, index construction and search, independent of how embeddings are fetched"""
+
+    def __init__(
+        self,
+        agent_url: str,
+        embedding_model: str = "nomic-embed-text",
+        index_type: str = "auto",
+    ):
         self.agent_url = agent_url
         self.embedding_model = embedding_model
+        self.index_type = index_type
         self.index = None
-        self.chunks = []
-
-    def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        start = 0
-        text_length = len(text)
+        # FAISS vector id -> chunk text
+        self.chunks: Dict[int, str] = {}
+        # Keyword index over the same chunks, for hybrid retrieval
+        self.lexical = BM25Index()
+        # Ids still in an index that cannot remove vectors (HNSW), filtered
+        # out of results until the next compaction
+        self.removed: Set[int] = set()
+        self.embedding_cache = embedding_cache
 
-        while start < text_length:
-            end = start + chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start += (chunk_size - overlap)
+    def iter_chunks(
+        self, pieces: Iterable[str], chunk_size: int = 500, overlap: int = 50, chunker: str = "characters"
+    ) -> Iterator[Tuple[int, int, str]]:
+        """Yield (start, end, text) overlapping chunks from a stream of text pieces.
 
-        return chunks
+        Only the unconsumed tail of the stream is buffered, so a document
+        never has to be held in memory as one string. See `chunking` for
+        the chunkers; sizes are in characters or (estimated) tokens.
+        """
+        return iter_chunks(pieces, chunk_size, overlap, chunker)
 
-    def get_embedding(self, text: str) -> np.ndarray:
-        """Get embedding from Ollama API"""
-        url = f"{self.agent_url}/api/embed"
-        payload = {
-            "model": self.embedding_model,
-            "input": text
-        }
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        result = response.json()
+    @staticmethod
+    def _parse_embeddings(result: dict, expected: int) -> np.ndarray:
         if "embeddings" in result:
-            embedding = result["embeddings"][0] if isinstance(result["embeddings"][0], list) else result["embeddings"]
+            embeddings = np.asarray(result["embeddings"], dtype="float32")
         elif "embedding" in result:
-            embedding = result["embedding"]
+            embeddings = np.asarray(result["embedding"], dtype="float32")
         else:
             raise ValueError(f"Unexpected response format from Ollama: {result}")
-        return np.array(embedding, dtype="float32")
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        if embeddings.shape[0] != expected:
+            raise ValueError(
+                f"Ollama returned {embeddings.shape[0]} embeddings for {expected} inputs"
+            )
+        return embeddings
 
-    def build_index(self, chunks: List[str]) -> None:
-        """Build FAISS index from text chunks."""
-        self.chunks = chunks
+    def _lookup_cached(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        if self.embedding_cache is None:
+            return [None] * len(texts)
+        return self.embedding_cache.get_many(self.embedding_model, texts)
 
-        embeddings = []
-        for chunk in chunks:
-            emb = self.get_embedding(chunk)
-            embeddings.append(emb)
+    def _store_cached(self, texts: List[str], embeddings: np.ndarray) -> None:
+        if self.embedding_cache is not None and len(texts):
+            self.embedding_cache.put_many(self.embedding_model, texts, embeddings)
 
-        embeddings_array = np.array(embeddings).astype("float32")
-        dimension = embeddings_array.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(embeddings_array)
+    @staticmethod
+    def _merge_cached(cached: List[Optional[np.ndarray]], fresh: np.ndarray) -> np.ndarray:
+        fresh_rows = iter(fresh)
+        return np.vstack([c if c is not None else next(fresh_rows) for c in cached])
 
-    def retrieve(self, query: str, k: int = 3) -> List[tuple]:
-        """Retrieve top-k most relevant chunks"""
-        if self.index is None or len(self.chunks) == 0:
-            return []
+    def _query_key(self, query: str) -> tuple:
+        return (self.agent_url, self.embedding_model, " ".join(query.split()))
 
-        query_embedding = self.get_embedding(query)
-        query_embedding = query_embedding.reshape(1, -1)
+    @staticmethod
+    def _batches(chunks: List[str], batch_size: Optional[int]) -> List[List[str]]:
+        batch_size = max(1, batch_size or settings.rag_embed_batch_size)
+        return [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+
+    def _set_index(self, ids: Sequence[int], chunks: List[str], embeddings: np.ndarray) -> None:
+        self.index = create_index(embeddings, self.index_type, ids)
+        self.chunks = dict(zip(ids, chunks))
+        self.lexical = BM25Index.build(ids, chunks)
+        self.removed = set()
+
+    def _add_to_index(self, ids: Sequence[int], chunks: List[str], embeddings: np.ndarray) -> None:
+        if self.index is None:
+            self._set_index(ids, chunks, embeddings)
+            return
+        if not self.removed.isdisjoint(ids):
+            # A tombstoned id is being reused; its old vector must go first
+            self._compact()
+        self.index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+        self.chunks.update(zip(ids, chunks))
+        self.lexical.add(ids, chunks)
+
+    def _remove_from_index(self, ids: Sequence[int]) -> None:
+        """Drop vectors by id, tombstoning them where the index cannot remove (HNSW)"""
+        try:
+            remove_ids(self.index, ids)
+        except RuntimeError:
+            self.removed.update(ids)
+        for chunk_id in ids:
+            self.chunks.pop(chunk_id, None)
+        self.lexical.remove(ids)
+        if len(self.removed) > COMPACT_RATIO * self.index.ntotal:
+            self._compact()
 
+    def _compact(self) -> None:
+        """Rebuild the index from its live vectors, dropping tombstoned ones"""
+        ids = list(self.chunks)
+        if ids:
+            embeddings = self.index.reconstruct_batch(np.asarray(ids, dtype="int64"))
+            self.index = create_index(embeddings, self.index_type, ids)
+        else:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.index.d))
+        self.removed = set()
+
+    def _search(
+        self,
+        query_embedding: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        query: Optional[str] = None,
+        mmr: bool = False,
+    ) -> List[tuple]:
+        """Top-k (chunk, L2 distance) pairs.
+
+        Given the query text, dense and BM25 candidates are fused with
+        reciprocal rank fusion, so chunks matching rare identifiers exactly
+        are found even when their embeddings are not among the nearest.
+        With `mmr`, the top k are then picked from the candidates by maximal
+        marginal relevance, skipping near-duplicates of chunks already chosen.
+        """
+        query_embedding = query_embedding.reshape(1, -1)
         k = min(k, len(self.chunks))
-        distances, indices = self.index.search(query_embedding, k)
+        hybrid = query is not None and len(self.lexical) > 0
+        fetch = max(
+            k,
+            settings.rag_hybrid_candidates if hybrid else 0,
+            settings.rag_mmr_candidates if mmr else 0,
+        )
+        fetch = min(fetch, len(self.chunks))
+        # Tombstoned vectors can take up to len(removed) of the nearest slots
+        fetch_dense = min(fetch + len(self.removed), self.index.ntotal)
+        params = search_params(
+            self.index,
+            nprobe or settings.rag_ivf_nprobe,
+            ef_search or settings.rag_hnsw_ef_search,
+        )
+        with faiss_search_duration.time(self.index_type):
+            distances, indices = self.index.search(query_embedding, fetch_dense, params=params)
+
+        # Approximate indexes return -1 when fewer than k neighbours were visited
+        dense = {int(i): float(d) for i, d in zip(indices[0], distances[0]) if int(i) in self.chunks}
+        dense = dict(list(dense.items())[:fetch])
+        ids, relevance = list(dense), None
+        if hybrid:
+            lexical = [i for i, _ in self.lexical.search(query, fetch) if i in self.chunks]
+            fused = reciprocal_rank_fusion([ids, lexical], settings.rag_rrf_k)
+            ids = [i for i, _ in fused]
+            relevance = np.array([score for _, score in fused])
+
+        if mmr and len(ids) > k:
+            vectors = self._vectors(ids)
+            if vectors is not None:
+                order = maximal_marginal_relevance(
+                    query_embedding[0], vectors, k, settings.rag_mmr_lambda, relevance
+                )
+                ids = [ids[i] for i in order]
+        ids = ids[:k]
 
-        return [(self.chunks[i[0]], i[1]) for i in zip(indices[0], distances[0])]
+        missing = [i for i in ids if i not in dense]
+        if missing:
+            vectors = self._vectors(missing)
+            for n, chunk_id in enumerate(missing):
+                dense[chunk_id] = (
+                    float(((vectors[n] - query_embedding[0]) ** 2).sum()) if vectors is not None else float("nan")
+                )
+        return [(self.chunks[i], dense[i]) for i in ids]
+
+    def _vectors(self, ids: Sequence[int]) -> Optional[np.ndarray]:
+        """Stored vectors of `ids` (approximate for PQ); None if the index cannot reconstruct them"""
+        try:
+            return self.index.reconstruct_batch(np.asarray(ids, dtype="int64"))
+        except RuntimeError:
+            return None
+
+    def nbytes(self) -> int:
+        """Approximate resident size of the index and chunk list"""
+        size = sys.getsizeof(self.chunks) + sum(sys.getsizeof(c) for c in self.chunks.values())
+        size += sys.getsizeof(self.removed)
+        if self.index is not None:
+            size += index_nbytes(self.index)
+        return size + self.lexical.nbytes()
 
     def augment_prompt(self, query: str, context_chunks: List[str], rag_prompt: str) -> str:
         """Create augmented prompt with context"""
@@ -80,3 +257,132 @@ class RAGService:
         augmented_prompt = augmented_prompt.replace("[query]", query)
 
         return augmented_prompt
+
+
+class AsyncRAGService(BaseRAGService):
+    """RAG service for use on the event loop.
+
+    Embeddings go through the agent's pooled httpx client; FAISS index
+    construction and search run in the default thread pool executor.
+    """
+
+    def __init__(
+        self,
+        agent_url: str,
+        embedding_model: str = "nomic-embed-text",
+        index_type: str = "auto",
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        super().__init__(agent_url, embedding_model, index_type)
+        self._client = client
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client or agent_clients.get(self.agent_url)
+
+    async def get_embeddings(self, texts: List[str], user_id: Optional[int] = None) -> np.ndarray:
+        """Embed a batch of texts, calling Ollama only for those not in the embedding cache"""
+        cached = await asyncio.to_thread(self._lookup_cached, texts)
+        missing = [t for t, c in zip(texts, cached) if c is None]
+        fresh = (
+            await self._request_embeddings(missing, user_id)
+            if missing else np.empty((0, 0), dtype="float32")
+        )
+        await asyncio.to_thread(self._store_cached, missing, fresh)
+        return self._merge_cached(cached, fresh)
+
+    async def _request_embeddings(self, texts: List[str], user_id: Optional[int] = None) -> np.ndarray:
+        url = f"{self.agent_url}/api/embed"
+        payload = {
+            "model": self.embedding_model,
+            "input": texts
+        }
+        # Requests on behalf of a user are refused when the agent is saturated;
+        # background indexing queues in a lane of its own
+        embedding_batch_size.observe(len(texts), self.embedding_model)
+        async with agent_scheduler.slot(self.agent_url, user_id or "ingestion", shed=user_id is not None):
+            with embedding_duration.time(self.agent_url, self.embedding_model):
+                response = await self.client.post(url, json=payload, timeout=agent_clients.timeout("embed"))
+        response.raise_for_status()
+        return self._parse_embeddings(response.json(), len(texts))
+
+    async def embed_chunks(
+        self,
+        chunks: List[str],
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> np.ndarray:
+        """Embed chunks in batches, with up to `concurrency` batches in flight"""
+        semaphore = asyncio.Semaphore(max(1, concurrency or settings.rag_embed_concurrency))
+        batches = self._batches(chunks, batch_size)
+        done = 0
+
+        async def embed_batch(batch_no: int) -> np.ndarray:
+            nonlocal done
+            async with semaphore:
+                embeddings = await self.get_embeddings(batches[batch_no])
+            done += len(batches[batch_no])
+            if progress_callback:
+                progress_callback(done, len(chunks))
+            return embeddings
+
+        results = await asyncio.gather(*(embed_batch(i) for i in range(len(batches))))
+        return np.vstack(results).astype("float32")
+
+    async def build_index(
+        self,
+        chunks: List[str],
+        ids: Optional[Sequence[int]] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> None:
+        """Build FAISS index from text chunks, addressed by `ids` (default 0..n-1)."""
+        ids = list(range(len(chunks))) if ids is None else list(ids)
+        embeddings_array = await self.embed_chunks(chunks, batch_size, concurrency, progress_callback)
+        await asyncio.to_thread(self._set_index, ids, chunks, embeddings_array)
+
+    async def add_embedded_chunks(
+        self, ids: Sequence[int], chunks: List[str], embeddings: np.ndarray
+    ) -> None:
+        """Add already-embedded chunks without touching existing vectors"""
+        await asyncio.to_thread(self._add_to_index, list(ids), chunks, embeddings)
+
+    async def remove_chunks(self, ids: Sequence[int]) -> None:
+        """Remove chunks from the index by id"""
+        ids = [i for i in ids if i in self.chunks]
+        if ids:
+            await asyncio.to_thread(self._remove_from_index, ids)
+
+    async def retrieve(
+        self,
+        query: str,
+        k: int = 3,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        user_id: Optional[int] = None,
+        hybrid: Optional[bool] = None,
+        mmr: Optional[bool] = None,
+    ) -> List[tuple]:
+        """Retrieve top-k most relevant chunks"""
+        if self.index is None or len(self.chunks) == 0:
+            return []
+
+        query_embedding = await self.embed_query(query, user_id)
+        text = query if (settings.rag_hybrid_search if hybrid is None else hybrid) else None
+        mmr = settings.rag_mmr if mmr is None else mmr
+        return await asyncio.to_thread(self._search, query_embedding, k, nprobe, ef_search, text, mmr)
+
+    async def embed_query(self, query: str, user_id: Optional[int] = None) -> np.ndarray:
+        """Embed a query, reusing recent embeddings of the same query.
+
+        Query embeddings live only in the in-process LRU cache; the
+        persistent embedding cache holds chunk embeddings alone.
+        """
+        key = self._query_key(query)
+        embedding = query_embedding_cache.get(key)
+        if embedding is None:
+            embedding = (await self._request_embeddings([query], user_id))[0]
+            query_embedding_cache.set(key, embedding)
+        return embedding
@@ -0,0 +1,191 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Hashable, Iterable, Optional
+
+from ..config import settings
+
+
+class QueueFull(Exception):
+    """An agent's queue has no room for another request"""
+
+
+class QueueTimeout(QueueFull):
+    """A request waited longer than allowed for a slot on an agent"""
+
+
+@dataclass(eq=False)
+class Ticket:
+    url: str
+    user: Hashable
+    future: asyncio.Future
+
+    @property
+    def admitted(self) -> bool:
+        return self.future.done() and not self.future.cancelled()
+
+
+@dataclass
+class AgentQueue:
+    active: int = 0
+    queued: int = 0
+    # Waiting tickets per user, in round-robin order: the next slot goes to
+    # the first user, who then moves to the back
+    waiting: "OrderedDict[Hashable, Deque[Ticket]]" = field(default_factory=OrderedDict)
+
+
+class AgentScheduler:
+    """Admission control in front of each Ollama agent.
+
+    At most `max_concurrent` requests run against an agent at once; the
+    rest wait in per-user queues served round-robin, so one user's burst
+    can't starve everyone else. Requests beyond `max_queued` per agent or
+    `max_queued_per_user` are refused up front with `QueueFull`.
+
+    A request should hold at most one ticket at a time: a ticket that is
+    admitted while its request waits for another slot on the same agent
+    (e.g. a chat ticket held during query embedding) can deadlock the
+    agent once every slot is taken that way. Routers therefore `pick` an
+    agent first and only `enqueue` once the request is ready to run.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        max_queued: int = 64,
+        max_queued_per_user: int = 4,
+        queue_timeout: Optional[float] = None,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+        self._agents: Dict[str, AgentQueue] = {}
+        self.rejected = 0
+
+    def _agent(self, url: str) -> AgentQueue:
+        url = url.rstrip("/")
+        agent = self._agents.get(url)
+        if agent is None:
+            agent = self._agents[url] = AgentQueue()
+        return agent
+
+    def has_room(self, url: str, user: Hashable) -> bool:
+        agent = self._agent(url)
+        if agent.active < self.max_concurrent and not agent.queued:
+            return True
+        return (
+            agent.queued < self.max_queued
+            and len(agent.waiting.get(user, ())) < self.max_queued_per_user
+        )
+
+    def pick(self, urls: Iterable[str], user: Hashable) -> str:
+        """First of `urls` with room for the user, or raise QueueFull"""
+        for url in urls:
+            if self.has_room(url, user):
+                return url
+        self.rejected += 1
+        raise QueueFull("All agents for this model are busy, try again shortly")
+
+    def admit(self, urls: Iterable[str], user: Hashable) -> Ticket:
+        """Enqueue on the first of `urls` with room, or raise QueueFull"""
+        return self.enqueue(self.pick(urls, user), user)
+
+    def enqueue(self, url: str, user: Hashable, shed: bool = False) -> Ticket:
+        """Take a slot on the agent, or a place in the user's queue for one"""
+        if shed and not self.has_room(url, user):
+            self.rejected += 1
+            raise QueueFull("Agent is busy, try again shortly")
+        agent = self._agent(url)
+        ticket = Ticket(url.rstrip("/"), user, asyncio.get_running_loop().create_future())
+        agent.waiting.setdefault(user, deque()).append(ticket)
+        agent.queued += 1
+        self._dispatch(agent)
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """Tickets that will be admitted before this one (0 = next)"""
+        if ticket.admitted:
+            return 0
+        agent = self._agent(ticket.url)
+        own = agent.waiting.get(ticket.user, ())
+        index = next((i for i, t in enumerate(own) if t is ticket), 0)
+        ahead, before_user = index, True
+        for user, tickets in agent.waiting.items():
+            if user == ticket.user:
+                before_user = False
+                continue
+            ahead += min(len(tickets), index + 1 if before_user else index)
+        return ahead
+
+    async def wait(self, ticket: Ticket, timeout: Optional[float] = None) -> bool:
+        """Wait until the ticket is admitted; False if `timeout` ran out first"""
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def release(self, ticket: Ticket) -> None:
+        agent = self._agent(ticket.url)
+        if ticket.admitted:
+            agent.active -= 1
+        else:
+            tickets = agent.waiting.get(ticket.user)
+            if tickets and ticket in tickets:
+                tickets.remove(ticket)
+                agent.queued -= 1
+                if not tickets:
+                    del agent.waiting[ticket.user]
+            ticket.future.cancel()
+        self._dispatch(agent)
+
+    def _dispatch(self, agent: AgentQueue) -> None:
+        while agent.active < self.max_concurrent and agent.waiting:
+            user, tickets = next(iter(agent.waiting.items()))
+            ticket = tickets.popleft()
+            agent.queued -= 1
+            if tickets:
+                agent.waiting.move_to_end(user)
+            else:
+                del agent.waiting[user]
+            if ticket.future.cancelled():
+                continue
+            agent.active += 1
+            ticket.future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, url: str, user: Hashable, shed: bool = False):
+        """Hold a slot for the block; raises QueueTimeout after `queue_timeout` in the queue"""
+        ticket = self.enqueue(url, user, shed)
+        try:
+            if not await self.wait(ticket, self.queue_timeout):
+                raise QueueTimeout("Timed out waiting for the agent, try again shortly")
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def load(self, url: str) -> int:
+        agent = self._agent(url)
+        return agent.active + agent.queued
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "max_queued_per_user": self.max_queued_per_user,
+            "rejected": self.rejected,
+            "agents": {
+                url: {"active": a.active, "queued": a.queued, "users_waiting": len(a.waiting)}
+                for url, a in self._agents.items()
+            },
+        }
+
+
+agent_scheduler = AgentScheduler(
+    max_concurrent=settings.ollama_max_concurrent_requests,
+    max_queued=settings.ollama_max_queued_requests,
+    max_queued_per_user=settings.ollama_max_queued_per_user,
+    queue_timeout=settings.ollama_queue_timeout or None,
+)
@@ -0,0 +1,61 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import SystemSettings
+
+
+class SystemSettingsCache:
+    """Active system settings held in memory, one value per setting name.
+
+    Every change inserts a new `SystemSettings` row, so the highest row id
+    doubles as a version number. At most every `check_interval` seconds a
+    read compares it with the database (a primary key lookup) and reloads
+    when another worker has written a newer setting; in between, reads
+    don't touch the database.
+    """
+
+    def __init__(self, check_interval: float = 5):
+        self.check_interval = check_interval
+        self.version: Optional[int] = None
+        self._values: Dict[str, str] = {}
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def load(self, db: AsyncSession) -> None:
+        result = await db.execute(
+            select(SystemSettings.id, SystemSettings.setting_name, SystemSettings.setting_value)
+            .where(SystemSettings.active.is_(True))
+            .order_by(SystemSettings.update_datetime, SystemSettings.id)
+        )
+        rows = result.all()
+        # Later rows win when a name has several active rows
+        self._values = {name: value for _, name, value in rows}
+        self.version = await db.scalar(select(func.max(SystemSettings.id))) or 0
+        self._checked_at = time.monotonic()
+
+    async def _refresh(self, db: AsyncSession) -> None:
+        if self.version is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        async with self._lock:
+            if self.version is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return
+            version = await db.scalar(select(func.max(SystemSettings.id))) or 0
+            if version != self.version:
+                await self.load(db)
+            self._checked_at = time.monotonic()
+
+    async def get(self, db: AsyncSession, name: str, default: Optional[str] = None) -> Optional[str]:
+        await self._refresh(db)
+        return self._values.get(name, default)
+
+    async def all(self, db: AsyncSession) -> Dict[str, str]:
+        await self._refresh(db)
+        return dict(self._values)
+
+
+system_settings = SystemSettingsCache(settings.system_settings_check_interval)
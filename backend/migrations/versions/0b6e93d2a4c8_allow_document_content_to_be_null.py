@@ -0,0 +1,31 @@
+"""allow knowledge base document content to be null
+
+Revision ID: 0b6e93d2a4c8
+Revises: f2a7c4e19b53
+Create Date: 2026-10-18 13:40:52.102877
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e93d2a4c8'
+down_revision = 'f2a7c4e19b53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # New uploads are streamed to the document store instead of this column
+    with op.batch_alter_table('knowledge_base_document', schema=None) as batch_op:
+        batch_op.alter_column('content',
+               existing_type=sa.Text(),
+               nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_base_document', schema=None) as batch_op:
+        batch_op.alter_column('content',
+               existing_type=sa.Text(),
+               nullable=False)
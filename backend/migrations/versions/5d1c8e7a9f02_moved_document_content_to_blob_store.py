@@ -0,0 +1,92 @@
+"""moved knowledge base document content to the blob store
+
+Revision ID: 5d1c8e7a9f02
+Revises: 0b6e93d2a4c8
+Create Date: 2026-10-18 14:18:09.664203
+
+"""
+import hashlib
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1c8e7a9f02'
+down_revision = '0b6e93d2a4c8'
+branch_labels = None
+depends_on = None
+
+
+def _blob_path(sha256):
+    return os.path.join(settings.rag_document_dir, "blobs", sha256[:2], sha256)
+
+
+def upgrade():
+    with op.batch_alter_table('knowledge_base_document', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_sha256', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('size_bytes', sa.Integer(), nullable=True))
+
+    # Move document text out of the database (rows still holding content)
+    # or out of per-document files (uploads streamed to disk) into
+    # content-addressed blobs
+    conn = op.get_bind()
+    documents = sa.table(
+        'knowledge_base_document',
+        sa.column('id', sa.Integer), sa.column('content', sa.Text),
+        sa.column('content_sha256', sa.String), sa.column('size_bytes', sa.Integer),
+    )
+    for doc_id, content in conn.execute(sa.select(documents.c.id, documents.c.content)).all():
+        legacy_path = os.path.join(settings.rag_document_dir, f"document_{doc_id}.txt")
+        if content is not None:
+            data = content.encode("utf-8")
+        elif os.path.exists(legacy_path):
+            with open(legacy_path, "rb") as f:
+                data = f.read()
+        else:
+            data = b""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = _blob_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        conn.execute(
+            documents.update().where(documents.c.id == doc_id)
+            .values(content_sha256=sha256, size_bytes=len(data))
+        )
+
+    with op.batch_alter_table('knowledge_base_document', schema=None) as batch_op:
+        batch_op.alter_column('content_sha256', existing_type=sa.String(length=64), nullable=False)
+        batch_op.alter_column('size_bytes', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index(batch_op.f('ix_knowledge_base_document_content_sha256'), ['content_sha256'], unique=False)
+        batch_op.drop_column('content')
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_base_document', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content', sa.Text(), nullable=True))
+
+    conn = op.get_bind()
+    documents = sa.table(
+        'knowledge_base_document',
+        sa.column('id', sa.Integer), sa.column('content', sa.Text),
+        sa.column('content_sha256', sa.String),
+    )
+    for doc_id, sha256 in conn.execute(sa.select(documents.c.id, documents.c.content_sha256)).all():
+        path = _blob_path(sha256)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                conn.execute(
+                    documents.update().where(documents.c.id == doc_id).values(content=f.read())
+                )
+
+    with op.batch_alter_table('knowledge_base_document', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_knowledge_base_document_content_sha256'))
+        batch_op.drop_column('size_bytes')
+        batch_op.drop_column('content_sha256')
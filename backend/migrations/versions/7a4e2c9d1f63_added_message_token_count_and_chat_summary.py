@@ -0,0 +1,37 @@
+"""added message token_count and chat summary
+
+Revision ID: 7a4e2c9d1f63
+Revises: 5d1c8e7a9f02
+Create Date: 2026-10-18 15:02:17.384910
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4e2c9d1f63'
+down_revision = '5d1c8e7a9f02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('token_count', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('chat', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('summary', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('summary_message_id', sa.Integer(), nullable=True))
+
+    # Same estimate as models.estimate_tokens
+    op.execute("UPDATE message SET token_count = (length(message) + 3) / 4")
+
+
+def downgrade():
+    with op.batch_alter_table('chat', schema=None) as batch_op:
+        batch_op.drop_column('summary_message_id')
+        batch_op.drop_column('summary')
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_column('token_count')
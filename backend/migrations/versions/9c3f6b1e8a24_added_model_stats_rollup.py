@@ -0,0 +1,57 @@
+"""added model stats rollup and message agent_id
+
+Revision ID: 9c3f6b1e8a24
+Revises: 7a4e2c9d1f63
+Create Date: 2026-10-18 16:41:52.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3f6b1e8a24'
+down_revision = '7a4e2c9d1f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('model_stats_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('agent_id', sa.Integer(), nullable=False),
+    sa.Column('model_name', sa.String(length=255), nullable=False),
+    sa.Column('messages', sa.Integer(), nullable=False),
+    sa.Column('total_duration_sum', sa.BigInteger(), nullable=False),
+    sa.Column('load_duration_sum', sa.BigInteger(), nullable=False),
+    sa.Column('cold_loads', sa.Integer(), nullable=False),
+    sa.Column('prompt_eval_count_sum', sa.BigInteger(), nullable=False),
+    sa.Column('prompt_eval_count_max', sa.Integer(), nullable=False),
+    sa.Column('eval_count_sum', sa.BigInteger(), nullable=False),
+    sa.Column('eval_duration_sum', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'agent_id', 'model_name')
+    )
+    op.create_table('model_stats_bucket',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('agent_id', sa.Integer(), nullable=False),
+    sa.Column('model_name', sa.String(length=255), nullable=False),
+    sa.Column('metric', sa.String(length=20), nullable=False),
+    sa.Column('bucket', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'agent_id', 'model_name', 'metric', 'bucket')
+    )
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('agent_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_message_agent_id', 'agent', ['agent_id'], ['id'], ondelete='SET NULL')
+
+    # Existing messages are folded in by POST /api/analytics/models/rebuild
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_message_agent_id', type_='foreignkey')
+        batch_op.drop_column('agent_id')
+
+    op.drop_table('model_stats_bucket')
+    op.drop_table('model_stats_daily')
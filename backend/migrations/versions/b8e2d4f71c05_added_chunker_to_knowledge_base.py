@@ -0,0 +1,29 @@
+"""added chunker to knowledge base
+
+Revision ID: b8e2d4f71c05
+Revises: 9c3f6b1e8a24
+Create Date: 2026-10-18 18:05:33.527104
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e2d4f71c05'
+down_revision = '9c3f6b1e8a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('knowledge_base', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('chunker', sa.String(length=20), server_default='structured', nullable=False))
+
+    # Existing knowledge bases keep their 500/50 character chunks and indexes
+    op.execute("UPDATE knowledge_base SET chunker = 'characters'")
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_base', schema=None) as batch_op:
+        batch_op.drop_column('chunker')
@@ -0,0 +1,27 @@
+"""added index_status to knowledge_base
+
+Revision ID: c3d9a1f04b27
+Revises: 35a902798f1e
+Create Date: 2026-10-18 10:12:41.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d9a1f04b27'
+down_revision = '35a902798f1e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing knowledge bases start as pending and are indexed on next startup
+    with op.batch_alter_table('knowledge_base', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('index_status', sa.String(length=20), nullable=False, server_default='pending'))
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_base', schema=None) as batch_op:
+        batch_op.drop_column('index_status')
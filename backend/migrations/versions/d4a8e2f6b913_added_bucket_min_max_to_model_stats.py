@@ -0,0 +1,29 @@
+"""added bucket min/max to model stats
+
+Revision ID: d4a8e2f6b913
+Revises: b8e2d4f71c05
+Create Date: 2026-10-18 20:12:47.406218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8e2f6b913'
+down_revision = 'b8e2d4f71c05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows keep NULL and fall back to the bucket bounds until the next rebuild
+    with op.batch_alter_table('model_stats_bucket', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('min_value', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('max_value', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('model_stats_bucket', schema=None) as batch_op:
+        batch_op.drop_column('max_value')
+        batch_op.drop_column('min_value')
@@ -0,0 +1,26 @@
+"""added index_type to knowledge_base
+
+Revision ID: e81f5b2c6d90
+Revises: c3d9a1f04b27
+Create Date: 2026-10-18 11:02:17.340915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81f5b2c6d90'
+down_revision = 'c3d9a1f04b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('knowledge_base', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('index_type', sa.String(length=20), nullable=False, server_default='auto'))
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_base', schema=None) as batch_op:
+        batch_op.drop_column('index_type')
@@ -0,0 +1,80 @@
+"""added knowledge base documents and chunks
+
+Revision ID: f2a7c4e19b53
+Revises: e81f5b2c6d90
+Create Date: 2026-10-18 12:25:03.771420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a7c4e19b53'
+down_revision = 'e81f5b2c6d90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('knowledge_base_document',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kb_id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('create_datetime', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['kb_id'], ['knowledge_base.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('knowledge_base_document', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_knowledge_base_document_kb_id'), ['kb_id'], unique=False)
+
+    op.create_table('knowledge_base_chunk',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kb_id', sa.Integer(), nullable=False),
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('chunk_index', sa.Integer(), nullable=False),
+    sa.Column('start_offset', sa.Integer(), nullable=False),
+    sa.Column('end_offset', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['document_id'], ['knowledge_base_document.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['kb_id'], ['knowledge_base.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('knowledge_base_chunk', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_knowledge_base_chunk_document_id'), ['document_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_knowledge_base_chunk_kb_id'), ['kb_id'], unique=False)
+
+    # Each existing knowledge base becomes a single-document one and is
+    # re-indexed with chunk ids on next startup
+    op.execute(
+        "INSERT INTO knowledge_base_document (kb_id, filename, content, create_datetime) "
+        "SELECT id, document_filename, document_content, create_datetime FROM knowledge_base"
+    )
+    op.execute("UPDATE knowledge_base SET index_status = 'pending'")
+
+    with op.batch_alter_table('knowledge_base', schema=None) as batch_op:
+        batch_op.drop_column('document_content')
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_base', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('document_content', sa.Text(), nullable=False, server_default=''))
+
+    # Only the first document of each knowledge base survives a downgrade
+    op.execute(
+        "UPDATE knowledge_base SET document_content = ("
+        " SELECT content FROM knowledge_base_document d WHERE d.kb_id = knowledge_base.id"
+        " ORDER BY d.id LIMIT 1) "
+        "WHERE EXISTS (SELECT 1 FROM knowledge_base_document d WHERE d.kb_id = knowledge_base.id)"
+    )
+    op.execute("UPDATE knowledge_base SET index_status = 'pending'")
+
+    with op.batch_alter_table('knowledge_base_chunk', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_knowledge_base_chunk_kb_id'))
+        batch_op.drop_index(batch_op.f('ix_knowledge_base_chunk_document_id'))
+
+    op.drop_table('knowledge_base_chunk')
+    with op.batch_alter_table('knowledge_base_document', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_knowledge_base_document_kb_id'))
+
+    op.drop_table('knowledge_base_document')
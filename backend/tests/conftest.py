@@ -0,0 +1,93 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+# Settings are read when the app is imported, so point it at scratch storage first
+_data_dir = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{_data_dir}/test.db",
+    "RAG_INDEX_DIR": os.path.join(_data_dir, "rag_indexes"),
+    "RAG_DOCUMENT_DIR": os.path.join(_data_dir, "rag_documents"),
+    "RAG_EMBEDDING_CACHE_PATH": "",
+})
+
+from fake_ollama import FakeOllama  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def ollama():
+    fake = FakeOllama()
+    yield fake
+    fake.close()
+    shutil.rmtree(_data_dir, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client(ollama):
+    """Logged-in TestClient of a superuser, with the fake agent serving model `m`"""
+    from fastapi.testclient import TestClient
+    from fastapi_users.password import PasswordHelper
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    from app.database import engine
+    from app.main import app
+    from app.models import Agent, Base, Model, User
+
+    async def create_schema():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with AsyncSession(engine) as db:
+            user = User(
+                email="admin@example.com", hashed_password=PasswordHelper().hash("pw"),
+                is_active=True, is_superuser=True, is_verified=True,
+            )
+            db.add(user)
+            await db.flush()
+            agent = Agent(name="fake", url=ollama.url, user_id=user.id)
+            db.add(agent)
+            await db.flush()
+            agent_id = agent.id
+            db.add(Model(agent_id=agent_id, model_name="m"))
+            await db.commit()
+            return agent_id
+
+    agent_id = asyncio.run(create_schema())
+    with TestClient(app) as test_client:
+        response = test_client.post("/auth/jwt/login", data={"username": "admin@example.com", "password": "pw"})
+        assert response.status_code in (200, 204), response.text
+        test_client.cookies.set("auth", response.cookies.get("auth"))
+        test_client.agent_id = agent_id
+        yield test_client
+
+
+@pytest.fixture
+def make_kb(client):
+    """Factory creating a knowledge base from a text and waiting until it is indexed"""
+    return lambda text, **form: _upload(client, text, **form)
+
+
+def _upload(client, text: str, name: str = "kb", **form) -> int:
+    response = client.post(
+        "/api/rag/upload",
+        data={"name": name, "agent_id": client.agent_id, "embedding_model": "e", **form},
+        files={"file": ("doc.txt", text.encode())},
+    )
+    assert response.status_code == 200, response.text
+    kb_id = response.json()["id"]
+    _wait_ready(client, kb_id)
+    return kb_id
+
+
+def _wait_ready(client, kb_id: int) -> dict:
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        status = client.get(f"/api/rag/{kb_id}/status").json()
+        if status["status"] in ("ready", "failed"):
+            assert status["status"] == "ready", status
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"knowledge base {kb_id} was not indexed in time")
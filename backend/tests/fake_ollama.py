@@ -0,0 +1,76 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def embed(text: str) -> list:
+    """Deterministic 16-dimensional embedding of a text"""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return (np.frombuffer(digest, dtype=np.uint8)[:16].astype("float32") / 255).tolist()
+
+
+class FakeOllama:
+    """Minimal Ollama HTTP API: /api/embed, streamed /api/chat and a version endpoint.
+
+    `chat_delay` holds every chat request open, so tests can keep agent
+    slots busy.
+    """
+
+    def __init__(self):
+        self.chat_delay = 0.0
+        self.calls = {"embed": 0, "chat": 0}
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body: bytes, content_type: str = "application/json"):
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client timed out and left
+
+            def do_GET(self):
+                self._send(json.dumps({"version": "0.0-test", "models": []}).encode())
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/embed":
+                    fake.calls["embed"] += 1
+                    texts = [body["input"]] if isinstance(body["input"], str) else body["input"]
+                    return self._send(json.dumps({"embeddings": [embed(t) for t in texts]}).encode())
+                if self.path == "/api/chat":
+                    fake.calls["chat"] += 1
+                    time.sleep(fake.chat_delay)
+                    final = {
+                        "message": {"role": "assistant", "content": ""}, "done": True,
+                        "total_duration": 1000, "load_duration": 10, "prompt_eval_count": 5,
+                        "prompt_eval_duration": 100, "eval_count": 2, "eval_duration": 200,
+                    }
+                    if not body.get("stream", True):
+                        final["message"]["content"] = "summary"
+                        return self._send(json.dumps(final).encode())
+                    lines = [{"message": {"role": "assistant", "content": "Hello"}, "done": False}, final]
+                    return self._send("".join(json.dumps(l) + "\n" for l in lines).encode(), "application/x-ndjson")
+                self._send(b"{}")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,56 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.services.agent_clients import AgentClientRegistry
+
+
+def test_timeouts_follow_the_operation(monkeypatch):
+    monkeypatch.setattr(settings, "ollama_embed_timeout", 7)
+    monkeypatch.setattr(settings, "ollama_default_timeout", 3)
+    registry = AgentClientRegistry(connect_timeout=2)
+    embed = registry.timeout("embed")
+    assert (embed.read, embed.connect) == (7, 2)
+    assert registry.timeout("unknown").read == 3
+    assert registry.timeout().read == 3
+
+
+def test_clients_are_reused_per_agent(ollama):
+    registry = AgentClientRegistry()
+
+    async def run():
+        client = registry.get(ollama.url + "/")
+        assert registry.get(ollama.url) is client
+        for _ in range(3):
+            (await client.get("/api/version")).raise_for_status()
+        stats = registry.stats()["agents"][ollama.url]
+        await registry.aclose()
+        # A closed registry hands out a fresh client
+        reopened = registry.get(ollama.url)
+        assert reopened is not client and not reopened.is_closed
+        await registry.aclose()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats["requests"] == 3
+    # All three requests went over the one kept-alive connection
+    assert stats["connections"] == 1
+
+
+def test_slow_agent_hits_the_operation_read_timeout(ollama, monkeypatch):
+    monkeypatch.setattr(ollama, "chat_delay", 0.5)
+    monkeypatch.setattr(settings, "ollama_chat_timeout", 0.1)
+    registry = AgentClientRegistry()
+
+    async def run():
+        try:
+            await registry.get(ollama.url).post(
+                "/api/chat", json={"model": "m", "messages": []}, timeout=registry.timeout("chat")
+            )
+        finally:
+            await registry.aclose()
+
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(run())
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from sqlalchemy import delete, select
+
+from app.database import async_session_maker
+from app.models import Agent, Message, Model
+from app.services.agent_pool import AgentPool, agent_pool
+
+DOWN = "http://127.0.0.1:9"
+
+
+def test_faster_agents_rank_first_and_unhealthy_ones_last():
+    pool = AgentPool(health_interval=0)
+    urls = ["http://slow", "http://fast", "http://new", "http://down"]
+    pool.end("http://slow", {"eval_count": 10, "eval_duration": 1e9})
+    pool.end("http://fast", {"eval_count": 100, "eval_duration": 1e9})
+    pool.end("http://down", {"eval_count": 1000, "eval_duration": 1e9})
+    pool.fail("http://down", "connection refused")
+    # Unmeasured agents count as average (370 tokens/s here), ahead of the slow one
+    assert pool.rank(urls) == ["http://new", "http://fast", "http://slow", "http://down"]
+
+
+def test_preferred_agent_wins_ties_and_server_errors_keep_it_healthy():
+    pool = AgentPool(health_interval=0)
+    urls = ["http://a", "http://b/"]
+    assert pool.rank(urls, preferred_url="http://b") == ["http://b", "http://a"]
+    pool.fail("http://b", "Ollama error 500", unreachable=False)
+    assert pool.rank(urls, preferred_url="http://b")[0] == "http://b"
+    assert pool.stats()["http://b"]["failures"] == 1
+
+
+def test_health_checks_mark_agents_down_and_up(ollama):
+    pool = AgentPool(health_interval=0)
+
+    async def run():
+        return await pool.check(ollama.url), await pool.check(DOWN)
+
+    assert asyncio.run(run()) == (True, False)
+    assert pool.state(DOWN).last_error
+    assert pool.rank([DOWN, ollama.url], preferred_url=DOWN) == [ollama.url, DOWN]
+
+
+def test_chat_fails_over_when_the_preferred_agent_is_down(client, ollama):
+    async def add_down_agent():
+        async with async_session_maker() as db:
+            agent = Agent(name="down", url=DOWN, user_id=1)
+            db.add(agent)
+            await db.flush()
+            db.add(Model(agent_id=agent.id, model_name="m"))
+            await db.commit()
+            return agent.id
+
+    async def remove_down_agent():
+        async with async_session_maker() as db:
+            await db.execute(delete(Model).where(Model.agent_id == down_id))
+            await db.execute(delete(Agent).where(Agent.id == down_id))
+            await db.commit()
+
+    async def reply_agent(chat_id):
+        async with async_session_maker() as db:
+            return await db.scalar(
+                select(Message.agent_id).where(Message.chat_id == chat_id, Message.role == "assistant")
+            )
+
+    down_id = client.portal.call(add_down_agent)
+    agent_pool.state(DOWN).healthy = True
+    failures = agent_pool.state(DOWN).failures
+    try:
+        response = client.post("/api/chat/send_message", json={
+            "agent_id": down_id, "model_name": "m", "message": "anyone there?",
+        })
+        assert response.status_code == 200
+        assert '"done": true' in response.text and '"error"' not in response.text
+        chat_id = json.loads(response.text.splitlines()[0])["chat_id"]
+        # Tried first, then the reply came from the agent that is up
+        assert agent_pool.state(DOWN).failures == failures + 1
+        assert client.portal.call(reply_agent, chat_id) == client.agent_id
+        assert not agent_pool.state(DOWN).healthy
+        assert agent_pool.rank([DOWN, ollama.url], preferred_url=DOWN) == [ollama.url, DOWN]
+    finally:
+        client.portal.call(remove_down_agent)
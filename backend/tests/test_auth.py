@@ -0,0 +1,109 @@
+import dataclasses
+
+import pytest
+from fastapi.testclient import TestClient
+from fastapi_users.db import SQLAlchemyUserDatabase
+from sqlalchemy import update
+
+from app.auth import UserManager, user_cache
+from app.database import async_session_maker
+from app.models import User
+
+_count = 0
+
+
+def _login(client, email, password):
+    """A separate TestClient signed in as `email`, or None when the login fails"""
+    other = TestClient(client.app)
+    response = other.post("/auth/jwt/login", data={"username": email, "password": password})
+    if response.status_code not in (200, 204):
+        return None
+    other.cookies.set("auth", response.cookies.get("auth"))
+    return other
+
+
+@pytest.fixture
+def member(client):
+    """A new superuser and a client signed in as them"""
+    global _count
+    _count += 1
+    email = f"member{_count}@example.com"
+    response = client.post("/api/users", json={"email": email, "password": "pw", "is_superuser": True})
+    assert response.status_code == 200, response.text
+    user_id = response.json()["id"]
+    session = _login(client, email, "pw")
+    assert session.get("/api/users/me").status_code == 200
+    return user_id, email, session
+
+
+def _patch(client, user_id, **fields):
+    response = client.patch(f"/api/users/{user_id}", json=fields)
+    assert response.status_code == 200, response.text
+
+
+def test_cached_user_is_an_immutable_snapshot(client, member):
+    user_id, email, session = member
+    snapshot = user_cache.get(user_id)
+    assert snapshot is not None and not isinstance(snapshot, User)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        snapshot.is_superuser = False
+
+    # Served from the cache, with the same fields as a fresh lookup
+    me = session.get("/api/users/me").json()
+    assert me == client.get(f"/api/users/{user_id}").json()
+    assert me["email"] == email
+
+
+def test_deactivated_user_loses_access_at_once(client, member):
+    user_id, _, session = member
+    _patch(client, user_id, is_active=False)
+    assert session.get("/api/users/me").status_code == 401
+    assert user_cache.get(user_id) is None
+
+
+def test_demoted_user_loses_admin_access_at_once(client, member):
+    user_id, _, session = member
+    assert session.get("/api/users").status_code == 200
+    _patch(client, user_id, is_superuser=False)
+    assert session.get("/api/users").status_code == 403
+    assert session.get("/api/users/me").json()["is_superuser"] is False
+
+
+def test_password_change_evicts_the_cached_user(client, member):
+    user_id, email, session = member
+    assert user_cache.get(user_id) is not None
+    _patch(client, user_id, password="new")
+    assert user_cache.get(user_id) is None
+    assert _login(client, email, "pw") is None
+    assert _login(client, email, "new").get("/api/users/me").status_code == 200
+
+
+def test_inactive_users_are_never_cached(client, member):
+    user_id, _, session = member
+    _patch(client, user_id, is_active=False)
+    for _ in range(2):
+        assert session.get("/api/users/me").status_code == 401
+        assert user_cache.get(user_id) is None
+
+    # Reactivated behind the app's back: picked up on the next request
+    async def reactivate():
+        async with async_session_maker() as db:
+            await db.execute(update(User).where(User.id == user_id).values(is_active=True))
+            await db.commit()
+
+    client.portal.call(reactivate)
+    assert session.get("/api/users/me").status_code == 200
+
+
+def test_token_of_a_deleted_user_is_rejected(client, member):
+    user_id, _, session = member
+    assert user_cache.get(user_id) is not None
+
+    async def delete():
+        async with async_session_maker() as db:
+            manager = UserManager(SQLAlchemyUserDatabase(db, User))
+            await manager.delete(await manager.get(user_id))
+
+    client.portal.call(delete)
+    assert user_cache.get(user_id) is None
+    assert session.get("/api/users/me").status_code == 401
@@ -0,0 +1,94 @@
+from app.database import async_session_maker
+from app.models import Chat, Message
+from app.services.chat_context import ChatContextManager
+
+# 40 characters estimate to 10 tokens each
+TEXTS = [f"message {i:02d} ".ljust(40, ".") for i in range(8)]
+
+
+def _make_chat(client, texts=TEXTS):
+    async def create():
+        async with async_session_maker() as db:
+            chat = Chat(name="context", user_id=1, agent_id=client.agent_id, model_name="m")
+            db.add(chat)
+            await db.flush()
+            messages = [
+                Message(chat_id=chat.id, message=text, role=("user", "assistant")[i % 2])
+                for i, text in enumerate(texts)
+            ]
+            db.add_all(messages)
+            await db.commit()
+            return chat.id, [message.id for message in messages]
+
+    return client.portal.call(create)
+
+
+def _history(client, manager, chat_id):
+    async def build():
+        async with async_session_maker() as db:
+            chat = await db.get(Chat, chat_id)
+            history, cutoff_id = await manager.build_history(db, chat)
+            return history, cutoff_id, manager.needs_summary(chat, cutoff_id)
+
+    return client.portal.call(build)
+
+
+def _summary(client, chat_id):
+    async def load():
+        async with async_session_maker() as db:
+            chat = await db.get(Chat, chat_id)
+            return chat.summary, chat.summary_message_id
+
+    return client.portal.call(load)
+
+
+def test_history_keeps_the_newest_messages_that_fit(client):
+    chat_id, ids = _make_chat(client)
+    history, cutoff_id, _ = _history(client, ChatContextManager(default_budget=35), chat_id)
+    assert [m["content"] for m in history] == TEXTS[-3:]
+    assert [m["role"] for m in history] == ["assistant", "user", "assistant"]
+    assert cutoff_id == ids[-4]
+
+    history, cutoff_id, _ = _history(client, ChatContextManager(default_budget=1000), chat_id)
+    assert [m["content"] for m in history] == TEXTS and cutoff_id is None
+
+
+def test_newest_message_is_sent_even_over_budget(client):
+    chat_id, ids = _make_chat(client)
+    manager = ChatContextManager(default_budget=100, budgets={"m": 5})
+    history, cutoff_id, _ = _history(client, manager, chat_id)
+    assert [m["content"] for m in history] == TEXTS[-1:]
+    assert cutoff_id == ids[-2]
+
+
+def test_rolling_summary_catches_up_and_replaces_old_turns(client, ollama):
+    chat_id, ids = _make_chat(client)
+    manager = ChatContextManager(default_budget=35, summarize=True)
+    _, cutoff_id, needs = _history(client, manager, chat_id)
+    assert needs and cutoff_id == ids[-4]
+
+    # One budget's worth per call: three messages, then the next two up to the cutoff
+    calls = ollama.calls["chat"]
+    client.portal.call(manager.update_summary, chat_id, ollama.url, "m", cutoff_id)
+    assert _summary(client, chat_id) == ("summary", ids[2])
+    client.portal.call(manager.update_summary, chat_id, ollama.url, "m", cutoff_id)
+    assert _summary(client, chat_id) == ("summary", ids[4])
+    assert ollama.calls["chat"] == calls + 2
+
+    history, cutoff_id, needs = _history(client, manager, chat_id)
+    assert history[0] == {"role": "system", "content": "Summary of the earlier conversation:\nsummary"}
+    # The summary's tokens come out of the budget; the window is unchanged here
+    assert [m["content"] for m in history[1:]] == TEXTS[-3:]
+    assert not needs
+
+    # Nothing left to fold in
+    client.portal.call(manager.update_summary, chat_id, ollama.url, "m", cutoff_id)
+    assert ollama.calls["chat"] == calls + 2
+
+
+def test_failed_summary_keeps_the_previous_one(client):
+    chat_id, ids = _make_chat(client)
+    manager = ChatContextManager(default_budget=35, summarize=True)
+    client.portal.call(manager.update_summary, chat_id, "http://127.0.0.1:9", "m", ids[-4])
+    assert _summary(client, chat_id) == (None, None)
+    assert not manager._summarizing
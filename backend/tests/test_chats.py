@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+def _pages(client, limit):
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit} | ({"cursor": cursor} if cursor else {})
+        response = client.get("/api/chats", params=params)
+        assert response.status_code == 200
+        pages.append([chat["id"] for chat in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+def test_chat_list_pages_follow_the_cursor(client):
+    created = [
+        client.post("/api/chats", json={"name": f"chat {i}", "agent_id": client.agent_id, "model_name": "m"}).json()["id"]
+        for i in range(5)
+    ]
+    everything = [chat["id"] for chat in client.get("/api/chats", params={"limit": 500}).json()]
+    assert everything == sorted(everything, reverse=True)
+
+    pages = _pages(client, 2)
+    assert all(len(page) == 2 for page in pages[:-1]) and 1 <= len(pages[-1]) <= 2
+    assert [chat_id for page in pages for chat_id in page] == everything
+    assert set(created) <= set(everything)
+
+
+def test_replies_are_stored_before_the_next_message(client, monkeypatch):
+    from app.services.message_writer import message_writer
+
+    write = message_writer._write
+
+    async def slow_write(batch):
+        await asyncio.sleep(0.2)
+        await write(batch)
+
+    # A slow commit would let a quick follow-up overtake the queued reply
+    monkeypatch.setattr(message_writer, "_write", slow_write)
+    chat_id = None
+    for text in ("first", "second", "third"):
+        body = {"agent_id": client.agent_id, "model_name": "m", "message": text}
+        if chat_id:
+            body["chat_id"] = chat_id
+        response = client.post("/api/chat/send_message", json=body)
+        assert response.status_code == 200
+        chat_id = chat_id or json.loads(response.text.splitlines()[0])["chat_id"]
+
+    messages = client.get(f"/api/chats/{chat_id}").json()["messages"]
+    assert [(m["role"], m["message"]) for m in messages] == [
+        ("user", "first"), ("assistant", "Hello"),
+        ("user", "second"), ("assistant", "Hello"),
+        ("user", "third"), ("assistant", "Hello"),
+    ]
@@ -0,0 +1,78 @@
+import random
+import re
+
+import pytest
+
+from app.services.chunking import iter_chunks
+
+_TOKEN = re.compile(r"\w{1,6}|[^\w\s]")
+
+
+def _document(seed: int) -> str:
+    rng = random.Random(seed)
+    words = ["pump", "valve", "pressure", "über", "maintenance", "ERR-4021", "x", "a.b.c", "(see §3)"]
+    parts = []
+    for section in range(6):
+        parts.append(f"# Section {section}\n\n")
+        for _ in range(rng.randint(1, 4)):
+            sentences = [
+                " ".join(rng.choice(words) for _ in range(rng.randint(1, 25))) + rng.choice(".!?;:")
+                for _ in range(rng.randint(1, 6))
+            ]
+            parts.append(" ".join(sentences) + rng.choice(["\n\n", "\n", "\n\n\n  "]))
+        if section == 3:
+            # One unit far longer than a chunk, with no separator to cut at
+            parts.append("supercalifragilistic" * 40 + "\n\n")
+    return "".join(parts)
+
+
+def _pieces(text: str, seed: int):
+    rng = random.Random(seed)
+    cuts = sorted(rng.sample(range(1, len(text)), 25))
+    return [text[a:b] for a, b in zip([0, *cuts], [*cuts, len(text)])]
+
+
+CASES = [(seed, size, overlap) for seed in range(3) for size, overlap in ((16, 4), (48, 8), (128, 0))]
+
+
+@pytest.mark.parametrize("seed,chunk_size,overlap", CASES)
+def test_structured_chunks_respect_their_invariants(seed, chunk_size, overlap):
+    text = _document(seed)
+    chunks = list(iter_chunks([text], chunk_size, overlap, "structured"))
+    assert chunks
+
+    covered = [False] * len(text)
+    for start, end, chunk in chunks:
+        assert chunk == text[start:end]
+        assert chunk == chunk.strip(), chunk
+        assert len(_TOKEN.findall(chunk)) <= chunk_size
+        for i in range(start, end):
+            covered[i] = True
+    assert all(covered[i] for i, c in enumerate(text) if not c.isspace())
+
+    for (start, end, _), (next_start, _, _) in zip(chunks, chunks[1:]):
+        assert next_start > start
+        if next_start < end:
+            assert len(_TOKEN.findall(text[next_start:end])) <= overlap
+
+
+@pytest.mark.parametrize("seed,chunk_size,overlap", CASES)
+@pytest.mark.parametrize("chunker", ["structured", "characters"])
+def test_streamed_pieces_chunk_like_the_whole_text(seed, chunk_size, overlap, chunker):
+    text = _document(seed)
+    whole = list(iter_chunks([text], chunk_size, overlap, chunker))
+    assert list(iter_chunks(_pieces(text, seed), chunk_size, overlap, chunker)) == whole
+
+
+def test_character_chunks_are_fixed_windows():
+    text = _document(0)
+    chunks = list(iter_chunks([text], 100, 20, "characters"))
+    assert [start for start, _, _ in chunks] == list(range(0, len(text), 80))
+    assert all(chunk == text[start:end] and len(chunk) <= 100 for start, end, chunk in chunks)
+    assert chunks[-1][1] == len(text)
+
+
+def test_a_heading_starts_a_new_chunk():
+    text = "Intro sentence one. Intro sentence two.\n\n# Heading\n\nBody text."
+    chunks = [chunk for _, _, chunk in iter_chunks([text], 16, 0, "structured")]
+    assert any(chunk.startswith("# Heading") for chunk in chunks)
@@ -0,0 +1,36 @@
+import hashlib
+import os
+
+from app.routers import rag
+from app.services.document_store import document_store
+
+
+def _blob(text):
+    return document_store.path(hashlib.sha256(text.encode()).hexdigest())
+
+
+def test_shared_blob_is_deleted_with_its_last_document(client, make_kb):
+    text = "Shared manual: pumps are primed before start."
+    first, second = make_kb(text), make_kb(text)
+    assert client.delete(f"/api/rag/{first}").status_code == 200
+    assert os.path.exists(_blob(text))
+    assert client.delete(f"/api/rag/{second}").status_code == 200
+    assert not os.path.exists(_blob(text))
+
+
+def test_release_keeps_a_blob_referenced_after_the_check(client, make_kb, monkeypatch):
+    text = "Compressor oil is changed every 500 hours."
+    kb_id = make_kb(text)
+    checks = iter([False])
+    real = rag._blob_in_use
+
+    async def racing_in_use(sha):
+        # The first check misses a document committed by another process
+        first = next(checks, None)
+        return first if first is not None else await real(sha)
+
+    monkeypatch.setattr(rag, "_blob_in_use", racing_in_use)
+    sha = hashlib.sha256(text.encode()).hexdigest()
+    client.portal.call(rag._release_blobs, [sha])
+    assert os.path.exists(_blob(text))
+    assert client.delete(f"/api/rag/{kb_id}").status_code == 200
@@ -0,0 +1,176 @@
+import asyncio
+import json
+
+import faiss
+import numpy as np
+import pytest
+
+from app.services.faiss_index import create_index, native_ivf
+from app.services.index_store import IndexStore
+from app.services.rag_service import AsyncRAGService, BaseRAGService
+
+N, D = 1200, 16
+INDEX_TYPES = ["flat", "hnsw", "ivf_flat", "ivf_pq"]
+
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, D)).astype("float32")
+
+
+def make_service(index_type, cls=BaseRAGService):
+    service = cls("http://agent", "m", index_type)
+    service.embedding_cache = None
+    service._set_index(list(range(N)), [f"chunk {i}" for i in range(N)], vectors(N))
+    return service
+
+
+def result_ids(service, query, k=50):
+    return [int(chunk.split()[1]) for chunk, _ in service._search(query, k, nprobe=1024, ef_search=512)]
+
+
+def assert_in_sync(service, data):
+    """Every live chunk is found by its own vector, and nothing else comes back"""
+    live = set(service.chunks)
+    for chunk_id, vector in list(data.items())[::97]:
+        found = result_ids(service, vector)
+        assert set(found) <= live
+        if service.index_type == "ivf_pq":
+            # PQ distances are approximate; the vector only has to be a candidate
+            assert chunk_id in found
+        else:
+            assert found[0] == chunk_id
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_remove_and_add_keep_index_in_sync(index_type):
+    service = make_service(index_type)
+    data = dict(enumerate(vectors(N)))
+    removed = list(range(0, N, 7))
+    service._remove_from_index(removed)
+    for chunk_id in removed:
+        del data[chunk_id]
+    assert_in_sync(service, data)
+    for chunk_id in removed[:20]:
+        assert chunk_id not in result_ids(service, vectors(N)[chunk_id])
+
+    # New chunks, one of them reusing a removed id
+    ids = [N, N + 1, removed[3]]
+    new = vectors(3, seed=1)
+    service._add_to_index(ids, [f"chunk {i}" for i in ids], new)
+    data.update(zip(ids, new))
+    assert_in_sync(service, data)
+    assert service.index.ntotal >= len(data)
+
+
+def test_hnsw_removals_are_tombstoned_until_compaction():
+    service = make_service("hnsw")
+    service._remove_from_index([1, 2, 3])
+    assert service.removed == {1, 2, 3}
+    assert service.index.ntotal == N
+    service._remove_from_index(list(range(10, N // 2)))
+    assert service.removed == set()
+    assert service.index.ntotal == len(service.chunks)
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_removals_survive_save_and_load(tmp_path, index_type):
+    store = IndexStore(str(tmp_path))
+    service = make_service(index_type)
+    service._remove_from_index([5, 6, 7])
+    store.save(1, "key", service)
+
+    for writable in (False, True):
+        loaded = BaseRAGService("http://agent", "m", index_type)
+        assert store.load(1, "key", loaded, writable=writable)
+        assert loaded.chunks == service.chunks
+        assert loaded.removed == service.removed
+        assert 6 not in result_ids(loaded, vectors(N)[6])
+
+    loaded._remove_from_index([8])
+    loaded._add_to_index([5], ["chunk 5"], vectors(1, seed=2))
+    assert result_ids(loaded, vectors(1, seed=2)[0])[0] == 5
+
+
+def test_legacy_wrapped_ivf_gets_native_ids():
+    data = vectors(N)
+    ivf = create_index(data, "ivf_flat")
+    ivf.reset()
+    ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+    legacy = faiss.IndexIDMap2(ivf)
+    legacy.add_with_ids(data, np.arange(100, 100 + N, dtype="int64"))
+
+    converted = native_ivf(legacy)
+    assert isinstance(converted, faiss.IndexIVF)
+    np.testing.assert_array_equal(converted.reconstruct(150), data[50])
+    converted.remove_ids(faiss.IDSelectorArray(1, faiss.swig_ptr(np.array([150], dtype="int64"))))
+    _, indices = converted.search(data[51:52], 1)
+    assert indices[0][0] == 151
+
+
+def test_remove_chunks_does_not_reembed():
+    service = make_service("hnsw", AsyncRAGService)
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("removal must not embed")
+
+    service.embed_chunks = fail
+    service.get_embeddings = fail
+    asyncio.run(service.remove_chunks(list(range(N))))
+    assert service.chunks == {}
+    assert service.index.ntotal == 0
+
+
+def test_ivf_stored_without_direct_map_can_reconstruct_and_remove(tmp_path):
+    store = IndexStore(str(tmp_path))
+    service = make_service("ivf_flat")
+    service.index.set_direct_map_type(faiss.DirectMap.NoMap)
+    store.save(1, "key", service)
+
+    for writable in (False, True):
+        loaded = BaseRAGService("http://agent", "m", "ivf_flat")
+        store.load(1, "key", loaded, writable=writable)
+        np.testing.assert_array_equal(loaded._vectors([3])[0], vectors(N)[3])
+    loaded._remove_from_index([3])
+    assert loaded.index.ntotal == N - 1
+
+
+def test_saves_swap_whole_generations(tmp_path):
+    store = IndexStore(str(tmp_path))
+    service = make_service("flat")
+    store.save(1, "key", service)
+    first = store.version(1, "key")
+    stale = store._paths(1, "key")
+
+    service._remove_from_index([5])
+    store.save(1, "key", service)
+    assert store.version(1, "key") != first
+    # Only the pointer and the current generation are left
+    generation = (tmp_path / "kb_1" / "key.current").read_text()
+    assert {p.name for p in (tmp_path / "kb_1").iterdir()} == {"key.current", generation}
+
+    # A reader that picked up the replaced generation retries with the new one
+    paths = iter([stale])
+    current = store._paths
+    store._paths = lambda kb_id, key: next(paths, None) or current(kb_id, key)
+    loaded = BaseRAGService("http://agent", "m", "flat")
+    assert store.load(1, "key", loaded)
+    assert 5 not in loaded.chunks and loaded.lexical.search("chunk 5", 1)[0][0] != 5
+
+    store.delete(1, "key")
+    assert not store.exists(1, "key") and not any((tmp_path / "kb_1").iterdir())
+
+
+def test_flat_files_of_older_stores_load_and_are_replaced(tmp_path):
+    store = IndexStore(str(tmp_path))
+    service = make_service("flat")
+    kb_dir = tmp_path / "kb_1"
+    kb_dir.mkdir()
+    faiss.write_index(service.index, str(kb_dir / "key.faiss"))
+    (kb_dir / "key.chunks.json").write_text(json.dumps(list(service.chunks.items())))
+
+    loaded = BaseRAGService("http://agent", "m", "flat")
+    assert store.version(1, "key") is not None
+    assert store.load(1, "key", loaded) and loaded.chunks == service.chunks
+    store.save(1, "key", loaded)
+    assert not (kb_dir / "key.faiss").exists() and not (kb_dir / "key.chunks.json").exists()
+    assert store.load(1, "key", BaseRAGService("http://agent", "m", "flat"))
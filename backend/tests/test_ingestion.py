@@ -0,0 +1,136 @@
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import select, update
+
+from app.config import settings
+from app.database import async_session_maker
+from app.models import KnowledgeBase, KnowledgeBaseChunk
+from app.services.index_cache import IndexCache
+from app.services.index_store import IndexStore, index_store
+from app.services.ingestion import IngestionQueue, _utcnow, ingestion_queue
+from app.services.rag_service import BaseRAGService
+from conftest import _wait_ready
+
+
+def _set(client, kb_id, **values):
+    async def run():
+        async with async_session_maker() as db:
+            await db.execute(update(KnowledgeBase).where(KnowledgeBase.id == kb_id).values(**values))
+            await db.commit()
+
+    client.portal.call(run)
+
+
+def _claim(client, kb_id):
+    return client.portal.call(IngestionQueue._claim, kb_id)
+
+
+def test_only_one_worker_claims_a_pending_knowledge_base(client, make_kb):
+    kb_id = make_kb("Valves are inspected monthly.")
+    assert not _claim(client, kb_id)  # ready
+
+    _set(client, kb_id, index_status="pending")
+    assert _claim(client, kb_id)
+    assert not _claim(client, kb_id)
+
+    # A claim left behind by a crashed worker lapses
+    _set(client, kb_id, update_datetime=_utcnow() - timedelta(hours=1))
+    assert _claim(client, kb_id)
+    _set(client, kb_id, index_status="ready")
+
+
+def test_queued_job_losing_the_claim_is_dropped(client, make_kb):
+    kb_id = make_kb("Filters are replaced yearly.")
+    _set(client, kb_id, index_status="indexing", update_datetime=_utcnow())
+    queue = IngestionQueue()
+    job = queue.enqueue(kb_id)
+    client.portal.call(queue._ingest, job)
+    assert queue.get(kb_id) is None
+    _set(client, kb_id, index_status="ready")
+
+
+def test_cached_index_is_dropped_once_the_stored_one_changes(tmp_path):
+    store, cache = IndexStore(str(tmp_path)), IndexCache(1 << 30)
+    service = BaseRAGService("http://agent", "m", "flat")
+    service._set_index([1], ["chunk"], np.ones((1, 4), dtype="float32"))
+    store.save(1, "key", service)
+    version = store.version(1, "key")
+    cache.put(1, service, version)
+    assert cache.get(1, version) is service
+
+    service._remove_from_index([1])
+    store.save(1, "key", service)
+    assert store.version(1, "key") != version
+    assert cache.get(1, store.version(1, "key")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def _stored_and_rows(client, kb_id):
+    """Chunk ids of the stored index, and of the knowledge base's chunk rows"""
+    async def run():
+        async with async_session_maker() as db:
+            kb = await db.get(KnowledgeBase, kb_id)
+            rows = set((await db.execute(
+                select(KnowledgeBaseChunk.id).where(KnowledgeBaseChunk.kb_id == kb_id)
+            )).scalars().all())
+            key = index_store.key(kb.embedding_model, kb.chunk_size, kb.chunk_overlap, kb.index_type, kb.chunker)
+        service = BaseRAGService("http://agent", kb.embedding_model, kb.index_type)
+        assert index_store.load(kb_id, key, service, writable=True)
+        return set(service.chunks), rows, service, key
+
+    return client.portal.call(run)
+
+
+def _sync(client, kb_id):
+    _set(client, kb_id, index_status="pending")
+    client.portal.call(_enqueue, kb_id)
+    _wait_ready(client, kb_id)
+
+
+async def _enqueue(kb_id):
+    ingestion_queue.enqueue(kb_id)
+
+
+SENTENCES = " ".join(f"Sentence number {i} describes step {i} of the procedure." for i in range(12))
+
+
+def test_documents_are_synced_incrementally_in_slices(client, make_kb, ollama, monkeypatch):
+    monkeypatch.setattr(settings, "rag_embed_batch_size", 2)
+    monkeypatch.setattr(settings, "rag_embed_concurrency", 1)
+    kb_id = make_kb(SENTENCES, chunker="characters", chunk_size=80, chunk_overlap=10)
+    first, rows, _, _ = _stored_and_rows(client, kb_id)
+    assert first == rows and len(first) > 4
+
+    calls = ollama.calls["embed"]
+    response = client.post(
+        f"/api/rag/{kb_id}/documents", files={"file": ("more.txt", SENTENCES.upper().encode())}
+    )
+    assert response.status_code == 200
+    document_id = response.json()["id"]
+    _wait_ready(client, kb_id)
+    stored, rows, _, _ = _stored_and_rows(client, kb_id)
+    added = stored - first
+    assert stored == rows and first < stored
+    # Only the new document is embedded, two chunks per call
+    assert ollama.calls["embed"] - calls == -(-len(added) // 2)
+
+    calls = ollama.calls["embed"]
+    assert client.delete(f"/api/rag/{kb_id}/documents/{document_id}").status_code == 200
+    _wait_ready(client, kb_id)
+    stored, rows, _, _ = _stored_and_rows(client, kb_id)
+    assert stored == rows == first
+    assert ollama.calls["embed"] == calls
+
+
+def test_sync_redoes_a_document_whose_vectors_were_never_saved(client, make_kb):
+    kb_id = make_kb(SENTENCES, chunker="characters", chunk_size=80, chunk_overlap=10)
+    stored, rows, service, key = _stored_and_rows(client, kb_id)
+    # As if the process died after committing chunk rows but before saving the index
+    lost = sorted(stored)[-2:]
+    service._remove_from_index(lost)
+    index_store.save(kb_id, key, service)
+
+    _sync(client, kb_id)
+    stored, rows, _, _ = _stored_and_rows(client, kb_id)
+    assert stored == rows and len(stored) == len(lost) + len(service.chunks)
@@ -0,0 +1,34 @@
+from fastapi.testclient import TestClient
+
+from app.services.metrics import MetricsRegistry
+
+
+def test_collector_families_are_rendered_contiguously():
+    registry = MetricsRegistry()
+
+    @registry.collector
+    def samples():
+        for cache in ("a", "b"):
+            yield ("lookups_total", "counter", "Lookups", {"cache": cache}, 1)
+            yield ("entries", "gauge", "Entries", {"cache": cache}, 2)
+
+    lines = registry.render().splitlines()
+    assert lines == [
+        "# HELP lookups_total Lookups",
+        "# TYPE lookups_total counter",
+        'lookups_total{cache="a"} 1',
+        'lookups_total{cache="b"} 1',
+        "# HELP entries Entries",
+        "# TYPE entries gauge",
+        'entries{cache="a"} 2',
+        'entries{cache="b"} 2',
+    ]
+
+
+def test_metrics_require_an_admin_session(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE cache_entries gauge" in response.text
+
+    anonymous = TestClient(client.app)
+    assert anonymous.get("/metrics").status_code == 401
@@ -0,0 +1,87 @@
+import pytest
+from sqlalchemy import delete, select
+
+from app.database import async_session_maker
+from app.models import Chat, Message, ModelStatsBucket, ModelStatsDaily
+from app.services import model_stats as model_stats_module
+from app.services.model_stats import model_stats
+
+
+def _reply(prompt_tokens, seconds=3.0):
+    return Message(
+        role="assistant", message="hi", model="stats-model", agent_id=99,
+        total_duration=int(seconds * 1e9), load_duration=0, prompt_eval_count=prompt_tokens,
+        eval_count=20, eval_duration=1_000_000_000,
+    )
+
+
+@pytest.mark.parametrize("native_upsert", [True, False])
+def test_replies_are_folded_into_existing_rows(client, monkeypatch, native_upsert):
+    if not native_upsert:
+        # The per-row path used on databases without ON CONFLICT
+        monkeypatch.setattr(model_stats_module, "_UPSERT_INSERTS", {})
+
+    async def run():
+        async with async_session_maker() as db:
+            await db.execute(delete(ModelStatsBucket).where(ModelStatsBucket.agent_id == 99))
+            await db.execute(delete(ModelStatsDaily).where(ModelStatsDaily.agent_id == 99))
+            await model_stats.record(db, [_reply(300), _reply(100, 2.5)])
+            await model_stats.record(db, [_reply(200, 3.5)])
+            await db.commit()
+            daily = (await db.execute(
+                select(ModelStatsDaily).where(ModelStatsDaily.agent_id == 99)
+            )).scalars().all()
+            latency = (await db.execute(
+                select(ModelStatsBucket.count, ModelStatsBucket.min_value, ModelStatsBucket.max_value)
+                .where(ModelStatsBucket.agent_id == 99, ModelStatsBucket.metric == "latency_ms")
+            )).all()
+            return daily, latency
+
+    daily, latency = client.portal.call(run)
+    assert len(daily) == 1
+    assert daily[0].messages == 3
+    assert daily[0].prompt_eval_count_sum == 600
+    assert daily[0].prompt_eval_count_max == 300
+    assert [tuple(row) for row in latency] == [(3, 2500.0, 3500.0)]
+
+
+def test_report_percentiles_stay_within_the_observed_values(client):
+    # Latency 120/130/200/3000 ms; every reply runs at 1e7 tokens/s on a 5-token prompt,
+    # like the fake agent, far outside the first and last bucket bounds
+    latencies_ms = [120, 130, 200, 3000]
+
+    def replies(chat_id):
+        return [
+            Message(
+                chat_id=chat_id, role="assistant", message="hi", model="stats-known",
+                agent_id=client.agent_id, total_duration=ms * 1_000_000, load_duration=0,
+                prompt_eval_count=5, eval_count=2, eval_duration=200,
+            )
+            for ms in latencies_ms
+        ]
+
+    async def run():
+        async with async_session_maker() as db:
+            chat = Chat(name="stats", user_id=1, agent_id=client.agent_id, model_name="stats-known")
+            db.add(chat)
+            await db.flush()
+            db.add_all(replies(chat.id))
+            await db.commit()
+            await model_stats.rebuild(db)
+            rebuilt = await model_stats.report(db, model_name="stats-known", by_day=False)
+
+            for table in (ModelStatsBucket, ModelStatsDaily):
+                await db.execute(delete(table).where(table.model_name == "stats-known"))
+            await model_stats.record(db, replies(chat.id))
+            await db.commit()
+            recorded = await model_stats.report(db, model_name="stats-known", by_day=False)
+            return rebuilt, recorded
+
+    rebuilt, recorded = client.portal.call(run)
+    assert rebuilt == recorded
+    [row] = recorded
+    assert row["messages"] == 4
+    # p50 falls in the 100-250 ms bucket, spread over its values 120..200
+    assert row["latency_ms"] == {"avg": 862.5, "p50": 173.3, "p95": 3000.0}
+    assert row["tokens_per_second"] == {"avg": 1e7, "p50": 1e7, "p95": 1e7}
+    assert row["prompt_tokens"] == {"avg": 5.0, "p95": 5.0, "max": 5}
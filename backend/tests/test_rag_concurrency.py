@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services.scheduler import agent_scheduler
+
+
+@pytest.fixture
+def two_slots(monkeypatch):
+    monkeypatch.setattr(agent_scheduler, "max_concurrent", 2)
+    monkeypatch.setattr(agent_scheduler, "queue_timeout", 20)
+
+
+def _query(client, kb_id, text):
+    return client.post("/api/rag/query", json={
+        "kb_id": kb_id, "agent_id": client.agent_id, "model_name": "m", "query": text,
+    })
+
+
+def test_concurrent_rag_queries_do_not_deadlock(client, ollama, make_kb, two_slots, monkeypatch):
+    kb_id = make_kb("Pumps need new seals every two years. Error codes are listed in the manual.")
+    # Chats hold their agent slot long enough for every query to overlap
+    monkeypatch.setattr(ollama, "chat_delay", 0.3)
+
+    with ThreadPoolExecutor(4) as pool:
+        responses = list(pool.map(lambda n: _query(client, kb_id, f"question {n}"), range(4)))
+
+    assert [r.status_code for r in responses] == [200] * 4
+    assert all('"done": true' in r.text for r in responses)
+    agents = agent_scheduler.stats()["agents"]
+    assert all(a["active"] == 0 and a["queued"] == 0 for a in agents.values())
+
+    # The agent still serves plain chats afterwards
+    monkeypatch.setattr(ollama, "chat_delay", 0)
+    response = client.post("/api/chat/send_message", json={
+        "agent_id": client.agent_id, "model_name": "m", "message": "hi",
+    })
+    assert response.status_code == 200
+    assert '"done": true' in response.text
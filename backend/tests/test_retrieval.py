@@ -0,0 +1,75 @@
+import numpy as np
+
+from app.services.bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+from app.services.rag_service import BaseRAGService, maximal_marginal_relevance
+
+TEXTS = [
+    "Replace the pump seals every two years.",
+    "Error ERR-4021 means the inlet valve is stuck.",
+    "The pump pressure should stay below 6 bar.",
+    "Valves are inspected monthly by the night shift.",
+]
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    tokens = tokenize("See ERR-4021 in config.yaml, v1.2")
+    assert "err-4021" in tokens and "err" in tokens and "4021" in tokens
+    assert "config.yaml" in tokens and "v1.2" in tokens
+
+
+def test_bm25_ranks_rare_exact_terms_first():
+    index = BM25Index.build([10, 11, 12, 13], TEXTS)
+    assert index.search("ERR-4021", 2)[0][0] == 11
+    ranked = [i for i, _ in index.search("pump", 4)]
+    assert set(ranked) == {10, 12}
+
+
+def test_bm25_add_remove_and_state_round_trip():
+    index = BM25Index.build([10, 11], TEXTS[:2])
+    index.add([12, 13], TEXTS[2:])
+    index.remove([11])
+    assert len(index) == 3
+    assert index.search("ERR-4021", 3) == []
+    restored = BM25Index.from_state(index.state())
+    assert restored.search("valves monthly", 3) == index.search("valves monthly", 3)
+    assert restored.search("valves monthly", 1)[0][0] == 13
+
+
+def test_bm25_slices_merge_into_the_same_postings_as_one_build():
+    rng = np.random.default_rng(0)
+    texts = [" ".join(f"w{t}" for t in rng.integers(0, 300, rng.integers(1, 40))) for _ in range(1000)]
+    whole = BM25Index.build(range(1000), texts)
+    sliced = BM25Index()
+    for start in range(0, 1000, 137):
+        sliced.add(range(start, min(start + 137, 1000)), texts[start:start + 137])
+    for name in ("ids", "lengths", "offsets", "rows", "tfs"):
+        np.testing.assert_array_equal(getattr(sliced, name), getattr(whole, name))
+    assert sliced.search("w1 w2 w3", 10) == whole.search("w1 w2 w3", 10)
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [4, 2, 5]], k=60)
+    ids = [i for i, _ in fused]
+    assert ids[0] == 2 and set(ids) == {1, 2, 3, 4, 5}
+    assert [s for _, s in fused] == sorted((s for _, s in fused), reverse=True)
+
+
+def test_mmr_skips_near_duplicates():
+    query = np.array([1.0, 0.0, 0.0])
+    vectors = np.array([[1.0, 0.1, 0.0], [1.0, 0.11, 0.0], [0.7, 0.0, 0.7], [0.0, 1.0, 0.0]])
+    assert maximal_marginal_relevance(query, vectors, 2) == [0, 2]
+    # With lambda 1 it is plain relevance order
+    assert maximal_marginal_relevance(query, vectors, 2, lambda_=1.0) == [0, 1]
+
+
+def test_hybrid_search_finds_exact_identifier_match():
+    rng = np.random.default_rng(0)
+    service = BaseRAGService("http://agent", "m", "flat")
+    embeddings = rng.standard_normal((len(TEXTS), 8)).astype("float32")
+    service._set_index([10, 11, 12, 13], TEXTS, embeddings)
+    # The query embedding is nearest to chunk 10, but its text names chunk 11's error code
+    query = embeddings[0] + 0.01
+    dense_only = [chunk for chunk, _ in service._search(query, 1)]
+    hybrid = [chunk for chunk, _ in service._search(query, 2, query="ERR-4021")]
+    assert dense_only == [TEXTS[0]]
+    assert TEXTS[1] in hybrid
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from app.services.scheduler import AgentScheduler, QueueFull, QueueTimeout
+
+URL = "http://agent"
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_slots_are_limited_and_handed_on_release():
+    async def main():
+        scheduler = AgentScheduler(max_concurrent=2)
+        tickets = [scheduler.enqueue(URL, "u") for _ in range(3)]
+        assert [t.admitted for t in tickets] == [True, True, False]
+        scheduler.release(tickets[0])
+        assert tickets[2].admitted
+        assert scheduler.stats()["agents"][URL] == {"active": 2, "queued": 0, "users_waiting": 0}
+
+    run(main())
+
+
+def test_waiting_users_are_served_round_robin():
+    async def main():
+        scheduler = AgentScheduler(max_concurrent=1, max_queued_per_user=8)
+        running = scheduler.enqueue(URL, "a")
+        burst = [scheduler.enqueue(URL, "a") for _ in range(3)]
+        other = scheduler.enqueue(URL, "b")
+        assert scheduler.position(other) == 1
+        scheduler.release(running)
+        scheduler.release(burst[0])
+        # b's single request goes before the rest of a's burst
+        assert other.admitted and not burst[1].admitted
+
+    run(main())
+
+
+def test_queue_limits_refuse_up_front():
+    async def main():
+        scheduler = AgentScheduler(max_concurrent=1, max_queued=3, max_queued_per_user=2)
+        scheduler.enqueue(URL, "a")
+        scheduler.admit([URL], "a")
+        scheduler.admit([URL], "a")
+        with pytest.raises(QueueFull):
+            scheduler.admit([URL], "a")
+        scheduler.admit([URL], "b")
+        with pytest.raises(QueueFull):
+            scheduler.pick([URL], "c")
+        assert scheduler.rejected == 2
+
+    run(main())
+
+
+def test_pick_does_not_take_a_slot():
+    async def main():
+        scheduler = AgentScheduler(max_concurrent=1)
+        assert scheduler.pick(["http://busy", URL], "u") == "http://busy"
+        assert scheduler.load("http://busy") == 0
+
+    run(main())
+
+
+def test_released_waiting_ticket_leaves_the_queue():
+    async def main():
+        scheduler = AgentScheduler(max_concurrent=1)
+        running = scheduler.enqueue(URL, "u")
+        waiting = scheduler.enqueue(URL, "u")
+        scheduler.release(waiting)
+        assert scheduler.load(URL) == 1
+        scheduler.release(running)
+        assert scheduler.load(URL) == 0
+
+    run(main())
+
+
+def test_slot_times_out_and_frees_its_place():
+    async def main():
+        scheduler = AgentScheduler(max_concurrent=1, queue_timeout=0.05)
+        running = scheduler.enqueue(URL, "chat")
+        with pytest.raises(QueueTimeout):
+            async with scheduler.slot(URL, "embed"):
+                pass
+        assert scheduler.load(URL) == 1
+        scheduler.release(running)
+        async with scheduler.slot(URL, "embed"):
+            assert scheduler.load(URL) == 1
+        assert scheduler.load(URL) == 0
+
+    run(main())
+
+
+def test_cancelled_slot_wait_is_released():
+    async def main():
+        scheduler = AgentScheduler(max_concurrent=1)
+        running = scheduler.enqueue(URL, "a")
+
+        async def use_slot():
+            async with scheduler.slot(URL, "b"):
+                pass
+
+        task = asyncio.create_task(use_slot())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.load(URL) == 1
+        scheduler.release(running)
+        assert scheduler.load(URL) == 0
+
+    run(main())
@@ -0,0 +1,66 @@
+import pytest
+from sqlalchemy import update
+
+from app.database import async_session_maker
+from app.models import SystemSettings
+from app.services.system_settings import SystemSettingsCache, system_settings
+
+
+@pytest.fixture(autouse=True)
+def restore_settings(client):
+    """Leave no test prompt active for later tests"""
+    yield
+
+    async def deactivate():
+        async with async_session_maker() as db:
+            await db.execute(update(SystemSettings).values(active=False))
+            await db.commit()
+            await system_settings.load(db)
+
+    client.portal.call(deactivate)
+
+
+def _update(client, prompt):
+    response = client.post("/api/system/settings", json={"rag_prompt": prompt})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_update_bumps_the_version_and_is_served_at_once(client):
+    before = system_settings.version
+    assert _update(client, "prompt one") == {"rag_prompt": "prompt one"}
+    assert system_settings.version > before
+    assert client.get("/api/system/settings").json() == {"rag_prompt": "prompt one"}
+
+
+def test_other_workers_pick_up_changes_after_the_check_interval(client):
+    # A second worker: its own cache, reading through its own sessions
+    worker = SystemSettingsCache(check_interval=60)
+
+    async def read():
+        async with async_session_maker() as db:
+            return await worker.get(db, "rag_prompt"), worker.version
+
+    _update(client, "prompt two")
+    value, version = client.portal.call(read)
+    assert value == "prompt two" and version == system_settings.version
+
+    _update(client, "prompt three")
+    # Within the interval the cached value is served without a query
+    assert client.portal.call(read) == ("prompt two", version)
+    worker._checked_at -= 60
+    assert client.portal.call(read) == ("prompt three", system_settings.version)
+
+
+def test_rows_written_by_another_session_are_reloaded(client, monkeypatch):
+    monkeypatch.setattr(system_settings, "check_interval", 0)
+    _update(client, "prompt four")
+
+    async def write_elsewhere():
+        async with async_session_maker() as db:
+            db.add(SystemSettings(user_id=1, setting_name="rag_prompt", setting_value="prompt five", active=True))
+            await db.commit()
+
+    client.portal.call(write_elsewhere)
+    # Both rows are active now; the newer one wins
+    assert client.get("/api/system/settings").json() == {"rag_prompt": "prompt five"}
@@ -17,6 +17,8 @@ export async function load({ url, fetch }) {
 
   const chatsRes = await fetch('/api/chats', { credentials: 'include' }).catch(() => null);
   const chats = chatsRes?.ok ? await chatsRes.json().catch(() => []) : [];
+  // Set when the user has more chats than one page; the sidebar loads them on demand
+  const chatsCursor = chatsRes?.ok ? chatsRes.headers.get('X-Next-Cursor') : null;
 
-  return { user, chats };
+  return { user, chats, chatsCursor };
 }